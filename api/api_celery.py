@@ -6,7 +6,12 @@ from fastapi import (
 )
 from api.prometheus_metrics import PrometheusMetrics
 from fastapi.security.api_key import APIKey, APIKeyHeader
-from schemas.schema import CeleryImageClassification, CelerySuggestion
+from schemas.schema import (
+    CeleryImageClassification, 
+    CelerySuggestion, 
+    CeleryTaskResp, 
+    CeleryTaskStatus
+)
 from logger.logging_config import setup_logging
 from broker import tasks
 import os
@@ -42,16 +47,44 @@ async def root():
 
     return {"message": "I'm alive!"}
 
-@app.post(f"/{PREFIX}/task_image_classification")
+@app.post(f"/{PREFIX}/task_image_classification", response_model=CeleryTaskResp)
 async def task_image_classification(request: CeleryImageClassification,
                                     api_key: APIKey = Depends(get_api_key)):
+    """
+    Dispatches the identify_clothes task to the Celery workers.
+
+    Returns:
+        CeleryTaskResp: The ID of the task, to be used with task_status.
+    """
     logger.info("Starting task_image_classification")
     
-    tasks.identify_clothes(request.id, request.images)
+    task = tasks.identify_clothes.delay(request.id, request.images)
     
-    logger.info("Finished task_image_classification")
+    logger.info(f"Dispatched task_image_classification: {task.id}")
     
-    return True
+    return {"task_id": task.id}
+
+@app.get(f"/{PREFIX}/task_status/{{task_id}}", response_model=CeleryTaskStatus)
+async def task_status(task_id: str,
+                      api_key: APIKey = Depends(get_api_key)):
+    """
+    Retrieves the status of a task dispatched by task_image_classification.
+
+    Args:
+        task_id (str): The ID returned by task_image_classification.
+
+    Returns:
+        CeleryTaskStatus: The Celery state of the task (PENDING, STARTED,
+            SUCCESS, FAILURE...) and its result once it is ready.
+    """
+    task = tasks.app.AsyncResult(task_id)
+
+    response = {"task_id": task_id, "status": task.status, "result": None}
+    if task.ready():
+        # A failed task holds the raised exception as result
+        response["result"] = task.result if task.successful() else str(task.result)
+
+    return response
 
 @app.get(f"/{PREFIX}/get_suggestions")
 async def get_suggestions(request: CelerySuggestion = Depends(),
@@ -5,28 +5,60 @@ from fastapi import (
     Security, 
     File, 
     UploadFile, 
-    Form
+    Form,
+    Header
 )
 from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security.api_key import APIKey, APIKeyHeader
 from models.object_detection import object_detection_model
 from models.face_detection import face_detection_model
 from models.segmentation import segmentation_model
 from models.classification import classification_model
+from models import inference
 from logger.logging_config import setup_logging
 from api.prometheus_metrics import PrometheusMetrics
+from api.result_cache import ResultCache
+from api.inference_scheduler import (
+    InferenceScheduler, 
+    InferenceQueueFull, 
+    call_each
+)
 from utils import utils_image
+from utils.utils_cache import LRUCache
+from PIL import Image
+import numpy as np
+import requests
+import base64
 import os
+import io
 import json
 
 PREFIX = os.getenv("MODELS_API_ENDPOINT")
 API_KEY = os.getenv("MODELS_API_KEY")
 TEMP_DIR = os.getenv("IMAGE_TMP_DIR")
+CLASSIFICATION_BATCH_SIZE = int(os.getenv("CLASSIFICATION_BATCH_SIZE", 32))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", 64))
+
+#DB
+SERVER = os.getenv("PG_API_SERVER")
+PORT = os.getenv("PG_API_PORT")
+ENDPOINT = os.getenv("PG_API_ENDPONT")
+
+PG_URI = f"http://{SERVER}:{PORT}/{ENDPOINT}"
+PG_API_KEY = os.getenv("PG_API_KEY")
+
+# Face encodings of the client FaceIDs, by client ID
+face_encodings = LRUCache(
+    max_size=int(os.getenv("FACE_ENCODING_CACHE_SIZE", 1024)),
+    ttl=int(os.getenv("FACE_ENCODING_CACHE_TTL", 3600)))
 
 logger = setup_logging(__name__)
 
 
 # Model Instantiation
+inference.configure_torch()
+
 logger.info("Loading Object Detection Model")
 try:
     object_detection = object_detection_model.ObjectDetection(
@@ -61,6 +93,130 @@ except Exception as e:
     logger.error(f"Error loading classification model: {e}")
     raise
 
+logger.info("Loading Classification Text Features")
+try:
+    # Encode the prompts of the DB taxonomy once, ahead of the first request
+    response = requests.get(f"{PG_URI}/taxonomy/", 
+                            headers={"access_token": PG_API_KEY},
+                            timeout=10)
+    response.raise_for_status()
+    taxonomy = response.json()
+
+    classification.load_text_features({
+        'id_gender': [x['gender'] for x in taxonomy['genders']],
+        'id_season': [x['name'] for x in taxonomy['seasons']],
+        'id_color': [x['name'] for x in taxonomy['colors']],
+        'id_usagetype': [x['name'] for x in taxonomy['usage_types']],
+        'id_articletype': [x['name'] for x in taxonomy['article_types']]
+    })
+except Exception as e:
+    # Not fatal, the prompts will be encoded on their first use
+    logger.warning(f"Error loading classification text features: {e}")
+
+def decoding_image(function):
+    """
+    Wraps a model method taking a PIL image as first argument so that it
+    takes the encoded image bytes instead, the image being decoded in the
+    worker thread of the scheduler rather than in the event loop.
+    """
+    def decode_and_call(image_bytes: bytes, *args):
+        return function(utils_image.open_rgb_image(io.BytesIO(image_bytes)), *args)
+
+    return decode_and_call
+
+def encoding_images(function):
+    """
+    Wraps a model method returning a list of PIL images so that it returns
+    them encoded, in the worker thread of the scheduler. The encoded images
+    are what the result caches hold.
+    """
+    def call_and_encode(*args):
+        return [utils_image.convert_pil_to_bytes(
+                    image, quality=utils_image.IMAGE_STREAM_QUALITY)
+                for image in function(*args)]
+
+    return call_and_encode
+
+def crop_single_clothe(image: Image.Image) -> list[Image.Image]:
+    return [segmentation.crop_clothe_from_image(image)]
+
+def classify_batch(batch):
+    """
+    Batch function of the classification scheduler: each request holds a
+    categories dict and a list of images. The images of the requests sharing
+    the same categories are classified together.
+    """
+    requests_by_categories = {}
+    for index, (categories_dict, _) in enumerate(batch):
+        key = json.dumps(categories_dict, sort_keys=True)
+        requests_by_categories.setdefault(key, []).append(index)
+
+    results = [None] * len(batch)
+    for indexes in requests_by_categories.values():
+        categories_dict = batch[indexes[0]][0]
+        images = [image for index in indexes for image in batch[index][1]]
+        try:
+            images = [utils_image.open_rgb_image(io.BytesIO(image)) 
+                      if isinstance(image, bytes) else image
+                      for image in images]
+            categories = classification.classify_images(
+                categories_dict,
+                images,
+                CLASSIFICATION_BATCH_SIZE)
+        except Exception as e:
+            for index in indexes:
+                results[index] = e
+            continue
+
+        # Give back its own images results to each request
+        offset = 0
+        for index in indexes:
+            n_images = len(batch[index][1])
+            results[index] = categories[offset:offset + n_images]
+            offset += n_images
+
+    return results
+
+# Inference schedulers, each model runs in its own worker threads
+object_detection_scheduler = InferenceScheduler(
+    "object_detection", 
+    call_each,
+    workers=int(os.getenv("OBJ_DETECTION_WORKERS", 1)),
+    max_queue_size=INFERENCE_QUEUE_SIZE)
+face_recognition_scheduler = InferenceScheduler(
+    "face_detection", 
+    call_each,
+    workers=int(os.getenv("FACE_DETECTION_WORKERS", 2)),
+    max_queue_size=INFERENCE_QUEUE_SIZE)
+segmentation_scheduler = InferenceScheduler(
+    "segmentation", 
+    call_each,
+    workers=int(os.getenv("SEGMENTATION_WORKERS", 2)),
+    max_queue_size=INFERENCE_QUEUE_SIZE)
+classification_scheduler = InferenceScheduler(
+    "classification",
+    classify_batch,
+    max_batch_size=int(os.getenv("CLASSIFICATION_SCHEDULER_BATCH_SIZE", 8)),
+    max_wait_ms=float(os.getenv("CLASSIFICATION_SCHEDULER_WAIT_MS", 10)),
+    workers=int(os.getenv("CLASSIFICATION_WORKERS", 1)),
+    max_queue_size=INFERENCE_QUEUE_SIZE)
+
+# Result caches by content hash, versioned by the model and the settings
+# changing its results
+object_detection_cache = ResultCache(
+    "object_detection",
+    f"{os.getenv('OBJ_DETECTION_MODEL_NAME')}:{object_detection.max_side}")
+segmentation_cache = ResultCache(
+    "segmentation",
+    f"{os.getenv('SEGMENTATION_MODEL_NAME')}:{segmentation.max_side}:"
+    f"{segmentation.background_removal}")
+single_segmentation_cache = ResultCache(
+    "single_segmentation",
+    f"{os.getenv('SEGMENTATION_MODEL_NAME')}:{segmentation.max_side}")
+classification_cache = ResultCache(
+    "classification",
+    os.getenv("CLASSIFICATION_MODEL_NAME"))
+
 # API Instatiation
 app = FastAPI()
 metrics = PrometheusMetrics()
@@ -90,6 +246,134 @@ async def get_api_key(api_key_header: str = Security(api_key_header)) -> str:
             detail="Could not validate API KEY"
         )
 
+def busy_exception(e: InferenceQueueFull) -> HTTPException:
+    """
+    Builds the 503 response returned when a model queue is full, so the 
+    caller retries later instead of waiting behind an overloaded model.
+    """
+    logger.warning(f"Rejecting request: {e}")
+    return HTTPException(
+        status_code=503,
+        detail="The models are busy, please retry later.",
+        headers={"Retry-After": "1"}
+    )
+
+async def classify_images(categories_dict: dict, images: list[bytes]) -> list[dict]:
+    """
+    Classifies encoded images, each one being looked up in the 
+    classification cache first (keyed by the image bytes and the JSON of the
+    categories). Only the misses are queued, in a single batch.
+
+    Args:
+        categories_dict (dict): The categories to match.
+        images (list[bytes]): The encoded images.
+
+    Returns:
+        list[dict]: The categories that best match each image, in the same
+            order as the images.
+
+    Raises:
+        InferenceQueueFull: If the classification queue is full.
+    """
+    categories_key = json.dumps(categories_dict, sort_keys=True)
+    lookups = await run_in_threadpool(
+        lambda: [classification_cache.lookup(image, categories_key) 
+                 for image in images])
+
+    categories = [category for _, category in lookups]
+    misses = [index for index, category in enumerate(categories) 
+              if category is None]
+    if misses:
+        results = await classification_scheduler.run(
+            categories_dict,
+            [images[index] for index in misses])
+        for index, category in zip(misses, results):
+            categories[index] = category
+
+        await run_in_threadpool(
+            lambda: [classification_cache.set(lookups[index][0], categories[index]) 
+                     for index in misses])
+
+    return categories
+
+def fetch_face_encoding(id_client: int):
+    """
+    Fetches the face encoding of a client from the DB API, or its FaceID
+    image when the encoding has not been computed yet.
+
+    Args:
+        id_client (int): The client ID.
+
+    Returns:
+        tuple[np.ndarray | None, bytes | None]: The face encoding, or the 
+            encoded FaceID image. Both are None if the client has no FaceID.
+    """
+    header = {"access_token": PG_API_KEY}
+    response = requests.get(f"{PG_URI}/get_face_encoding?id_client={id_client}",
+                            headers=header,
+                            timeout=10)
+    if response.status_code == 404:
+        return None, None
+    response.raise_for_status()
+
+    encoding = response.json()["encoding"]
+    if encoding is not None:
+        return np.array(encoding), None
+
+    response = requests.get(f"{PG_URI}/get_faceid?id_client={id_client}",
+                            headers=header,
+                            timeout=10)
+    response.raise_for_status()
+
+    return None, base64.b64decode(response.json()["images"])
+
+async def get_client_face_encoding(id_client: int) -> np.ndarray:
+    """
+    Returns the face encoding of a client FaceID, from the in-process LRU
+    cache or, on a miss, from the DB API.
+
+    Args:
+        id_client (int): The client ID.
+
+    Returns:
+        np.ndarray: The face encoding.
+
+    Raises:
+        HTTPException: If the client has no FaceID (404), no face is found
+            in it (400), or the encoding could not be retrieved.
+    """
+    face_encoding = face_encodings.get(id_client)
+    if face_encoding is not None:
+        return face_encoding
+
+    try:
+        face_encoding, face_id_bytes = await run_in_threadpool(
+            fetch_face_encoding, id_client)
+
+        # FaceID uploaded before the encodings were stored
+        if face_encoding is None and face_id_bytes is not None:
+            face_encoding = await face_recognition_scheduler.run(
+                face_recognition.encode_face_id, io.BytesIO(face_id_bytes))
+    except InferenceQueueFull as e:
+        raise busy_exception(e)
+    except IndexError:
+        raise HTTPException(
+            status_code=400,
+            detail="Could not find any face in the FaceID."
+        )
+    except Exception as e:
+        logger.error(f"Error retrieving the face encoding of client {id_client}: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Something went wrong, please contact the administrator."
+        )
+
+    if face_encoding is None:
+        raise HTTPException(status_code=404, detail="FaceId not found.")
+
+    face_encodings.set(id_client, face_encoding)
+    return face_encoding
+
 @app.get("/")
 async def root() -> dict:
     """
@@ -106,6 +390,7 @@ async def root() -> dict:
 @app.post(f"/{PREFIX}/object_detection")
 async def crop_object_image(image: UploadFile = File(...),
                       category_to_detect: str = Form(...),
+                      accept: str | None = Header(default=None),
                       api_key: APIKey = Depends(get_api_key)):
     """
     Perform object detection on the given image and detect the given object type.
@@ -113,62 +398,152 @@ async def crop_object_image(image: UploadFile = File(...),
     Args:
         image (UploadFile): The image to detect the object in.
         category_to_detect (str): The type of object to detect.
+        accept (str): The Accept header, application/x-image-stream 
+            to get the images as a binary stream instead of base64.
 
     Returns:
         dict: A dictionary with a single key-value pair. The key is "images" and
             the value is a list of base64 encoded images with the detected object
             cropped out.
     """
-    # Convert the image file to a base64 encoded string
-    image_base64 = await utils_image.convert_image_to_base64(image)
+    image_bytes = await image.read()
+
+    cache_key, returned_images = await run_in_threadpool(
+        object_detection_cache.lookup, image_bytes, category_to_detect)
+
+    if returned_images is None:
+        try:
+            # Perform the object detection
+            returned_images = await object_detection_scheduler.run(
+                encoding_images(decoding_image(object_detection.detect_objects)),
+                image_bytes,
+                category_to_detect)
+        except InferenceQueueFull as e:
+            raise busy_exception(e)
+        except Exception as e:
+            # Log the error if the object detection fails
+            logger.error(f"Error executing object detection model: {e}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Something went wrong, please contact the administrator."
+            )
+
+        await run_in_threadpool(object_detection_cache.set, 
+                                cache_key, returned_images)
+
+    # If no images were detected, return a 204 response
+    if not returned_images:
+        raise HTTPException(
+            status_code=204,
+            detail=f"Could find any {category_to_detect} in the image"
+        )
+
+    return utils_image.encoded_images_response(returned_images, accept)
+
+@app.post(f"/{PREFIX}/face_encoding")
+async def face_encoding(image: UploadFile = File(...),
+                        api_key: APIKey = Depends(get_api_key)):
+    """
+    Computes the encoding of the face of a FaceID. The cached encodings are
+    left untouched, see invalidate_face_encoding.
+
+    Args:
+        image (UploadFile): The FaceID image.
+
+    Returns:
+        dict: A dictionary with the 128-d face "encoding".
+    """
+    image_bytes = await image.read()
 
     try:
-        # Perform the object detection
-        returned_images = object_detection.detection(
-            image_base64,
-            category_to_detect)
+        encoding = await face_recognition_scheduler.run(
+            face_recognition.encode_face_id,
+            io.BytesIO(image_bytes))
+    except InferenceQueueFull as e:
+        raise busy_exception(e)
+    except IndexError:
+        raise HTTPException(
+            status_code=400,
+            detail="Could not find any face in the image."
+        )
     except Exception as e:
-        # Log the error if the object detection fails
-        logger.error(f"Error executing object detection model: {e}")
+        logger.error(f"Error executing face detection model: {e}")
         raise HTTPException(
             status_code=500,
             detail=f"Something went wrong, please contact the administrator."
         )
 
-    # If no images were detected, return a 204 response
-    if returned_images == {"images": []}:
-        raise HTTPException(
-            status_code=204,
-            detail=f"Could find any {category_to_detect} in the image"
-        )
+    return {"encoding": encoding.tolist()}
+
+@app.post(f"/{PREFIX}/invalidate_face_encoding")
+async def invalidate_face_encoding(id_client: int = Form(...),
+                                   api_key: APIKey = Depends(get_api_key)):
+    """
+    Drops the cached face encoding of a client, called by the DB API once 
+    a new FaceID is stored.
+
+    Args:
+        id_client (int): The ID of the client whose FaceID was updated.
+    """
+    face_encodings.invalidate(id_client)
 
-    return returned_images
+    return {"status": "success"}
 
 @app.post(f"/{PREFIX}/face_detection")
-async def face_detection(image: UploadFile = File(...),
-                   images_to_search: UploadFile = File(...),
+async def face_detection(images_to_search: UploadFile = File(...),
+                   image: UploadFile | None = File(default=None),
+                   id_client: int | None = Form(default=None),
+                   return_image: bool = Form(default=True),
+                   accept: str | None = Header(default=None),
                    api_key: APIKey = Depends(get_api_key)):
     """
-    Perform face detection on the given image and detect the given object type.
+    Checks whether the face of a FaceID is found in an image. The FaceID
+    is either uploaded or, given a client ID, the registered FaceID of the
+    client, whose encoding is cached.
+
+    A matching image is returned as it was received, never re-encoded.
 
     Args:
-        image (UploadFile): The image to detect the object in.
         images_to_search (UploadFile): The images to search in.
+        image (UploadFile): The FaceID image.
+        id_client (int): The ID of the client whose FaceID to search, 
+            instead of image.
+        return_image (bool): False to only get whether the face matches, 
+            the caller already holding the image.
+        accept (str): The Accept header, application/x-image-stream 
+            to get the image as a binary stream instead of base64.
 
     Returns:
         dict: A dictionary with a single key-value pair. The key is "images" and
-            the value is a list of base64 encoded images with the detected object
-            cropped out.
+            the value is the base64 encoded searched image, or {"match": True}
+            when return_image is False.
     """
-    # Convert the image files to base64 encoded strings
-    face_id_base64 = await utils_image.convert_image_to_base64(image)
-    unknown_image_b64 = await utils_image.convert_image_to_base64(images_to_search)
+    if image is None and id_client is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Either a FaceID image or a client ID is required.")
+
+    unknown_image_bytes = await images_to_search.read()
+
+    face_encoding = None
+    if id_client is not None:
+        face_encoding = await get_client_face_encoding(id_client)
+    else:
+        face_id_bytes = await image.read()
 
     try:
+        if face_encoding is None:
+            face_encoding = await face_recognition_scheduler.run(
+                face_recognition.encode_face_id,
+                io.BytesIO(face_id_bytes))
+
         # Perform the face detection
-        returned_images = face_recognition.face_recognition(
-            face_id_base64,
-            unknown_image_b64)
+        same_person = await face_recognition_scheduler.run(
+            face_recognition.match_face_image,
+            face_encoding,
+            io.BytesIO(unknown_image_bytes))
+    except InferenceQueueFull as e:
+        raise busy_exception(e)
     except Exception as e:
         # Log the error if the face detection fails
         logger.error(f"Error executing face detection model: {e}")
@@ -178,60 +553,135 @@ async def face_detection(image: UploadFile = File(...),
         )
 
     # If no images were detected, return a 204 response
-    if returned_images == {"images": ''}:
+    if not same_person:
         raise HTTPException(
             status_code=204,
             detail=f"Could not find any relation between those images."
         )
 
+    if not return_image:
+        return {"match": True}
+
+    # The searched image is returned untouched, without decoding it
+    if utils_image.accepts_image_stream(accept):
+        return utils_image.image_stream_response([unknown_image_bytes])
+
+    returned_images = {"images": base64.b64encode(unknown_image_bytes).decode('utf-8')}
+
     return JSONResponse(content=returned_images)
 
 
+@app.post(f"/{PREFIX}/face_detection_batch")
+async def face_detection_batch(images_to_search: list[UploadFile] = File(...),
+                               image: UploadFile | None = File(default=None),
+                               id_client: int | None = Form(default=None),
+                               api_key: APIKey = Depends(get_api_key)):
+    """
+    Checks, for each image of a batch (typically the persons detected in 
+    a picture), whether the face of a FaceID is found in it. The FaceID 
+    encoding is computed (or taken from the cache) once for the batch.
+
+    Args:
+        images_to_search (list[UploadFile]): The images to search in.
+        image (UploadFile): The FaceID image.
+        id_client (int): The ID of the client whose FaceID to search, 
+            instead of image.
+
+    Returns:
+        dict: A dictionary with a single key "matches", whose value is, for
+            each image, whether the face was found in it.
+    """
+    if image is None and id_client is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Either a FaceID image or a client ID is required.")
+
+    unknown_images = [io.BytesIO(await unknown_image.read()) 
+                      for unknown_image in images_to_search]
+
+    face_encoding = None
+    if id_client is not None:
+        face_encoding = await get_client_face_encoding(id_client)
+    else:
+        face_id_bytes = await image.read()
+
+    try:
+        if face_encoding is None:
+            face_encoding = await face_recognition_scheduler.run(
+                face_recognition.encode_face_id,
+                io.BytesIO(face_id_bytes))
+
+        matches = await face_recognition_scheduler.run(
+            face_recognition.match_face_images,
+            face_encoding,
+            unknown_images)
+    except InferenceQueueFull as e:
+        raise busy_exception(e)
+    except Exception as e:
+        logger.error(f"Error executing face detection model: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Something went wrong, please contact the administrator."
+        )
+
+    return {"matches": matches}
+
+
 @app.post(f"/{PREFIX}/single_clothes_segmentation")
 async def single_clothes_segmentation(image: UploadFile = File(...),
+                        accept: str | None = Header(default=None),
                         api_key: APIKey = Depends(get_api_key)):
     """
     Perform single clothes segmentation on the given image.
 
     Args:
         image (UploadFile): The image to detect the clothes in.
+        accept (str): The Accept header, application/x-image-stream 
+            to get the images as a binary stream instead of base64.
 
     Returns:
         dict: A dictionary with a single key-value pair. The key is "images" and
             the value is a list of base64 encoded images with the detected clothes
             cropped out.
     """
-    try:
-        # Convert the image file to a base64 encoded string
-        image_base64 = await utils_image.convert_image_to_base64(image)
-        # Perform the segmentation
-        returned_images = segmentation.crop_clothes(image_base64)
-    except Exception as e:
-        # Log the error if the segmentation fails
-        logger.error(f"Error executing segmentation model: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Something went wrong, please contact the administrator."
-        )
+    image_bytes = await image.read()
 
-    # If no images were detected, return a 204 response
-    if returned_images == {"images": []}:
-        raise HTTPException(
-            status_code=204,
-            detail=f"Could found any clothes in the image."
-        )
+    cache_key, returned_images = await run_in_threadpool(
+        single_segmentation_cache.lookup, image_bytes)
 
-    return returned_images
+    if returned_images is None:
+        try:
+            # Perform the segmentation
+            returned_images = await segmentation_scheduler.run(
+                encoding_images(decoding_image(crop_single_clothe)),
+                image_bytes)
+        except InferenceQueueFull as e:
+            raise busy_exception(e)
+        except Exception as e:
+            # Log the error if the segmentation fails
+            logger.error(f"Error executing segmentation model: {e}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Something went wrong, please contact the administrator."
+            )
+
+        await run_in_threadpool(single_segmentation_cache.set, 
+                                cache_key, returned_images)
+
+    return utils_image.encoded_images_response(returned_images, accept)
 
 
 @app.post(f"/{PREFIX}/clothes_segmentation")
 async def clothes_segmentation(image: UploadFile = File(...),
+                               accept: str | None = Header(default=None),
                                api_key: APIKey = Depends(get_api_key)):
     """
     Perform clothes segmentation on the given image.
 
     Args:
         image (UploadFile): The image to perform segmentation on.
+        accept (str): The Accept header, application/x-image-stream 
+            to get the images as a binary stream instead of base64.
         api_key (APIKey): The API key for authentication.
 
     Returns:
@@ -242,29 +692,38 @@ async def clothes_segmentation(image: UploadFile = File(...),
     Raises:
         HTTPException: If an error occurs during segmentation or if no clothes are found.
     """
-    try:
-        # Convert the image file to a base64 encoded string
-        image_base64 = await utils_image.convert_image_to_base64(image)
-        
-        # Perform segmentation to crop clothes from the full-body image
-        returned_images = segmentation.crop_clothes_from_fullbody(image_base64)
-        
-    except Exception as e:
-        # Log the error if the segmentation fails
-        logger.error(f"Error executing segmentation model: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Something went wrong, please contact the administrator."
-        )
-        
+    image_bytes = await image.read()
+
+    cache_key, returned_images = await run_in_threadpool(
+        segmentation_cache.lookup, image_bytes)
+
+    if returned_images is None:
+        try:
+            # Perform segmentation to crop clothes from the full-body image
+            returned_images = await segmentation_scheduler.run(
+                encoding_images(decoding_image(segmentation.crop_clothes_from_image)),
+                image_bytes)
+        except InferenceQueueFull as e:
+            raise busy_exception(e)
+        except Exception as e:
+            # Log the error if the segmentation fails
+            logger.error(f"Error executing segmentation model: {e}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Something went wrong, please contact the administrator."
+            )
+
+        await run_in_threadpool(segmentation_cache.set, 
+                                cache_key, returned_images)
+
     # If no images were detected, return a 204 response
-    if returned_images == {"images": []}:
+    if not returned_images:
         raise HTTPException(
             status_code=204,
             detail=f"Could found any clothes in the image."
         )
 
-    return returned_images
+    return utils_image.encoded_images_response(returned_images, accept)
 
 @app.post(f"/{PREFIX}/image_classification")
 async def get_categories_from_image(
@@ -294,21 +753,196 @@ async def get_categories_from_image(
             status_code=400, 
             detail="Invalid JSON format for dict_of_categories")
 
+    image_bytes = await image.read()
+
     try:
-        image_base64 = await utils_image.convert_image_to_base64(image)
-        category = classification.image_classification_from_dict(
-            categories_dict,
-            image_base64)
+        [category] = await classify_images(categories_dict, [image_bytes])
+    except InferenceQueueFull as e:
+        raise busy_exception(e)
     except Exception as e:
         logger.error(f"Error executing classification model: {e}")
         raise HTTPException(
             status_code=500,
             detail=f"Something went wrong, please contact the administrator."
         )
-        
+
     if category == {}:
         raise HTTPException(
             status_code=204, 
             detail="Could not identify any category for this image.")
     
     return category
+
+
+@app.post(f"/{PREFIX}/image_classification_batch")
+async def get_categories_from_images(
+        categories_dict: str = Form(...),
+        images: list[UploadFile] = File(...),
+        api_key: APIKey = Depends(get_api_key)):
+    """
+    Perform image classification on a batch of images and return, for each
+    image, the categories that best match it. The images already classified
+    with the same categories are served from the cache, see classify_images.
+
+    Args:
+        categories_dict (str): A JSON string containing the categories to match.
+        images (list[UploadFile]): The images to classify.
+        api_key (APIKey): The API key for authentication.
+
+    Returns:
+        dict: A dictionary with a single key "categories", whose value is the
+            list of categories that best match each image, in the same order
+            as the images.
+
+    Raises:
+        HTTPException: If an error occurs during classification.
+    """
+    try:
+        categories_dict = json.loads(categories_dict)
+    except json.JSONDecodeError:
+        raise HTTPException(
+            status_code=400, 
+            detail="Invalid JSON format for dict_of_categories")
+
+    try:
+        images_to_classify = [await image.read() for image in images]
+        categories = await classify_images(categories_dict, images_to_classify)
+    except InferenceQueueFull as e:
+        raise busy_exception(e)
+    except Exception as e:
+        logger.error(f"Error executing classification model: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Something went wrong, please contact the administrator."
+        )
+
+    return {"categories": categories}
+
+@app.post(f"/{PREFIX}/extract_garments")
+async def extract_garments(
+        categories_dict: str = Form(...),
+        image: UploadFile = File(...),
+        face_id: UploadFile | None = File(default=None),
+        id_client: int | None = Form(default=None),
+        accept: str | None = Header(default=None),
+        api_key: APIKey = Depends(get_api_key)):
+    """
+    Runs the whole pipeline on the given image in a single call: detects 
+    each person, keeps the ones matching the client FaceID, crops each 
+    piece of cloth they wear and classifies it.
+
+    The image is decoded once, in the worker thread of the object 
+    detection, and every model works on the decoded image without any 
+    network hop.
+
+    Args:
+        categories_dict (str): A JSON string containing the categories to match.
+        image (UploadFile): The image to extract the garments from.
+        face_id (UploadFile): The client FaceID.
+        id_client (int): The ID of the client, whose cached FaceID encoding
+            is used instead of face_id.
+        accept (str): The Accept header, application/x-image-stream 
+            to get the garments as a binary stream instead of base64.
+        api_key (APIKey): The API key for authentication.
+
+    Returns:
+        dict: A dictionary with the "images" of the garments and the 
+            "categories" that best match each of them, or the binary 
+            stream of the garments with their categories in the
+            X-Image-Categories header, see 
+            utils_image.classified_images_response.
+
+    Raises:
+        HTTPException: If an error occurs during the extraction or if no
+            garments are found.
+    """
+    try:
+        categories_dict = json.loads(categories_dict)
+    except json.JSONDecodeError:
+        raise HTTPException(
+            status_code=400, 
+            detail="Invalid JSON format for dict_of_categories")
+
+    if face_id is None and id_client is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Either a FaceID image or a client ID is required.")
+
+    face_encoding = None
+    if id_client is not None:
+        face_encoding = await get_client_face_encoding(id_client)
+    else:
+        face_id_bytes = await face_id.read()
+
+    try:
+        if face_encoding is None:
+            face_encoding = await face_recognition_scheduler.run(
+                face_recognition.encode_face_id,
+                io.BytesIO(face_id_bytes))
+
+        garments = await extract_garments_from_image(await image.read(),
+                                                     face_encoding,
+                                                     categories_dict)
+    except InferenceQueueFull as e:
+        raise busy_exception(e)
+    except Exception as e:
+        logger.error(f"Error executing garments extraction: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Something went wrong, please contact the administrator."
+        )
+
+    if not garments:
+        raise HTTPException(
+            status_code=204, 
+            detail="Could not find any garment weared by the client.")
+
+    return utils_image.classified_images_response(
+        [garment for garment, _ in garments],
+        [categories for _, categories in garments],
+        accept)
+
+async def extract_garments_from_image(image_bytes, face_encoding, categories_dict):
+    """
+    Detection -> face match -> segmentation -> classification on an image,
+    each step running on the scheduler of its model.
+
+    Args:
+        image_bytes (bytes): The encoded image to extract the garments 
+            from, decoded in the worker thread of the object detection.
+        face_encoding (np.ndarray): The encoding of the client FaceID.
+        categories_dict (dict): The categories to match.
+
+    Returns:
+        list[tuple[bytes, dict]]: Each JPEG encoded garment with its 
+            categories.
+    """
+    persons = await object_detection_scheduler.run(
+        decoding_image(object_detection.detect_objects), image_bytes, 'person')
+
+    if not persons:
+        return []
+
+    # Match the faces of every person at once
+    matches = await face_recognition_scheduler.run(
+        face_recognition.match_faces, face_encoding, persons)
+
+    garments = []
+    for person, same_person in zip(persons, matches):
+        if not same_person:
+            continue
+
+        # The garments are encoded in the worker thread, as the crops of
+        # the clothes_segmentation endpoint
+        garments.extend(await segmentation_scheduler.run(
+            encoding_images(segmentation.crop_clothes_from_image), person))
+
+    if not garments:
+        return []
+
+    # Classify every garment of the image in a single batch, the garments
+    # being decoded in the worker thread
+    categories = await classify_images(categories_dict, garments)
+
+    return [(garment, category) for garment, category 
+            in zip(garments, categories) if category]
@@ -1,25 +1,52 @@
-from fastapi import Depends, FastAPI, HTTPException, Security, UploadFile, File, Form
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Security, UploadFile, File, Form, Header, Response
+from fastapi.responses import JSONResponse
 from fastapi.security.api_key import APIKey, APIKeyHeader
 from starlette.status import HTTP_403_FORBIDDEN
 from typing import Annotated
 from api.prometheus_metrics import PrometheusMetrics
 from prometheus_fastapi_instrumentator import Instrumentator
 from sqlalchemy.orm import Session
-from database.connection import SessionLocal, engine
-from database import crud
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.connection import session_scope
+from database import crud, async_crud, model
 from schemas import schema
+from logger.logging_config import setup_logging
+import numpy as np
+import requests
 import os
+import json
 import base64
+import hashlib
 
 PREFIX = os.getenv("PG_API_ENDPONT")
 API_KEY = os.getenv("PG_API_KEY")
 
+#MODELs
+SERVER = os.getenv("MODELS_API_SERVER")
+PORT = os.getenv("MODELS_API_PORT")
+ENDPOINT = os.getenv("MODELS_API_ENDPOINT")
+
+MODELS_URI = f"http://{SERVER}:{PORT}/{ENDPOINT}"
+MODELS_API_KEY = os.getenv("MODELS_API_KEY")
+
+logger = setup_logging(__name__)
+
+# Serve the read endpoints with async handlers on an asyncpg engine,
+# instead of sync handlers run in the Starlette threadpool
+DB_ASYNC = os.getenv("DB_ASYNC", "False").lower() == "true"
+if DB_ASYNC:
+    from database.async_connection import async_session_scope
+
 # Initialize the FastAPI app
 app = FastAPI()
 #Instrumentator().instrument(app).expose(app)
 metrics = PrometheusMetrics()
 metrics.setup(app)
 
+# Read endpoints, sync or async depending on DB_ASYNC
+db_reads = APIRouter()
+async_db_reads = APIRouter()
+
 api_key_header = APIKeyHeader(name="access_token", auto_error=False)
 
 async def get_api_key(api_key_header: str = Security(api_key_header)) -> str:
@@ -48,11 +75,16 @@ def get_db():
     Provides a database session to interact with the database during the request lifecycle.
     Closes the session after the request is completed.
     """
-    db = SessionLocal()
-    try:
+    with session_scope() as db:
+        yield db
+
+async def get_async_db():
+    """
+    Provides an async database session (DB_ASYNC), closed after the request
+    is completed.
+    """
+    async with async_session_scope() as db:
         yield db
-    finally:
-        db.close()  # Ensure the session is closed after use
 
 
 @app.get("/")
@@ -91,7 +123,7 @@ def create_color(color: schema.Color,
     return crud.create_color(db, color=color)
 
 
-@app.get(f"/{PREFIX}/colors/", response_model=list[schema.Color])
+@db_reads.get(f"/{PREFIX}/colors/", response_model=list[schema.Color])
 def get_colors(skip: int = 0, limit: int = 100,
                db: Session = Depends(get_db),
                api_key: APIKey = Depends(get_api_key)):
@@ -116,7 +148,7 @@ def get_colors(skip: int = 0, limit: int = 100,
     return colors
 
 
-@app.get(f"/{PREFIX}/seasons/", response_model=list[schema.Season])
+@db_reads.get(f"/{PREFIX}/seasons/", response_model=list[schema.Season])
 def get_seasons(skip: int = 0, limit: int = 100,
                 db: Session = Depends(get_db),
                 api_key: APIKey = Depends(get_api_key)) -> list[schema.Season]:
@@ -141,7 +173,7 @@ def get_seasons(skip: int = 0, limit: int = 100,
     return seasons
 
 
-@app.get(f"/{PREFIX}/genders/", response_model=list[schema.Gender])
+@db_reads.get(f"/{PREFIX}/genders/", response_model=list[schema.Gender])
 def get_genders(skip: int = 0, limit: int = 100,
                 db: Session = Depends(get_db),
                 api_key: APIKey = Depends(get_api_key)) -> list[schema.Gender]:
@@ -166,7 +198,7 @@ def get_genders(skip: int = 0, limit: int = 100,
     return genders
 
 
-@app.get(f"/{PREFIX}/usage_types/", response_model=list[schema.UsageType])
+@db_reads.get(f"/{PREFIX}/usage_types/", response_model=list[schema.UsageType])
 def get_usage_types(skip: int = 0, limit: int = 100,
                     db: Session = Depends(get_db),
                     api_key: APIKey = Depends(get_api_key)) -> list[schema.UsageType]:
@@ -191,7 +223,7 @@ def get_usage_types(skip: int = 0, limit: int = 100,
     return usage
 
 
-@app.get(f"/{PREFIX}/categories/", response_model=list[schema.Category])
+@db_reads.get(f"/{PREFIX}/categories/", response_model=list[schema.Category])
 def get_categories(skip: int = 0, limit: int = 100,
                    db: Session = Depends(get_db),
                    api_key: APIKey = Depends(get_api_key)) -> list[schema.Category]:
@@ -216,7 +248,7 @@ def get_categories(skip: int = 0, limit: int = 100,
     return categories
 
 
-@app.get(f"/{PREFIX}/subcategories/", response_model=list[schema.SubCategory])
+@db_reads.get(f"/{PREFIX}/subcategories/", response_model=list[schema.SubCategory])
 def get_subcategories(skip: int = 0, limit: int = 100,
                       db: Session = Depends(get_db),
                       api_key: APIKey = Depends(get_api_key)):
@@ -244,7 +276,7 @@ def get_subcategories(skip: int = 0, limit: int = 100,
     return subcategories
 
 
-@app.get(f"/{PREFIX}/article_types/", response_model=list[schema.ArticleType])
+@db_reads.get(f"/{PREFIX}/article_types/", response_model=list[schema.ArticleType])
 def get_article_types(skip: int = 0, limit: int = 100,
                       db: Session = Depends(get_db),
                       api_key: APIKey = Depends(get_api_key)):
@@ -268,7 +300,7 @@ def get_article_types(skip: int = 0, limit: int = 100,
     article_types = crud.get_article_types(db, skip=skip, limit=limit)
     return article_types
 
-@app.get(f"/{PREFIX}/article_types_by_category/", response_model=list[schema.ArticleType])
+@db_reads.get(f"/{PREFIX}/article_types_by_category/", response_model=list[schema.ArticleType])
 def get_article_types_by_category(category_id: int, skip: int = 0, limit: int = 100,
                       db: Session = Depends(get_db),
                       api_key: APIKey = Depends(get_api_key)):
@@ -291,6 +323,46 @@ def get_article_types_by_category(category_id: int, skip: int = 0, limit: int =
     return article_types
 
 
+@db_reads.get(f"/{PREFIX}/taxonomy/", response_model=schema.Taxonomy)
+def get_taxonomy(if_none_match: str | None = Header(default=None),
+                 db: Session = Depends(get_db),
+                 api_key: APIKey = Depends(get_api_key)):
+    """
+    Retrieve every reference table (genders, seasons, colors, usage types,
+    categories, subcategories and article types) in a single payload.
+
+    The response carries an ETag computed from its content, so clients
+    caching the taxonomy can revalidate it with an If-None-Match header and
+    get an empty 304 response while it has not changed.
+
+    Args:
+        if_none_match (str): The ETag of the taxonomy cached by the client.
+        db (Session): The SQLAlchemy database session.
+        api_key (APIKey): The API Key for authentication.
+
+    Returns:
+        schema.Taxonomy: The taxonomy, or a 304 response if it has not changed.
+    """
+    return taxonomy_response(crud.get_taxonomy(db), if_none_match)
+
+
+def taxonomy_response(taxonomy: dict, if_none_match: str | None):
+    """
+    Serializes the taxonomy with its ETag, or returns an empty 304 response
+    if it matches the If-None-Match header.
+    """
+    taxonomy = schema.Taxonomy.model_validate(taxonomy, from_attributes=True)
+    content = taxonomy.model_dump(mode="json")
+
+    etag = '"' + hashlib.sha256(
+        json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest() + '"'
+
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return JSONResponse(content=content, headers={"ETag": etag})
+
+
 @app.post(f"/{PREFIX}/import_image/", response_model=schema.ImageProduct)
 def create_image_product(image: schema.ImageProduct,
                          db: Session = Depends(get_db),
@@ -312,8 +384,9 @@ def create_image_product(image: schema.ImageProduct,
     return db_image
 
 
-@app.get(f"/{PREFIX}/images_categories/", response_model=list[schema.ImageProductDetailed])
+@db_reads.get(f"/{PREFIX}/images_categories/", response_model=list[schema.ImageProductDetailed])
 def get_all_images(skip: int = 0, limit: int = 100,
+                   after_id: int | None = None,
                    db: Session = Depends(get_db),
                    api_key: APIKey = Depends(get_api_key)):
     """
@@ -322,11 +395,14 @@ def get_all_images(skip: int = 0, limit: int = 100,
     This endpoint supports pagination by providing the `skip` and `limit`
     parameters. The `skip` parameter determines the number of records to skip
     before returning the image and category list, and the `limit` parameter
-    determines the maximum number of records to return.
+    determines the maximum number of records to return. The images are
+    ordered by ID, passing the ID of the last image of a page as `after_id`
+    returns the next page at the same cost whatever its position.
 
     Args:
         skip (int): The number of records to skip. Defaults to 0.
         limit (int): The maximum number of records to return. Defaults to 100.
+        after_id (int | None): The ID of the last image of the previous page.
         db (Session): The SQLAlchemy database session.
         api_key (APIKey): The API Key for authentication.
 
@@ -334,12 +410,13 @@ def get_all_images(skip: int = 0, limit: int = 100,
         list[ImageProductDetailed]: A list of ImageProductDetailed objects.
     """
     # Retrieve a list of all images along with their categories from the database
-    images = crud.get_images_and_categories(db, skip=skip, limit=limit)
+    images = crud.get_images_and_categories(db, skip=skip, limit=limit,
+                                            after_id=after_id)
     # Return the detailed list of images and categories
     return images
 
 
-@app.get(f"/{PREFIX}/images/", response_model=list[schema.ImageProduct])
+@db_reads.get(f"/{PREFIX}/images/", response_model=list[schema.ImageProduct])
 def get_all_images(skip: int = 0, limit: int = 100,
                    db: Session = Depends(get_db),
                    api_key: APIKey = Depends(get_api_key)):
@@ -423,7 +500,6 @@ def authentication(email: str, password: str,
 @app.post(f"/{PREFIX}/upload_faceid/")
 def update_faceid(id_client: Annotated[int, Form()],
                   image: UploadFile = File(...),
-                  db: Session = Depends(get_db),
                   api_key: APIKey = Depends(get_api_key)):
     """
     Endpoint to update the FaceID of a client.
@@ -431,7 +507,6 @@ def update_faceid(id_client: Annotated[int, Form()],
     Args:
         id_client (int): The ID of the client whose FaceID is being updated.
         image (UploadFile): The uploaded image file containing the new FaceID.
-        db (Session): Database session dependency.
         api_key (APIKey): API key dependency for security.
 
     Returns:
@@ -439,6 +514,7 @@ def update_faceid(id_client: Annotated[int, Form()],
 
     Raises:
         HTTPException: If the FaceID update fails, an HTTP 400 error is raised.
+            If the models API is unavailable, an HTTP 503 error is raised.
     """
     # Read the image bytes from the uploaded file
     image_bytes = image.file.read()
@@ -446,15 +522,80 @@ def update_faceid(id_client: Annotated[int, Form()],
     # Convert the image bytes to a base64 encoded string
     image_base64 = base64.b64encode(image_bytes).decode('utf-8')
 
+    # Compute the face encoding once, at upload time, before taking a DB
+    # connection for the update
+    face_encoding = compute_face_encoding(image_bytes)
+
     # Update the FaceID in the database
-    if not crud.update_faceid(db, id_client, image_base64):
-        raise HTTPException(status_code=400, detail="Invalid Image.")
+    with session_scope() as db:
+        if not crud.update_faceid(db, id_client, image_base64, face_encoding):
+            raise HTTPException(status_code=400, detail="Invalid Image.")
+
+    # Only once committed, the models API drops the encoding of the former
+    # FaceID it has cached
+    invalidate_face_encoding(id_client)
 
     # Return a success status
     return {"status": "success"}
 
 
-@app.get(f"/{PREFIX}/get_faceid")
+def compute_face_encoding(image_bytes: bytes) -> bytes:
+    """
+    Asks the models API for the encoding of the face of a FaceID.
+
+    Args:
+        image_bytes (bytes): The encoded FaceID image.
+
+    Returns:
+        bytes: The 128-d float64 encoding.
+
+    Raises:
+        HTTPException: If no face is found in the image, an HTTP 400 error 
+            is raised. If the models API is unavailable, an HTTP 503 error
+            is raised and the FaceID is not updated.
+    """
+    unavailable = HTTPException(status_code=503,
+                                detail="The FaceID could not be processed, please retry later.",
+                                headers={"Retry-After": "10"})
+    try:
+        response = requests.post(f"{MODELS_URI}/face_encoding",
+                                 files={"image": ('faceid.jpeg', 
+                                                  image_bytes, 
+                                                  'image/jpeg')},
+                                 headers={"access_token": MODELS_API_KEY},
+                                 timeout=30)
+    except requests.RequestException:
+        raise unavailable
+
+    if response.status_code == 400:
+        raise HTTPException(status_code=400, 
+                            detail="Could not find any face in the FaceID.")
+    if response.status_code != 200:
+        if "Retry-After" in response.headers:
+            unavailable.headers["Retry-After"] = response.headers["Retry-After"]
+        raise unavailable
+
+    return np.array(response.json()["encoding"], dtype=np.float64).tobytes()
+
+def invalidate_face_encoding(id_client: int):
+    """
+    Asks the models API to drop the face encoding it has cached for a 
+    client. On a failure, the former encoding is served until it expires
+    (FACE_ENCODING_CACHE_TTL of the models API).
+
+    Args:
+        id_client (int): The ID of the client whose FaceID was updated.
+    """
+    try:
+        response = requests.post(f"{MODELS_URI}/invalidate_face_encoding",
+                                 data={"id_client": id_client},
+                                 headers={"access_token": MODELS_API_KEY},
+                                 timeout=10)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logger.error(f"Unable to invalidate the face encoding of client {id_client}: {e}")
+
+@db_reads.get(f"/{PREFIX}/get_faceid")
 def get_faceid(id_client: int,
                db: Session = Depends(get_db),
                api_key: APIKey = Depends(get_api_key)) -> dict:
@@ -481,21 +622,53 @@ def get_faceid(id_client: int,
     # Return the FaceID as a base64 encoded string
     return {'images': db_faceid.tobytes().decode("utf-8")}
 
-@app.get(f"/{PREFIX}/images_from_client/", response_model=list[schema.ImageProductDetailed])
+@db_reads.get(f"/{PREFIX}/get_face_encoding")
+def get_face_encoding(id_client: int,
+                      db: Session = Depends(get_db),
+                      api_key: APIKey = Depends(get_api_key)) -> dict:
+    """
+    Retrieves the encoding of the face of a client FaceID.
+
+    Args:
+        id_client (int): The ID of the client whose encoding is being requested.
+        db (Session): The database session dependency.
+        api_key (APIKey): The API key dependency for security.
+
+    Returns:
+        dict: A dictionary containing the 128-d "encoding", None if it has
+            not been computed yet.
+
+    Raises:
+        HTTPException: If the client has no FaceID, an HTTP 404 error is raised.
+    """
+    face_encoding = crud.get_face_encoding(db, id_client)
+    if face_encoding is False:
+        raise HTTPException(status_code=404, detail="FaceId not found.")
+
+    if face_encoding is None:
+        return {"encoding": None}
+
+    return {"encoding": np.frombuffer(face_encoding, dtype=np.float64).tolist()}
+
+@db_reads.get(f"/{PREFIX}/images_from_client/", response_model=list[schema.ImageProductDetailed])
 def get_images_from_client(
         skip: int = 0,  # The number of records to skip (for pagination)
         limit: int = 100,  # The maximum number of records to return
         client_id: int = 0,  # The ID of the client whose images are being requested
+        after_id: int | None = None,  # The ID of the last image of the previous page
         db: Session = Depends(get_db),  # The database session dependency
         api_key: APIKey = Depends(get_api_key)  # The API key dependency for security
 ) -> list[schema.ImageProductDetailed]:
     """
-    Retrieves a list of images from the database associated with a client.
+    Retrieves a list of images from the database associated with a client,
+    ordered by ID.
 
     Args:
         skip (int): The number of records to skip (for pagination).
         limit (int): The maximum number of records to return.
         client_id (int): The ID of the client whose images are being requested.
+        after_id (int | None): Keyset pagination, the ID of the last image of
+            the previous page.
         db (Session): The database session dependency.
         api_key (APIKey): The API key dependency for security.
 
@@ -507,10 +680,140 @@ def get_images_from_client(
     """
     # Retrieve the images from the database
     images_from_client = crud.get_images_from_user(db, skip=skip, limit=limit, 
-                                                   client_id=client_id)
+                                                   client_id=client_id,
+                                                   after_id=after_id)
     if not images_from_client:
         # Raise an HTTP 404 error if the client ID is invalid
         raise HTTPException(status_code=404, detail="Client ID is invalid.")
 
     # Return the list of images
     return images_from_client
+
+
+# Async variants of the read endpoints (DB_ASYNC), see the sync endpoints
+# above for the documentation of each one.
+
+@async_db_reads.get(f"/{PREFIX}/colors/", response_model=list[schema.Color])
+async def get_colors_async(skip: int = 0, limit: int = 100,
+                           db: AsyncSession = Depends(get_async_db),
+                           api_key: APIKey = Depends(get_api_key)):
+    return await async_crud.get_all(db, model.Color, skip=skip, limit=limit)
+
+
+@async_db_reads.get(f"/{PREFIX}/seasons/", response_model=list[schema.Season])
+async def get_seasons_async(skip: int = 0, limit: int = 100,
+                            db: AsyncSession = Depends(get_async_db),
+                            api_key: APIKey = Depends(get_api_key)):
+    return await async_crud.get_all(db, model.Season, skip=skip, limit=limit)
+
+
+@async_db_reads.get(f"/{PREFIX}/genders/", response_model=list[schema.Gender])
+async def get_genders_async(skip: int = 0, limit: int = 100,
+                            db: AsyncSession = Depends(get_async_db),
+                            api_key: APIKey = Depends(get_api_key)):
+    return await async_crud.get_all(db, model.Gender, skip=skip, limit=limit)
+
+
+@async_db_reads.get(f"/{PREFIX}/usage_types/", response_model=list[schema.UsageType])
+async def get_usage_types_async(skip: int = 0, limit: int = 100,
+                                db: AsyncSession = Depends(get_async_db),
+                                api_key: APIKey = Depends(get_api_key)):
+    return await async_crud.get_all(db, model.UsageType, skip=skip, limit=limit)
+
+
+@async_db_reads.get(f"/{PREFIX}/categories/", response_model=list[schema.Category])
+async def get_categories_async(skip: int = 0, limit: int = 100,
+                               db: AsyncSession = Depends(get_async_db),
+                               api_key: APIKey = Depends(get_api_key)):
+    return await async_crud.get_all(db, model.Category, skip=skip, limit=limit)
+
+
+@async_db_reads.get(f"/{PREFIX}/subcategories/", response_model=list[schema.SubCategory])
+async def get_subcategories_async(skip: int = 0, limit: int = 100,
+                                  db: AsyncSession = Depends(get_async_db),
+                                  api_key: APIKey = Depends(get_api_key)):
+    return await async_crud.get_all(db, model.SubCategory, skip=skip, limit=limit)
+
+
+@async_db_reads.get(f"/{PREFIX}/article_types/", response_model=list[schema.ArticleType])
+async def get_article_types_async(skip: int = 0, limit: int = 100,
+                                  db: AsyncSession = Depends(get_async_db),
+                                  api_key: APIKey = Depends(get_api_key)):
+    return await async_crud.get_all(db, model.ArticleType, skip=skip, limit=limit)
+
+
+@async_db_reads.get(f"/{PREFIX}/article_types_by_category/", response_model=list[schema.ArticleType])
+async def get_article_types_by_category_async(category_id: int, skip: int = 0, limit: int = 100,
+                                              db: AsyncSession = Depends(get_async_db),
+                                              api_key: APIKey = Depends(get_api_key)):
+    return await async_crud.get_article_types_by_categories(db,
+                                                            category_id=category_id,
+                                                            skip=skip,
+                                                            limit=limit)
+
+
+@async_db_reads.get(f"/{PREFIX}/taxonomy/", response_model=schema.Taxonomy)
+async def get_taxonomy_async(if_none_match: str | None = Header(default=None),
+                             db: AsyncSession = Depends(get_async_db),
+                             api_key: APIKey = Depends(get_api_key)):
+    return taxonomy_response(await async_crud.get_taxonomy(db), if_none_match)
+
+
+@async_db_reads.get(f"/{PREFIX}/images_categories/", response_model=list[schema.ImageProductDetailed])
+async def get_all_images_categories_async(skip: int = 0, limit: int = 100,
+                                          after_id: int | None = None,
+                                          db: AsyncSession = Depends(get_async_db),
+                                          api_key: APIKey = Depends(get_api_key)):
+    return await async_crud.get_images_and_categories(db, skip=skip, limit=limit,
+                                                      after_id=after_id)
+
+
+@async_db_reads.get(f"/{PREFIX}/images/", response_model=list[schema.ImageProduct])
+async def get_all_images_async(skip: int = 0, limit: int = 100,
+                               db: AsyncSession = Depends(get_async_db),
+                               api_key: APIKey = Depends(get_api_key)):
+    return await async_crud.get_images(db, skip=skip, limit=limit)
+
+
+@async_db_reads.get(f"/{PREFIX}/get_faceid")
+async def get_faceid_async(id_client: int,
+                           db: AsyncSession = Depends(get_async_db),
+                           api_key: APIKey = Depends(get_api_key)) -> dict:
+    db_faceid = await async_crud.get_faceid(db, id_client)
+    if not db_faceid:
+        raise HTTPException(status_code=404, detail="FaceId not found.")
+
+    # asyncpg returns the bytea columns as bytes, not as memoryview
+    if not isinstance(db_faceid, str):
+        db_faceid = bytes(db_faceid).decode("utf-8")
+
+    return {'images': db_faceid}
+
+
+@async_db_reads.get(f"/{PREFIX}/get_face_encoding")
+async def get_face_encoding_async(id_client: int,
+                                  db: AsyncSession = Depends(get_async_db),
+                                  api_key: APIKey = Depends(get_api_key)) -> dict:
+    face_encoding = await async_crud.get_face_encoding(db, id_client)
+    if face_encoding is False:
+        raise HTTPException(status_code=404, detail="FaceId not found.")
+
+    if face_encoding is None:
+        return {"encoding": None}
+
+    return {"encoding": np.frombuffer(face_encoding, dtype=np.float64).tolist()}
+
+
+@async_db_reads.get(f"/{PREFIX}/images_from_client/", response_model=list[schema.ImageProductDetailed])
+async def get_images_from_client_async(skip: int = 0, limit: int = 100,
+                                       client_id: int = 0,
+                                       after_id: int | None = None,
+                                       db: AsyncSession = Depends(get_async_db),
+                                       api_key: APIKey = Depends(get_api_key)):
+    # Like the sync endpoint, a client without images gets an empty list
+    return await async_crud.get_images_from_user(db, skip=skip, limit=limit,
+                                                 client_id=client_id,
+                                                 after_id=after_id)
+
+
+app.include_router(async_db_reads if DB_ASYNC else db_reads)
@@ -0,0 +1,180 @@
+from concurrent.futures import Future
+from prometheus_client import Counter, Histogram
+import asyncio
+import logging
+import threading
+import queue
+import time
+
+BATCH_SIZE = Histogram(
+    "inference_batch_size", "Number of requests per inference batch", ["model"],
+    buckets=[1, 2, 4, 8, 16, 32, 64]
+)
+QUEUE_WAIT = Histogram(
+    "inference_queue_wait_seconds", "Time spent by a request in the inference queue",
+    ["model"]
+)
+REJECTED = Counter(
+    "inference_rejected_total", "Requests rejected because the inference queue was full",
+    ["model"]
+)
+
+logger = logging.getLogger(__name__)
+
+class InferenceQueueFull(Exception):
+    """
+    Raised when a request is submitted to a scheduler whose queue is full.
+    """
+
+class InferenceScheduler:
+    """
+    Queues the inference requests of one model and runs them by micro-batches
+    in a dedicated worker thread, so the PyTorch code never blocks the event
+    loop. Concurrent requests are only grouped into a single model call when
+    the batch function supports it (e.g. the classification); with 
+    call_each, the requests of a model are just serialized on its workers.
+
+    A batch is closed as soon as it holds max_batch_size requests or when
+    max_wait_ms elapsed since its first request.
+
+    The queue is bounded: once max_queue_size requests are waiting, new
+    requests are rejected with InferenceQueueFull instead of piling up.
+    """
+
+    def __init__(self,
+                 name: str,
+                 batch_function,
+                 max_batch_size: int = 1,
+                 max_wait_ms: float = 0,
+                 workers: int = 1,
+                 max_queue_size: int = 0):
+        """
+        Args:
+            name (str): The model name, used as the metrics label.
+            batch_function (callable): Receives the list of the arguments
+                tuples of a batch and returns the list of their results, in
+                the same order. A result may be an Exception, which is then
+                raised to its caller only.
+            max_batch_size (int): The maximum number of requests per batch.
+            max_wait_ms (float): How long to wait for a batch to fill up.
+            workers (int): The number of batches of this model that may run
+                concurrently, each in its own worker thread.
+            max_queue_size (int): The maximum number of waiting requests,
+                0 for an unbounded queue.
+        """
+        self.name = name
+        self.batch_function = batch_function
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.workers = [threading.Thread(target=self.process_batches,
+                                         name=f"inference-{name}-{i}",
+                                         daemon=True)
+                        for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, *args) -> Future:
+        """
+        Queues a request.
+
+        Returns:
+            Future: The future resolved with the result of the request.
+
+        Raises:
+            InferenceQueueFull: If the queue of the model is full.
+        """
+        future = Future()
+        try:
+            self.queue.put_nowait((args, future, time.monotonic()))
+        except queue.Full:
+            REJECTED.labels(model=self.name).inc()
+            raise InferenceQueueFull(f"The {self.name} queue is full")
+        return future
+
+    async def run(self, *args):
+        """
+        Queues a request and waits for its result without blocking the
+        event loop.
+        """
+        return await asyncio.wrap_future(self.submit(*args))
+
+    @staticmethod
+    def accept(batch: list, request):
+        """
+        Adds a request to a batch unless it was cancelled (client gone,
+        timeout) while queued. Once marked running, its future can no 
+        longer be cancelled, so its result can always be set.
+        """
+        _, future, _ = request
+        if future.set_running_or_notify_cancel():
+            batch.append(request)
+
+    def next_batch(self) -> list:
+        # Block until a first request arrives, then fill the batch
+        batch = []
+        while not batch:
+            self.accept(batch, self.queue.get())
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                self.accept(batch, self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def process_batches(self):
+        while True:
+            try:
+                batch = self.next_batch()
+                self.process_batch(batch)
+            except BaseException as e:
+                # The worker must survive anything, or every later request
+                # to the model would wait forever
+                logger.exception(f"Inference worker of {self.name} failed: {e!r}")
+
+    def process_batch(self, batch: list):
+        started_at = time.monotonic()
+        BATCH_SIZE.labels(model=self.name).observe(len(batch))
+        for _, _, queued_at in batch:
+            QUEUE_WAIT.labels(model=self.name).observe(started_at - queued_at)
+
+        try:
+            results = self.batch_function([args for args, _, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name} returned {len(results)} "
+                                   f"results for {len(batch)} requests")
+        except BaseException as e:
+            # Never hand a SystemExit or KeyboardInterrupt to the event loop
+            if not isinstance(e, Exception):
+                e = RuntimeError(f"{self.name} inference interrupted: {e!r}")
+            results = [e] * len(batch)
+
+        for (_, future, _), result in zip(batch, results):
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+def call_each(batch):
+    """
+    Batch function of the models without batch support (object detection,
+    face detection, segmentation): each request holds the model method to
+    call followed by its arguments, the methods are called in turn, one
+    forward pass per request. Such a scheduler is kept to max_batch_size=1,
+    grouping the requests would only delay the first ones.
+    """
+    results = []
+    for function, *args in batch:
+        try:
+            results.append(function(*args))
+        except Exception as e:
+            results.append(e)
+
+    return results
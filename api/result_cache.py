@@ -0,0 +1,239 @@
+from prometheus_client import Counter
+from utils.utils_cache import LRUCache
+import threading
+import hashlib
+import logging
+import pickle
+import os
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 256))
+# Total size of the pickled results kept by each tier of a model cache
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 256 * 2**20))
+RESULT_CACHE_DIR_MAX_BYTES = int(os.getenv("RESULT_CACHE_DIR_MAX_BYTES", 2**30))
+# On-disk tier, disabled when not set
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR")
+# Once the on-disk tier is full, the least recently used entries are
+# removed until it is back under this ratio of its size
+RESULT_CACHE_DIR_LOW_WATERMARK = 0.9
+
+CACHE_HITS = Counter(
+    "model_result_cache_hits_total", "Model results served from the cache",
+    ["model", "tier"]
+)
+CACHE_MISSES = Counter(
+    "model_result_cache_misses_total", "Model results missing from the cache",
+    ["model"]
+)
+
+class ResultCache:
+    """
+    Caches the results of a model by the content of its inputs, so a photo
+    uploaded again is not processed a second time.
+
+    The results are kept in an in-memory LRU of RESULT_CACHE_SIZE entries
+    and RESULT_CACHE_MAX_BYTES, backed by an on-disk tier in 
+    RESULT_CACHE_DIR when set, bounded to RESULT_CACHE_DIR_MAX_BYTES by 
+    removing the least recently used files (by mtime, refreshed on a hit).
+    The keys include the model version, so a model upgrade never serves the
+    former results. The cache is best-effort: an entry which can't be read
+    is a miss, and a result which can't be written is not cached.
+    """
+
+    def __init__(self,
+                 name: str,
+                 version: str,
+                 max_size: int = RESULT_CACHE_SIZE,
+                 directory: str | None = RESULT_CACHE_DIR,
+                 max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 directory_max_bytes: int = RESULT_CACHE_DIR_MAX_BYTES):
+        """
+        Args:
+            name (str): The model name, used as the metrics label and the
+                on-disk directory.
+            version (str): The model version (model name, settings changing
+                its results...), part of every key.
+            max_size (int): The maximum number of entries kept in memory, 0
+                to disable the memory tier.
+            directory (str): The root directory of the on-disk tier, None to
+                disable it.
+            max_bytes (int): The maximum size of the memory tier, 0 for no
+                limit.
+            directory_max_bytes (int): The maximum size of the on-disk tier.
+        """
+        self.name = name
+        self.version = version
+        self.memory = LRUCache(max_size, max_bytes=max_bytes) if max_size else None
+        self.directory = os.path.join(directory, name) if directory else None
+        self.directory_max_bytes = directory_max_bytes
+        # Size of the on-disk tier, shared with the other processes: it is
+        # counted once, then only recounted when it seems full
+        self.directory_bytes = None
+        self.eviction_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory is not None or self.directory is not None
+
+    def key(self, *parts) -> str:
+        """
+        Hashes the model version and the inputs (bytes or str) of a call.
+        """
+        digest = hashlib.sha256(self.version.encode('utf-8'))
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            digest.update(len(part).to_bytes(8, 'big'))
+            digest.update(part)
+
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str):
+        """
+        Returns the result cached for a key, or None on a miss.
+        """
+        if self.memory is not None:
+            value = self.memory.get(key)
+            if value is not None:
+                CACHE_HITS.labels(model=self.name, tier="memory").inc()
+                return value
+
+        if self.directory is not None:
+            value, size = self.read(key)
+            if value is not None:
+                CACHE_HITS.labels(model=self.name, tier="disk").inc()
+                if self.memory is not None:
+                    self.memory.set(key, value, size)
+                return value
+
+        CACHE_MISSES.labels(model=self.name).inc()
+        return None
+
+    def read(self, key: str) -> tuple[object, int]:
+        """
+        Reads an entry of the on-disk tier and returns its result and size,
+        (None, 0) when it is missing. An entry which can't be read (e.g. 
+        truncated, or pickled by an incompatible version) is removed.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                data = cache_file.read()
+            value = pickle.loads(data)
+        except FileNotFoundError:
+            return None, 0
+        except Exception as e:
+            logger.warning(f"Removing unreadable {self.name} cache entry {key}: {e}")
+            self.remove(path)
+            return None, 0
+
+        # Keep the recently used entries from being evicted
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return value, len(data)
+
+    def set(self, key: str, value):
+        """
+        Caches the result of a call in every tier.
+        """
+        if key is None:
+            return
+
+        data = pickle.dumps(value)
+        if self.memory is not None:
+            self.memory.set(key, value, len(data))
+
+        if self.directory is not None:
+            self.write(key, data)
+
+    def write(self, key: str, data: bytes):
+        """
+        Writes an entry of the on-disk tier, then evicts the least recently
+        used entries if the tier is full. A failure (e.g. a full disk) is
+        logged and the entry is not cached.
+        """
+        path = self.path(key)
+        # Write then rename, so a concurrent reader never gets a partial
+        # entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as cache_file:
+                cache_file.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Unable to cache the {self.name} result {key}: {e}")
+            self.remove(tmp_path)
+            return
+
+        with self.eviction_lock:
+            if self.directory_bytes is None:
+                self.directory_bytes = self.directory_size()
+            else:
+                self.directory_bytes += len(data)
+
+            if self.directory_bytes > self.directory_max_bytes:
+                self.directory_bytes = self.evict(
+                    self.directory_max_bytes * RESULT_CACHE_DIR_LOW_WATERMARK)
+
+    def entries(self) -> list[tuple[float, int, str]]:
+        """
+        Lists the mtime, size and path of the entries of the on-disk tier.
+        """
+        entries = []
+        for directory, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                # Skip the entries being written
+                if file_name.endswith('.tmp'):
+                    continue
+                path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        return entries
+
+    def directory_size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes: float) -> int:
+        """
+        Removes the least recently used entries of the on-disk tier until
+        its size is under max_bytes, and returns its new size.
+        """
+        entries = sorted(self.entries())
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= max_bytes:
+                break
+            self.remove(path)
+            size -= entry_size
+
+        return size
+
+    @staticmethod
+    def remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def lookup(self, *parts) -> tuple[str, object]:
+        """
+        Hashes the inputs of a call and returns its key and cached result
+        (None on a miss). The key is None when the cache is disabled.
+        """
+        if not self.enabled:
+            return None, None
+
+        key = self.key(*parts)
+        return key, self.get(key)
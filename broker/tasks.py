@@ -1,18 +1,25 @@
 from colorsys import rgb_to_hsv
 from http.client import HTTPResponse
-from celery import Celery
+from celery import Celery, chord, group
+from celery.result import allow_join_result
+from celery.exceptions import Ignore
+from celery.signals import worker_process_init
 from PIL import Image
 from fastapi import HTTPException
 from fastapi.responses import JSONResponse
 from utils import utils_image
 from dotenv import load_dotenv
-from database.connection import SessionLocal
+from database.connection import session_scope, dispose_engine, SQLALCHEMY_DATABASE_URL
 from database import crud
 from schemas.schema import ImageProduct
 from logger.logging_config import setup_logging
 from requests.auth import HTTPBasicAuth
 import pandas as pd
 import requests
+import tempfile
+import io
+import threading
+import time
 import json
 import os
 
@@ -20,8 +27,21 @@ load_dotenv(dotenv_path="config/.env")
 
 # Define the path where the fashion dataset is stored
 IMAGE_STORAGE_DIR = os.getenv("IMAGE_STORAGE_DIR")
+IMAGE_TMP_DIR = os.getenv("IMAGE_TMP_DIR", tempfile.gettempdir())
 BROKER_SERVER = os.getenv("BROKER_SERVER")
 
+# Celery execution mode. Chords need a result backend able to store
+# group results, so the DB backend is used by default.
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND",
+                                  f"db+postgresql://{SQLALCHEMY_DATABASE_URL}")
+CELERY_TASK_ALWAYS_EAGER = os.getenv("CELERY_TASK_ALWAYS_EAGER",
+                                     "False").lower() == "true"
+
+# Concurrency limit: images and person crops are fanned out to the worker
+# pool.
+CELERY_WORKER_CONCURRENCY = int(os.getenv("CELERY_WORKER_CONCURRENCY", 
+                                          os.cpu_count()))
+
 #DB
 SERVER = os.getenv("PG_API_SERVER")
 PORT = os.getenv("PG_API_PORT")
@@ -38,6 +58,26 @@ ENDPOINT = os.getenv("MODELS_API_ENDPOINT")
 MODELS_URI = f"http://{SERVER}:{PORT}/{ENDPOINT}"
 MODELS_API_KEY = os.getenv("MODELS_API_KEY")
 HEADER = {"access_token": MODELS_API_KEY }
+# Ask for the images as a binary stream instead of base64 JSON
+STREAM_HEADER = {**HEADER, "Accept": utils_image.IMAGE_STREAM_MEDIA_TYPE}
+# Use the single call extract_garments endpoint instead of one call per step
+MODELS_FUSED_PIPELINE = os.getenv("MODELS_FUSED_PIPELINE", 
+                                  "False").lower() == "true"
+
+# Maximum Hamming distance between the perceptual hashes of two images
+# considered as near-duplicates, -1 to disable the deduplication
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", 6))
+
+# Retries of a task when a models API call fails on the server side (e.g.
+# 503 when an inference queue is full), after its Retry-After delay or
+# TASK_RETRY_DELAY seconds, see retry_unavailable
+TASK_MAX_RETRIES = int(os.getenv("TASK_MAX_RETRIES", 5))
+TASK_RETRY_DELAY = int(os.getenv("TASK_RETRY_DELAY", 10))
+
+# Categories cache, see load_categories
+CATEGORIES_CACHE_TTL = int(os.getenv("CATEGORIES_CACHE_TTL", 3600))
+categories_cache = {'categories': None, 'etag': None, 'expires_at': 0}
+categories_cache_lock = threading.Lock()
 
 # METEO API
 METEO_URI_TOKEN = os.getenv("METEO_URI_TOKEN")
@@ -60,24 +100,19 @@ NEUTRAL_COLORS = [
 
 logger = setup_logging(__name__)
 
-def get_db():
-    """
-    Provides a database session to interact with the database during the request lifecycle.
-    Closes the session after the request is completed.
-    """
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-app = Celery('tasks', broker=f"amqp://{BROKER_SERVER}")
+app = Celery('tasks',
+             broker=f"amqp://{BROKER_SERVER}",
+             backend=CELERY_RESULT_BACKEND)
 
 app.conf.update(
-    task_always_eager=True,  # Synchonous tasks
+    task_always_eager=CELERY_TASK_ALWAYS_EAGER,  # Synchonous tasks (debug)
     task_eager_propagates=True,  # Propagate exceptions
     task_default_queue='default',
+    task_track_started=True,
+    result_extended=True,
+    worker_concurrency=CELERY_WORKER_CONCURRENCY,
+    # Pipeline tasks are long, do not let a worker hoard the queue
+    worker_prefetch_multiplier=1,
     worker_hijack_root_logger=False,
 )
 
@@ -85,136 +120,567 @@ app.conf.update(
 def configure_task_logger(sender=None, **kwargs):
     logger.propagate = False
 
-@app.task
-def identify_clothes(id_client, image_paths):
+@worker_process_init.connect
+def reset_db_connections(**kwargs):
+    # Each worker process opens its own connections, never the ones of
+    # the parent process
+    dispose_engine()
+
+def replace_task(task, signature):
+    """
+    Replaces a running task by a signature (chain, group, chord...).
+
+    Celery refuses to join the nested canvas of an eager task, so when
+    CELERY_TASK_ALWAYS_EAGER is set the signature is applied in place.
+
+    Args:
+        task (celery.Task): The bound task to replace.
+        signature (celery.Signature): The signature replacing the task.
+    """
+    if task.request.is_eager:
+        with allow_join_result():
+            return signature.apply().get()
+
+    return task.replace(signature)
+
+def retry_unavailable(task, response):
+    """
+    Retries a task when a models API call failed on the server side (5xx),
+    after the Retry-After delay of the response. Returns when the failure 
+    is definitive: a client error (4xx), or no retry left.
+
+    Args:
+        task (celery.Task): The bound task to retry.
+        response (requests.Response): The failed response.
+    """
+    if response.status_code < 500 or task.request.retries >= TASK_MAX_RETRIES:
+        return
+
+    try:
+        countdown = int(response.headers.get("Retry-After", TASK_RETRY_DELAY))
+    except ValueError:
+        countdown = TASK_RETRY_DELAY
+
+    raise task.retry(countdown=countdown, max_retries=TASK_MAX_RETRIES)
+
+@app.task(bind=True)
+def identify_clothes(self, id_client, image_paths):
     """
     Task to identify clothes in images uploaded by clients.
 
     The task does the following:
     1. Loads categories (genders, seasons, colors, etc.) from the API.
-    2. For each image provided by the client:
-        a. Extracts each person present in the image.
-        b. Identifies the client based on its Face ID.
-        c. Extracts each piece of cloth weared by the client.
-        d. Classifies each piece of cloth.
-        e. Saves the images in the client directory.
-        f. Saves the image path + categories in the DB.
+    2. Checks the client registered its Face ID.
+    3. Replaces itself by a chord where, for each image provided by the client:
+        a. Extracts each person present in the image (detect_persons).
+        b. Fans out one task per person (identify_persons) that:
+            - Identifies the client based on its Face ID.
+            - Extracts each piece of cloth weared by the client.
+            - Classifies each piece of cloth.
+            - Saves the images in the client directory.
+            - Saves the image path + categories in the DB.
+    4. Once every image is processed, removes the tmp images
+       (finalize_identification). They are also removed when the task or 
+       the chord fails (cleanup_identification).
+
+    Near-duplicate uploads (burst shots, copies of a same photo) are only
+    processed once.
+
+    The chord inherits this task id, so the status of the whole workflow can
+    be followed through ``AsyncResult(task_id)``.
     """
     logger.debug(f"Task started for client ID: {id_client}")
 
-    # Load Categories
-    dict_genders = get_categories('genders','gender')
-    dict_seasons = get_categories('seasons','name')
-    dict_colors = get_categories('colors','name')
-    dict_usage = get_categories('usage_types','name')
-    dict_article = get_categories('article_types_by_category',
-                                  'name',
-                                  'category_id',
-                                  3)
-
-    dict_of_dict_categories = {
-        'id_gender': dict_genders,
-        'id_season': dict_seasons,
-        'id_color': dict_colors,
-        'id_usagetype': dict_usage,
-        'id_articletype': dict_article     
-    }
+    try:
+        # Load Categories
+        dict_of_dict_categories = load_categories()
+
+        # Check the client Face ID, the models API resolves its encoding
+        # by client ID so the image itself is not downloaded
+        face_encoding = get_face_encoding(id_client)
+        if face_encoding.status_code != 200:
+            logger.error(f"Failed to get face ID for client ID {id_client}: {face_encoding.status_code}")
+            raise HTTPException(
+                status_code=403,
+                detail=f"Unable to identify your FaceId, did you register it?")
+
+        # Skip the near-duplicate uploads before any inference, they are
+        # still removed by finalize_identification
+        unique_paths = [image_paths[index] for index, _ 
+                        in drop_near_duplicates(image_paths)]
+
+        # One chain per image, all of them running in parallel on the workers
+        if MODELS_FUSED_PIPELINE:
+            image_tasks = (extract_garments.s(image_path, id_client,
+                                              dict_of_dict_categories)
+                           for image_path in unique_paths)
+        else:
+            image_tasks = (detect_persons.s(image_path) |
+                           identify_persons.s(id_client, dict_of_dict_categories)
+                           for image_path in unique_paths)
+
+        # The body errbacks are called when a task of the chord fails
+        finalize = finalize_identification.si(id_client, image_paths)
+        finalize.link_error(cleanup_identification.si(id_client, image_paths))
+
+        return replace_task(self, chord(image_tasks, finalize))
+    except Ignore:
+        # Replaced by the chord, which removes the tmp images
+        raise
+    except BaseException:
+        remove_files(image_paths)
+        raise
+
+def drop_near_duplicates(images, known_hashes=None, keys=None):
+    """
+    Filters out the images whose perceptual hash is within 
+    PHASH_MAX_DISTANCE of a known hash or of an earlier image of the list
+    with the same key. The hash ignores the colors, so e.g. the key of a 
+    piece of cloth is its article type and color.
+
+    Args:
+        images (list): The images (paths or file-like objects).
+        known_hashes (dict): The hashes of the images already stored, by 
+            key.
+        keys (list): The key of each image. By default, all the images 
+            have the same key.
+
+    Returns:
+        list[tuple[int, int]]: The index and the hash of each image kept.
+            The hash is None when the image could not be hashed, such 
+            images are always kept.
+    """
+    if PHASH_MAX_DISTANCE < 0:
+        return [(index, None) for index in range(len(images))]
+
+    if keys is None:
+        keys = [None] * len(images)
+
+    hashes = {key: list(key_hashes) 
+              for key, key_hashes in (known_hashes or {}).items()}
+    kept = []
+    for index, (image, key) in enumerate(zip(images, keys)):
+        try:
+            image_hash = utils_image.perceptual_hash(image)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unable to hash image {index}: {e}")
+            kept.append((index, None))
+            continue
+
+        key_hashes = hashes.setdefault(key, [])
+        if utils_image.is_near_duplicate(image_hash, key_hashes, 
+                                         PHASH_MAX_DISTANCE):
+            logger.info(f"Skipping near-duplicate image {index}")
+            continue
+
+        key_hashes.append(image_hash)
+        kept.append((index, image_hash))
+
+    return kept
+
+def clothe_key(data_classification, dict_of_dict_categories):
+    """
+    Returns the (id_articletype, id_color) of a classified piece of cloth, 
+    see new_clothes.
+    """
+    return (dict_of_dict_categories['id_articletype'][
+                data_classification['id_articletype']],
+            dict_of_dict_categories['id_color'][
+                data_classification['id_color']])
+
+def new_clothes(id_client, clothes_images, clothes_keys):
+    """
+    Drops the pieces of cloth the client already has in its wardrobe, or 
+    found twice in the same image. A piece of cloth is only compared with
+    the ones of the same article type and color: the hash ignores the 
+    colors, so a red and a blue shirt of the same shape are both kept.
+
+    Args:
+        id_client (int): The client ID.
+        clothes_images (list[bytes]): The encoded pieces of cloth.
+        clothes_keys (list[tuple[int, int]]): The (id_articletype, 
+            id_color) of each piece of cloth, see clothe_key.
+
+    Returns:
+        list[tuple[int, int]]: The index and the hash of each new piece of
+            cloth, see drop_near_duplicates.
+    """
+    if PHASH_MAX_DISTANCE < 0:
+        return drop_near_duplicates(clothes_images)
+
+    known_hashes = {}
+    with session_scope() as db:
+        for phash, id_articletype, id_color in crud.get_image_hashes(db, id_client):
+            known_hashes.setdefault((id_articletype, id_color), []).append(phash)
+
+    return drop_near_duplicates([io.BytesIO(image) for image in clothes_images],
+                                known_hashes,
+                                clothes_keys)
+
+def load_categories():
+    """
+    Loads the categories used to classify the clothes.
+
+    The categories are cached by the process for CATEGORIES_CACHE_TTL
+    seconds. Once expired, the taxonomy is revalidated against its ETag, so
+    it is only downloaded again when the reference tables have changed.
+
+    Returns:
+        dict: A dictionary where each key is an ImageProduct foreign key
+        (e.g. 'id_color') and each value is a dictionary with the category
+        names as keys and their corresponding IDs as values.
+    """
+    with categories_cache_lock:
+        if time.monotonic() < categories_cache['expires_at']:
+            return categories_cache['categories']
+
+        header = {"access_token": PG_API_KEY}
+        if categories_cache['etag']:
+            header['If-None-Match'] = categories_cache['etag']
+
+        response = requests.get(f"{PG_URI}/taxonomy/", headers=header)
+
+        if response.status_code == 200:
+            categories_cache['categories'] = build_categories(response.json())
+            categories_cache['etag'] = response.headers.get('ETag')
+        elif response.status_code != 304:
+            logger.error(f"Failed to load the taxonomy: {response.status_code}")
+            raise HTTPException(
+                status_code=503,
+                detail="Could not load the categories")
 
-    dict_of_categories = {
-        'id_gender': list(dict_genders.keys()),
-        'id_season': list(dict_seasons.keys()),
-        'id_color': list(dict_colors.keys()),
-        'id_usagetype': list(dict_usage.keys()),
-        'id_articletype': list(dict_article.keys())
+        categories_cache['expires_at'] = time.monotonic() + CATEGORIES_CACHE_TTL
+
+        return categories_cache['categories']
+
+def build_categories(taxonomy):
+    """
+    Builds the categories used to classify the clothes from the taxonomy.
+
+    Args:
+        taxonomy (dict): The payload of the taxonomy endpoint.
+
+    Returns:
+        dict: The categories, as returned by load_categories.
+    """
+    # Only the article types of the clothes category (id 3) are classified
+    subcategories = {subcategory['id'] for subcategory in taxonomy['subcategories']
+                     if subcategory['id_category'] == 3}
+
+    return {
+        'id_gender': {x['gender']: x['id'] for x in taxonomy['genders']},
+        'id_season': {x['name']: x['id'] for x in taxonomy['seasons']},
+        'id_color': {x['name']: x['id'] for x in taxonomy['colors']},
+        'id_usagetype': {x['name']: x['id'] for x in taxonomy['usage_types']},
+        'id_articletype': {x['name']: x['id'] for x in taxonomy['article_types']
+                           if x['id_subcategory'] in subcategories}
     }
 
-    # Get Base 64 Client Face ID
-    face_id = get_faceid(id_client)
-    if face_id.status_code != 200:
-        logger.error(f"Failed to get face ID for client ID {id_client}: {face_id.status_code}")
-        raise HTTPException(
-            status_code=403,
-            detail=f"Unable to identify your FaceId, did you register it?")
+def invalidate_categories_cache():
+    """
+    Drops the categories cached by the process, so the next task reloads them.
+    To be called after the reference tables have been modified.
+    """
+    with categories_cache_lock:
+        categories_cache['categories'] = None
+        categories_cache['etag'] = None
+        categories_cache['expires_at'] = 0
 
-    face_id_b64 = json.loads(face_id.content)['images']
+@app.task
+def detect_persons(image_path):
+    """
+    Extracts each person present in an image.
 
-    # For each image provided by the client:
-    for image_path in image_paths:
-        logger.debug(f"Processing image: {image_path}")
+    Every detected person is saved as a tmp image, so only its path travels
+    through the broker.
 
-        # Extract each person present in the image.
-        obj_response = object_detection(image_path,'person')
+    Args:
+        image_path (str): The path to the image uploaded by the client.
 
-        if obj_response.status_code != 200:
-            logger.warning(f"Object detection failed for image: {image_path}")
-            continue
+    Returns:
+        list[str]: The paths to the tmp images of each detected person.
+    """
+    logger.debug(f"Processing image: {image_path}")
+
+    obj_response = object_detection(image_path,'person')
+
+    if obj_response.status_code != 200:
+        logger.warning(f"Object detection failed for image: {image_path}")
+        return []
+
+    person_paths = []
+    for person_bytes in utils_image.unpack_images(obj_response.content):
+        person_path = IMAGE_TMP_DIR + '/' + utils_image.generate_image_name('jpeg')
+        with open(person_path, 'wb') as person_file:
+            person_file.write(person_bytes)
+        person_paths.append(person_path)
+
+    return person_paths
+
+@app.task(bind=True)
+def identify_persons(self, person_paths, id_client, dict_of_dict_categories):
+    """
+    Identifies the client among the persons found in an image with a single
+    batch face detection call, then fans out one identify_person task for
+    each person matching the client.
 
-        data_obj_detection = json.loads(obj_response.content)
-
-        for image_base64 in data_obj_detection['images']:
-            # For each person identify the client based in its FaceID
-            face_response = face_detection(face_id_b64, 
-                                           image_base64)
-
-            if face_response.status_code != 200:
-                logger.warning(f"Face detection failed for image: {image_path}")
-                continue
-
-            data_face_detection = json.loads(face_response.content)
-            face_detection_b64 = data_face_detection['images']
-            # Once the client have been detected in the image
-            # Extract each piece of cloth weared by the client
-            segment_response = image_segmentation(face_detection_b64)
-
-            if segment_response.status_code != 200:
-                logger.error(f"Segmentation failed, for client ID {id_client}")
-                continue
-
-            data_segmentation = json.loads(segment_response.content)
-
-            for img_segmentation_b64 in data_segmentation['images']:
-                # Classify each piece of cloth
-                image_name = utils_image.generate_image_name()
-                classification_response = image_classification(
-                    dict_of_categories, 
-                    img_segmentation_b64, 
-                    image_name)
-                
-                if classification_response.status_code != 200:
-                    continue
-
-                # Save the images in the client directory
-                # Save the image path + categories in the DB
-                image_bytes = utils_image.convert_base64_to_bytesIO(img_segmentation_b64)
-                image_buffer = Image.open(image_bytes)
-                if image_buffer.mode == 'RGBA':
-                        image_buffer = image_buffer.convert('RGB')
-                        
-                image_new_path = IMAGE_STORAGE_DIR + '/' + str(id_client) + '/' + image_name
-                image_buffer.save(image_new_path, format='JPEG')
-                image_buffer.close()
-
-                data_classification = json.loads(classification_response.content)
-
-                image_product = {}
-                image_product['id'] = None
-                image_product['path'] = image_new_path
-                image_product['id_client'] = id_client
-
-                for key, value in data_classification.items():
-                    image_product[key] = dict_of_dict_categories[key][value]
-
-                new_image_product = crud.create_image_product(next(get_db()),
-                                                              ImageProduct(**image_product))
-                
+    Args:
+        person_paths (list[str]): The paths returned by detect_persons.
+        id_client (int): The client ID.
+        dict_of_dict_categories (dict): The categories returned by
+            load_categories.
+    """
+    if not person_paths:
+        return 0
+
+    person_images = []
+    for person_path in person_paths:
+        with open(person_path, 'rb') as person_file:
+            person_images.append(person_file.read())
+
+    # Identify the client based in its FaceID
+    face_response = face_detection_batch(id_client, person_images)
+
+    matches = [False] * len(person_paths)
+    if face_response.status_code == 200:
+        matches = json.loads(face_response.content)['matches']
+    else:
+        # The crops are kept for the retry
+        retry_unavailable(self, face_response)
+        logger.warning(f"Face detection failed for images: {person_paths}")
+
+    client_paths = []
+    for person_path, same_person in zip(person_paths, matches):
+        if same_person:
+            client_paths.append(person_path)
+        else:
+            os.remove(person_path)
+
+    if not client_paths:
+        return 0
+
+    return replace_task(self, group(
+        identify_person.s(person_path, id_client, dict_of_dict_categories)
+        for person_path in client_paths))
+
+@app.task(bind=True)
+def identify_person(self, person_path, id_client, dict_of_dict_categories):
+    """
+    Extracts, classifies and saves each piece of cloth weared by the client
+    in a person crop already identified by identify_persons. The crop is 
+    kept until the models API gives a definitive answer, see 
+    retry_unavailable.
+
+    Args:
+        person_path (str): The path to the tmp image of the client.
+        id_client (int): The client ID.
+        dict_of_dict_categories (dict): The categories returned by
+            load_categories.
+
+    Returns:
+        int: The number of clothes saved in the DB.
+    """
+    dict_of_categories = {key: list(categories.keys()) for key, categories
+                          in dict_of_dict_categories.items()}
+
+    with open(person_path, 'rb') as person_file:
+        person_bytes = person_file.read()
+
+    # Extract each piece of cloth weared by the client
+    segment_response = image_segmentation(person_bytes)
+
+    if segment_response.status_code != 200:
+        retry_unavailable(self, segment_response)
+        logger.error(f"Segmentation failed, for client ID {id_client}")
+        os.remove(person_path)
+        return 0
+
+    img_segmentations = utils_image.unpack_images(segment_response.content)
+    image_names = [utils_image.generate_image_name() for _ in img_segmentations]
+
+    # Classify every piece of cloth in a single batch
+    classification_response = image_classification_batch(
+        dict_of_categories,
+        img_segmentations,
+        image_names)
+
+    if classification_response.status_code != 200:
+        retry_unavailable(self, classification_response)
+        logger.error(f"Classification failed, for client ID {id_client}")
+        os.remove(person_path)
+        return 0
+
+    data_classifications = json.loads(classification_response.content)['categories']
+
+    # Do not save the clothes already in the client wardrobe
+    new_images = new_clothes(id_client, img_segmentations,
+                             [clothe_key(data_classification, dict_of_dict_categories)
+                              for data_classification in data_classifications])
+
+    # Save each piece of cloth, then insert them all at once
+    image_products = [save_clothe(img_segmentations[index], image_names[index], 
+                                  id_client, data_classifications[index], 
+                                  dict_of_dict_categories, image_hash)
+                      for index, image_hash in new_images]
+    store_clothes(image_products)
+    os.remove(person_path)
+
+    return len(image_products)
+
+def save_clothe(image_bytes, image_name, id_client, data_classification,
+                dict_of_dict_categories, phash=None):
+    """
+    Saves the image of a classified piece of cloth in the client directory
+    and builds its DB entry (path + categories), see store_clothes.
+
+    Args:
+        image_bytes (bytes): The JPEG encoded piece of cloth.
+        image_name (str): The name of the image in the client directory.
+        id_client (int): The client ID.
+        data_classification (dict): The category name found for each
+            ImageProduct foreign key.
+        dict_of_dict_categories (dict): The categories returned by
+            load_categories.
+        phash (int): The perceptual hash of the image, see 
+            utils_image.perceptual_hash.
+
+    Returns:
+        ImageProduct: The image path + categories to save in the DB.
+    """
+    # Save the images in the client directory, the models already
+    # return JPEG bytes, so they are written untouched
+    image_new_path = IMAGE_STORAGE_DIR + '/' + str(id_client) + '/' + image_name
+    with open(image_new_path, 'wb') as image_file:
+        image_file.write(image_bytes)
+
+    image_product = {}
+    image_product['id'] = None
+    image_product['path'] = image_new_path
+    image_product['id_client'] = id_client
+    image_product['phash'] = phash
+
+    for key, value in data_classification.items():
+        image_product[key] = dict_of_dict_categories[key][value]
+
+    return ImageProduct(**image_product)
+
+def store_clothes(image_products):
+    """
+    Saves the pieces of cloth found by a task in the DB, with a single
+    INSERT statement in a single transaction.
+
+    Args:
+        image_products (list[ImageProduct]): The entries built by 
+            save_clothe.
+
+    Returns:
+        list[int]: The IDs of the new ImageProducts.
+    """
+    if not image_products:
+        return []
+
+    with session_scope() as db:
+        return crud.create_image_products(db, image_products)
+
+@app.task(bind=True)
+def extract_garments(self, image_path, id_client, dict_of_dict_categories):
+    """
+    Extracts, classifies and saves the clothes weared by the client in an
+    image with a single call to the models API (MODELS_FUSED_PIPELINE), 
+    retried when the models API is unavailable, see retry_unavailable.
+
+    Args:
+        image_path (str): The path to the image uploaded by the client.
+        id_client (int): The client ID, whose Face ID is resolved by the
+            models API.
+        dict_of_dict_categories (dict): The categories returned by
+            load_categories.
+
+    Returns:
+        int: The number of clothes saved in the DB.
+    """
+    logger.debug(f"Processing image: {image_path}")
+
+    dict_of_categories = {key: list(categories.keys()) for key, categories
+                          in dict_of_dict_categories.items()}
+    data = {'categories_dict': json.dumps(dict_of_categories),
+            'id_client': id_client}
+
+    with open(image_path, "rb") as image_file:
+        files = {"image": (image_path, 
+                           image_file, 
+                           utils_image.get_mime_type(image_path))}
+
+        response = requests.post(f"{MODELS_URI}/extract_garments",
+                                 files=files,
+                                 data=data,
+                                 headers=STREAM_HEADER)
+
+    if response.status_code != 200:
+        retry_unavailable(self, response)
+        logger.warning(f"Garments extraction failed for image: {image_path}")
+        return 0
+
+    garment_images = utils_image.unpack_images(response.content)
+    garment_categories = json.loads(
+        response.headers[utils_image.IMAGE_CATEGORIES_HEADER])
+
+    # Do not store the clothes already in the client wardrobe
+    new_garments = new_clothes(id_client, garment_images,
+                               [clothe_key(categories, dict_of_dict_categories)
+                                for categories in garment_categories])
+    store_clothes([save_clothe(garment_images[index],
+                               utils_image.generate_image_name(),
+                               id_client,
+                               garment_categories[index],
+                               dict_of_dict_categories,
+                               image_hash)
+                   for index, image_hash in new_garments])
+
+    return len(new_garments)
+
+@app.task
+def finalize_identification(id_client, image_paths):
+    """
+    Last step of identify_clothes, executed once every image is processed.
+
+    Args:
+        id_client (int): The client ID.
+        image_paths (list[str]): The tmp images uploaded by the client.
+
+    Returns:
+        bool: True once the tmp images have been removed.
+    """
     # Remove tmp images
-    for image_path in image_paths:
-        os.remove(image_path)
+    remove_files(image_paths)
 
     logger.debug(f"Task completed for client ID: {id_client}")
     #Add function to alert the client by mail
     return True
 
+@app.task
+def cleanup_identification(id_client, image_paths):
+    """
+    Errback of the identify_clothes chord, removes the tmp images uploaded
+    by the client when a task of the chord failed.
+
+    Args:
+        id_client (int): The client ID.
+        image_paths (list[str]): The tmp images uploaded by the client.
+    """
+    remove_files(image_paths)
+    logger.error(f"Clothes identification failed for client ID: {id_client}")
+
+def remove_files(paths):
+    """
+    Removes tmp files, the ones already removed are skipped.
+    """
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
 @app.task
 def get_categories(method, key, filter_field = None, filter_value = None):
     """
@@ -247,7 +713,8 @@ def object_detection(image_path: str, object_type: str):
         object_type (str): The type of object to detect.
 
     Returns:
-        The response of the object detection API call.
+        The response of the object detection API call, with the detected
+        objects as a binary image stream.
     """
     # Set the category to detect
     category_to_detect = {'category_to_detect': object_type}
@@ -261,59 +728,80 @@ def object_detection(image_path: str, object_type: str):
         response = requests.post(f"{MODELS_URI}/object_detection",
                             files=files,
                             data=category_to_detect,
-                            headers=HEADER)
+                            headers=STREAM_HEADER)
     
     # Return the response
     return response
 
 @app.task
-def face_detection(image_b64: str, images_to_search_b64: str):
+def face_detection(id_client: int, images_to_search: bytes):
     """
-    Perform face detection on a base64 encoded image and a set of base64
-    encoded images to search for the face.
+    Searches the Face ID of a client in an encoded image. The models API
+    resolves the Face ID encoding by client ID.
 
     Args:
-        image_b64 (str): The base64 encoded image to detect the face in.
-        images_to_search_b64 (str): The base64 encoded images to search for the
+        id_client (int): The client ID.
+        images_to_search (bytes): The encoded image to search for the
             face in.
 
     Returns:
-        requests.Response: The response from the face detection model.
+        requests.Response: The response from the face detection model, with
+            the matching image as a binary image stream.
     """
-    # Convert the base64 encoded images to bytesIO objects
-    image = utils_image.convert_base64_to_bytesIO(image_b64)
-    images_to_search = utils_image.convert_base64_to_bytesIO(images_to_search_b64)
-
     # Create a dictionary with the image file for the request
-    files = {"image": ('faceid.jpeg',
-                       image,
-                       utils_image.get_mime_type('faceid.jpeg')),
-            "images_to_search" : ('unknown_face.jpeg',
-                                  images_to_search,
-                                  utils_image.get_mime_type(
-                                      'unknown_face.jpeg'))}
+    files = {"images_to_search" : ('unknown_face.jpeg',
+                                   images_to_search,
+                                   utils_image.get_mime_type(
+                                       'unknown_face.jpeg'))}
 
     # Perform the face detection
     response = requests.post(f"{MODELS_URI}/face_detection",
                         files=files,
-                        headers=HEADER)
+                        data={'id_client': id_client},
+                        headers=STREAM_HEADER)
 
     return response
 
 @app.task
-def image_segmentation(image_b64: str):
+def face_detection_batch(id_client: int, images_to_search: list[bytes]):
     """
-    Perform image segmentation on a base64 encoded image, which is
-    passed as a string.
+    Searches the Face ID of a client in a batch of encoded images, in a
+    single call.
 
     Args:
-        image_b64 (str): The base64 encoded image as a string.
+        id_client (int): The client ID.
+        images_to_search (list[bytes]): The encoded images to search for 
+            the face in.
 
     Returns:
-        str: The response from the segmentation model as a string.
+        requests.Response: The response from the face detection model, with
+            whether the face was found in each image.
+    """
+    files = [("images_to_search", ('unknown_face.jpeg',
+                                   image,
+                                   utils_image.get_mime_type(
+                                       'unknown_face.jpeg')))
+             for image in images_to_search]
+
+    response = requests.post(f"{MODELS_URI}/face_detection_batch",
+                        files=files,
+                        data={'id_client': id_client},
+                        headers=HEADER)
+
+    return response
+
+@app.task
+def image_segmentation(image: bytes):
     """
-    image = utils_image.convert_base64_to_bytesIO(image_b64)
+    Perform image segmentation on an encoded image.
+
+    Args:
+        image (bytes): The encoded image.
 
+    Returns:
+        requests.Response: The response from the segmentation model, with
+            the pieces of cloth as a binary image stream.
+    """
     # Create a dictionary with the image file for the request
     files = {"image": ('segmentation.jpeg', 
                        image, 
@@ -322,13 +810,13 @@ def image_segmentation(image_b64: str):
     # Post the image to the segmentation model
     response = requests.post(f"{MODELS_URI}/clothes_segmentation",
                             files=files,
-                            headers=HEADER)
+                            headers=STREAM_HEADER)
 
     # Return the response from the segmentation model
     return response
 
 @app.task
-def image_classification(subcategories, image_b64, file_name):
+def image_classification(subcategories, image, file_name):
     """
     Evaluates the similarity between an image and a dict of subcategory 
     descriptions using CLIP.
@@ -336,13 +824,12 @@ def image_classification(subcategories, image_b64, file_name):
     Args:
         subcategories (dict): A dictionary with subcategory descriptions as
             values.
-        image_b64 (str): The image to classify as a base64 encoded string.
+        image (bytes): The JPEG encoded image to classify.
         file_name (str): The name of the file to send in the request.
 
     Returns:
         response: The response from the API as a requests.Response object.
     """
-    image = utils_image.image_base64_to_buffer(image_b64)
     categories = {'categories_dict': json.dumps(subcategories)}
 
     # Create a tuple with the file name, image buffer, and the MIME type of the 
@@ -359,6 +846,35 @@ def image_classification(subcategories, image_b64, file_name):
     
     return response
 
+@app.task
+def image_classification_batch(subcategories, images, file_names):
+    """
+    Evaluates the similarity between a batch of images and a dict of 
+    subcategory descriptions using CLIP, in a single call.
+
+    Args:
+        subcategories (dict): A dictionary with subcategory descriptions as
+            values.
+        images (list[bytes]): The JPEG encoded images to classify.
+        file_names (list[str]): The name of each file to send in the request.
+
+    Returns:
+        response: The response from the API as a requests.Response object.
+    """
+    categories = {'categories_dict': json.dumps(subcategories)}
+
+    files = [("images", (file_name, 
+                         image, 
+                         utils_image.get_mime_type(file_name)))
+             for image, file_name in zip(images, file_names)]
+
+    response = requests.post(f"{MODELS_URI}/image_classification_batch",
+                        files=files,
+                        data=categories,
+                        headers=HEADER)
+    
+    return response
+
 @app.task
 def get_faceid(client_id):
     header = {"access_token": PG_API_KEY}
@@ -367,6 +883,14 @@ def get_faceid(client_id):
     
     return response
 
+@app.task
+def get_face_encoding(client_id):
+    header = {"access_token": PG_API_KEY}
+    response = requests.get(f"{PG_URI}/get_face_encoding?id_client={client_id}",
+                             headers=header)
+    
+    return response
+
 @app.task
 def get_lat_long(address):
     """
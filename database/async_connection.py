@@ -0,0 +1,54 @@
+from contextlib import asynccontextmanager
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from database.connection import (
+    MeteredQueuePool,
+    export_pool_metrics,
+    SQLALCHEMY_DATABASE_URL,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_APPLICATION_NAME
+)
+
+class MeteredAsyncQueuePool(MeteredQueuePool, AsyncAdaptedQueuePool):
+    """
+    AsyncAdaptedQueuePool measuring the time spent waiting for a connection.
+    """
+    engine_name = "async"
+
+# asyncpg engine, with the same pool settings as the sync one
+async_engine = create_async_engine(
+    f"postgresql+asyncpg://{SQLALCHEMY_DATABASE_URL}",
+    poolclass=MeteredAsyncQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    connect_args={"server_settings": {"application_name": DB_APPLICATION_NAME}})
+
+export_pool_metrics("async", async_engine.pool)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, 
+                                       autoflush=False,
+                                       expire_on_commit=False)
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncSession:
+    """
+    Async variant of connection.session_scope: commits the transaction when
+    the block exits normally, rolls it back on an exception, and always 
+    returns the connection to the pool.
+    """
+    session = AsyncSessionLocal()
+    try:
+        yield session
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
@@ -0,0 +1,202 @@
+"""
+Async variant of the read functions of crud.py, on an AsyncSession, used by
+the DB API when DB_ASYNC is set. The writes stay in crud.py.
+"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import model
+from database.crud import paginate
+
+
+async def get_all(db: AsyncSession, table, skip: int = 0, limit: int = 100):
+    """
+    Retrieves the rows of a reference table with pagination.
+
+    Args:
+        db (AsyncSession): The SQLAlchemy async database session.
+        table: The model of the table (e.g. model.Color).
+        skip (int): The number of records to skip (for pagination).
+        limit (int): The maximum number of records to return.
+
+    Returns:
+        list: A list of model objects.
+    """
+    result = await db.scalars(select(table).offset(skip).limit(limit))
+    return result.all()
+
+
+async def get_article_types_by_categories(db: AsyncSession,
+                                          category_id: int = None,
+                                          skip: int = 0,
+                                          limit: int = 200):
+    """
+    Retrieves the article types of a category with pagination.
+
+    Args:
+        db (AsyncSession): The SQLAlchemy async database session.
+        category_id (int): The ID of the category.
+        skip (int): The number of records to skip (for pagination).
+        limit (int): The maximum number of records to return.
+
+    Returns:
+        list[ArticleType]: A list of ArticleType objects.
+    """
+    result = await db.scalars(
+        select(model.ArticleType
+               ).join(model.SubCategory,
+                      model.SubCategory.id == model.ArticleType.id_subcategory
+               ).filter(model.SubCategory.id_category == category_id
+               ).offset(skip).limit(limit))
+    return result.all()
+
+
+async def get_taxonomy(db: AsyncSession):
+    """
+    Retrieves every reference table used to classify the images.
+
+    Args:
+        db (AsyncSession): The SQLAlchemy async database session.
+
+    Returns:
+        dict: A dictionary with the genders, seasons, colors, usage_types,
+        categories, subcategories and article_types lists.
+    """
+    tables = {
+        'genders': model.Gender,
+        'seasons': model.Season,
+        'colors': model.Color,
+        'usage_types': model.UsageType,
+        'categories': model.Category,
+        'subcategories': model.SubCategory,
+        'article_types': model.ArticleType
+    }
+
+    # A session runs one statement at a time
+    taxonomy = {}
+    for name, table in tables.items():
+        result = await db.scalars(select(table).order_by(table.id))
+        taxonomy[name] = result.all()
+
+    return taxonomy
+
+
+async def get_images(db: AsyncSession, skip: int = 0, limit: int = 100):
+    """
+    Retrieves a list of images from the database with pagination.
+
+    Args:
+        db (AsyncSession): The SQLAlchemy async database session.
+        skip (int): The number of records to skip (for pagination).
+        limit (int): The maximum number of records to return.
+
+    Returns:
+        list[ImageProduct]: A list of ImageProduct objects.
+    """
+    return await get_all(db, model.ImageProduct, skip=skip, limit=limit)
+
+
+def images_and_categories():
+    """
+    Builds the statement selecting the images along with the names of their
+    categories, see get_images_and_categories.
+    """
+    return select(
+                model.ImageProduct.id,
+                model.ImageProduct.path,
+                model.Gender.gender,
+                model.Color.name.label('color'),
+                model.Color.rgb.label('color_rgb'),
+                model.Season.name.label('season'),
+                model.ArticleType.name.label('article'),
+                model.Category.name.label('category'),
+                model.SubCategory.name.label('sub_category'),
+                model.UsageType.name.label('usage_type')
+                ).join(model.Gender,
+                        model.Gender.id == model.ImageProduct.id_gender
+                ).join(model.Color,
+                        model.Color.id == model.ImageProduct.id_color
+                ).join(model.Season,
+                        model.Season.id == model.ImageProduct.id_season
+                ).join(model.ArticleType,
+                        model.ArticleType.id == model.ImageProduct.id_articletype
+                ).join(model.SubCategory,
+                        model.SubCategory.id == model.ArticleType.id_subcategory
+                ).join(model.Category,
+                        model.Category.id == model.SubCategory.id_category
+                ).join(model.UsageType,
+                        model.UsageType.id == model.ImageProduct.id_usagetype)
+
+
+async def get_images_and_categories(db: AsyncSession,
+                                    skip: int = 0, limit: int = 100,
+                                    after_id: int | None = None):
+    """
+    Retrieves images along with their associated categories from the database,
+    ordered by ID.
+
+    Args:
+        db (AsyncSession): The SQLAlchemy async database session.
+        skip (int): The number of records to skip (for pagination).
+        limit (int): The maximum number of records to return.
+        after_id (int | None): Keyset pagination, only the images with a
+            greater ID are returned.
+
+    Returns:
+        list[Row]: A list of rows containing image and category information.
+    """
+    result = await db.execute(paginate(images_and_categories(), 
+                                       skip, limit, after_id))
+    return result.all()
+
+
+async def get_images_from_user(db: AsyncSession, client_id: int,
+                               skip: int = 0, limit: int = 100,
+                               after_id: int | None = None):
+    """
+    Retrieves the images of a client along with their associated categories,
+    ordered by ID.
+
+    Args:
+        db (AsyncSession): The SQLAlchemy async database session.
+        client_id (int): The client ID.
+        skip (int): The number of records to skip (for pagination).
+        limit (int): The maximum number of records to return.
+        after_id (int | None): Keyset pagination, only the images with a
+            greater ID are returned.
+
+    Returns:
+        list[Row]: A list of rows containing image and category information.
+    """
+    result = await db.execute(paginate(
+        images_and_categories().filter(
+            model.ImageProduct.id_client == client_id),
+        skip, limit, after_id))
+    return result.all()
+
+
+async def get_faceid(db: AsyncSession, id_client: int):
+    """
+    Retrieves the FaceID of a client, see crud.get_faceid.
+    """
+    face_id = await db.execute(select(model.Client.face_id).filter(
+        model.Client.id == id_client))
+    face_id = face_id.first()
+    if not face_id:
+        return False
+
+    return face_id[0]
+
+
+async def get_face_encoding(db: AsyncSession, id_client: int):
+    """
+    Retrieves the face encoding of a client FaceID, see
+    crud.get_face_encoding.
+    """
+    db_client = await db.execute(select(model.Client.face_id.isnot(None),
+                                        model.Client.face_encoding).filter(
+        model.Client.id == id_client))
+    db_client = db_client.first()
+    if not db_client or not db_client[0]:
+        return False
+
+    return db_client[1]
@@ -0,0 +1,82 @@
+"""
+Load test of the read endpoints of the DB API: sends requests to
+images_from_client and images_categories from concurrent clients for a fixed
+duration, and reports the requests per second and the latency of each one.
+
+Run it once against the API started with the sync handlers and once with
+DB_ASYNC=true, on the same database, to compare both backends:
+
+    DB_ASYNC=false uvicorn api.api_server_db:app --port 5000
+    DB_ASYNC=true uvicorn api.api_server_db:app --port 5000
+
+Usage:
+    PYTHONPATH=. python -m database.benchmarking.db_api_load.benchmark_db_api_load \
+        --url http://127.0.0.1:5000/dressing_virtuel --client-id 1 \
+        --concurrency 64 --duration 30
+"""
+import argparse
+import asyncio
+import httpx
+import time
+import os
+
+async def worker(client: httpx.AsyncClient, url: str, deadline: float,
+                 latencies: list, errors: list):
+    while time.perf_counter() < deadline:
+        started_at = time.perf_counter()
+        try:
+            response = await client.get(url)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+
+        if response.status_code != 200:
+            errors.append(response.status_code)
+            continue
+        latencies.append(time.perf_counter() - started_at)
+
+async def load(url: str, api_key: str, concurrency: int, duration: float):
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60,
+                                 headers={"access_token": api_key}) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(worker(client, url, deadline, latencies, errors)
+                               for _ in range(concurrency)))
+
+    return latencies, errors
+
+def percentile(values: list, ratio: float) -> float:
+    return values[min(int(len(values) * ratio), len(values) - 1)] * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:5000/dressing_virtuel")
+    parser.add_argument("--api-key", default=os.getenv("PG_API_KEY"))
+    parser.add_argument("--client-id", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=30)
+    args = parser.parse_args()
+
+    endpoints = {
+        "images_from_client": f"{args.url}/images_from_client/"
+                              f"?client_id={args.client_id}&limit={args.limit}",
+        "images_categories": f"{args.url}/images_categories/?limit={args.limit}"
+    }
+
+    print(f"{'endpoint':<22}{'req/s':>10}{'p50 (ms)':>12}{'p99 (ms)':>12}{'errors':>10}")
+    for name, url in endpoints.items():
+        latencies, errors = asyncio.run(load(url, args.api_key,
+                                             args.concurrency, args.duration))
+        latencies.sort()
+        if not latencies:
+            print(f"{name:<22}{'-':>10}{'-':>12}{'-':>12}{len(errors):>10}")
+            continue
+
+        print(f"{name:<22}{len(latencies) / args.duration:>10.1f}"
+              f"{percentile(latencies, 0.5):>12.1f}"
+              f"{percentile(latencies, 0.99):>12.1f}{len(errors):>10}")
+
+if __name__ == "__main__":
+    main()
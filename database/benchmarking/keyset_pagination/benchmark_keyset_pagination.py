@@ -0,0 +1,142 @@
+"""
+Compares the latency of the image listing queries (images_categories and
+images_from_client) paged by offset and by keyset, at increasing page
+positions, on a synthetic table of --rows images spread over --clients
+clients.
+
+The synthetic rows are inserted in a transaction rolled back at the end, so
+the database is left untouched. Apply database/migrations/003 first (or
+create the tables from database/model.py) so the indexes exist. Run it
+against a scratch database: 1M rows take a few hundred MB while the
+transaction is open.
+
+Usage:
+    PYTHONPATH=. python -m database.benchmarking.keyset_pagination.benchmark_keyset_pagination \
+        --rows 1000000 --clients 10
+"""
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from database.connection import engine
+from database import crud
+import argparse
+import time
+
+REFERENCE_TABLES = {
+    "id_usagetype": "INSERT INTO tb_usagetype (name) VALUES ('benchmark') RETURNING id",
+    "id_gender": "INSERT INTO tb_gender (gender) VALUES ('benchmark') RETURNING id",
+    "id_season": "INSERT INTO tb_seasons (name) VALUES ('benchmark') RETURNING id",
+    "id_color": "INSERT INTO tb_colors (name, rgb) VALUES ('benchmark', '0,0,0') RETURNING id",
+}
+
+def fill(db: Session, rows: int, clients: int) -> list[int]:
+    """
+    Inserts the synthetic images, and the reference rows and clients they
+    point to.
+
+    Returns:
+        list[int]: The IDs of the synthetic clients.
+    """
+    ids = {column: db.execute(text(statement)).scalar()
+           for column, statement in REFERENCE_TABLES.items()}
+
+    id_category = db.execute(text(
+        "INSERT INTO tb_productcategories (name) VALUES ('benchmark') RETURNING id"
+    )).scalar()
+    id_subcategory = db.execute(text(
+        "INSERT INTO tb_productsubcategories (name, id_category) "
+        "VALUES ('benchmark', :id_category) RETURNING id"
+    ), {"id_category": id_category}).scalar()
+    ids["id_articletype"] = db.execute(text(
+        "INSERT INTO tb_articletype (name, id_subcategory) "
+        "VALUES ('benchmark', :id_subcategory) RETURNING id"
+    ), {"id_subcategory": id_subcategory}).scalar()
+
+    client_ids = db.execute(text(
+        "INSERT INTO tb_client (email, password) "
+        "SELECT 'benchmark-' || g || '@example.com', '' "
+        "FROM generate_series(1, :clients) g RETURNING id"
+    ), {"clients": clients}).scalars().all()
+
+    db.execute(text(
+        "INSERT INTO tb_imageproduct (path, id_usagetype, id_gender, id_season, "
+        "                             id_color, id_articletype, id_client) "
+        "SELECT 'benchmark/' || g || '.jpeg', :id_usagetype, :id_gender, "
+        "       :id_season, :id_color, :id_articletype, "
+        "       (:client_ids)[1 + g % cardinality(:client_ids)] "
+        "FROM generate_series(1, :rows) g"
+    ), {**ids, "client_ids": client_ids, "rows": rows})
+    db.execute(text("ANALYZE tb_imageproduct"))
+
+    return client_ids
+
+def measure(function, runs: int) -> float:
+    """
+    Returns the median latency of a function, in milliseconds.
+    """
+    latencies = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - started_at)
+
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1000
+
+def id_at(db: Session, depth: int, client_id: int | None = None) -> int | None:
+    """
+    Returns the ID of the image before the page at the given position.
+    """
+    if depth == 0:
+        return None
+
+    statement = "SELECT id FROM tb_imageproduct "
+    if client_id is not None:
+        statement += "WHERE id_client = :client_id "
+    statement += "ORDER BY id OFFSET :offset LIMIT 1"
+
+    return db.execute(text(statement), {"client_id": client_id,
+                                        "offset": depth - 1}).scalar()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        db = Session(bind=connection)
+        try:
+            started_at = time.perf_counter()
+            client_ids = fill(db, args.rows, args.clients)
+            print(f"{args.rows} rows inserted in {time.perf_counter() - started_at:.1f} s\n")
+
+            client_id = client_ids[0]
+            client_rows = args.rows // args.clients
+
+            print(f"{'query':<20}{'position':>10}{'offset (ms)':>14}{'keyset (ms)':>14}")
+            for ratio in (0, 0.01, 0.1, 0.5, 0.9):
+                depth = int(args.rows * ratio)
+                after_id = id_at(db, depth)
+                offset = measure(lambda: crud.get_images_and_categories(
+                    db, skip=depth, limit=args.limit), args.runs)
+                keyset = measure(lambda: crud.get_images_and_categories(
+                    db, limit=args.limit, after_id=after_id), args.runs)
+                print(f"{'images_categories':<20}{depth:>10}{offset:>14.1f}{keyset:>14.1f}")
+
+            for ratio in (0, 0.01, 0.1, 0.5, 0.9):
+                depth = int(client_rows * ratio)
+                after_id = id_at(db, depth, client_id)
+                offset = measure(lambda: crud.get_images_from_user(
+                    db, client_id, skip=depth, limit=args.limit).all(), args.runs)
+                keyset = measure(lambda: crud.get_images_from_user(
+                    db, client_id, limit=args.limit, after_id=after_id).all(), args.runs)
+                print(f"{'images_from_client':<20}{depth:>10}{offset:>14.1f}{keyset:>14.1f}")
+        finally:
+            db.close()
+            transaction.rollback()
+
+if __name__ == "__main__":
+    main()
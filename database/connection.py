@@ -1,5 +1,9 @@
+from contextlib import contextmanager
+from prometheus_client import Gauge, Histogram
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool
+import time
 import os
 
 HOST = os.getenv("PG_DB_HOST")
@@ -11,8 +15,96 @@ PASSWORD = os.getenv("PG_DB_PASSWORD")
 # Construct the database URL for SQLAlchemy
 SQLALCHEMY_DATABASE_URL  = f"{USER}:{PASSWORD}@{HOST}:{PORT}/{DB_NAME}"
 
-# Create an SQLAlchemy engine for PostgreSQL
-engine = create_engine(f"postgresql://{SQLALCHEMY_DATABASE_URL}")
+# Connection pool of the process. Every service (and every Celery worker
+# process) has its own pool, so the Postgres connections used at most are
+# the sum of DB_POOL_SIZE + DB_MAX_OVERFLOW over all the processes.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 5))
+# Seconds to wait for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Seconds after which a connection is replaced, before Postgres or a
+# proxy closes it on its side
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# Test each connection before using it, so a dropped connection is
+# replaced instead of failing the request
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "True").lower() == "true"
+# Shown in pg_stat_activity, to know which service holds the connections
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "dressing_virtuel")
+
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the pool",
+    ["engine"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+)
+POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Connections of the pool", ["engine", "state"]
+)
+
+class MeteredQueuePool(QueuePool):
+    """
+    QueuePool measuring the time spent waiting for a connection.
+    """
+    engine_name = "sync"
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.labels(engine=self.engine_name).observe(
+                time.perf_counter() - started_at)
+
+# Create an SQLAlchemy engine for PostgreSQL, one per process
+engine = create_engine(f"postgresql://{SQLALCHEMY_DATABASE_URL}",
+                       poolclass=MeteredQueuePool,
+                       pool_size=DB_POOL_SIZE,
+                       max_overflow=DB_MAX_OVERFLOW,
+                       pool_timeout=DB_POOL_TIMEOUT,
+                       pool_recycle=DB_POOL_RECYCLE,
+                       pool_pre_ping=DB_POOL_PRE_PING,
+                       connect_args={"application_name": DB_APPLICATION_NAME})
+
+def export_pool_metrics(name: str, pool: QueuePool):
+    """
+    Exports the checked out, idle and overflow connections of a pool.
+    """
+    POOL_CONNECTIONS.labels(engine=name, state="checked_out").set_function(
+        lambda: pool.checkedout())
+    POOL_CONNECTIONS.labels(engine=name, state="idle").set_function(
+        lambda: pool.checkedin())
+    POOL_CONNECTIONS.labels(engine=name, state="overflow").set_function(
+        lambda: max(pool.overflow(), 0))
+
+export_pool_metrics("sync", engine.pool)
 
 # Create a configured "SessionLocal" class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@contextmanager
+def session_scope() -> Session:
+    """
+    Provides a session for a unit of work: the transaction is committed
+    when the block exits normally, rolled back on an exception, and the
+    connection always goes back to the pool.
+
+    Usage:
+        with session_scope() as db:
+            crud.create_image_products(db, image_products)
+    """
+    session = SessionLocal()
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def dispose_engine():
+    """
+    Drops the connections inherited from the parent process, to be called
+    in a forked process (e.g. a Celery worker) before using the database.
+    """
+    engine.dispose(close=False)
@@ -1,3 +1,4 @@
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from database import model
 from schemas import schema
@@ -266,6 +267,31 @@ def get_article_types_by_categories(db: Session,
                            ).filter(model.SubCategory.id_category == category_id
                                     ).offset(skip).limit(limit).all()
 
+def get_taxonomy(db: Session):
+    """
+    Retrieves every reference table used to classify the images.
+
+    Args:
+        db (Session): The SQLAlchemy database session.
+
+    Returns:
+        dict: A dictionary with the genders, seasons, colors, usage_types,
+        categories, subcategories and article_types lists.
+    """
+    return {
+        'genders': db.query(model.Gender).order_by(model.Gender.id).all(),
+        'seasons': db.query(model.Season).order_by(model.Season.id).all(),
+        'colors': db.query(model.Color).order_by(model.Color.id).all(),
+        'usage_types': db.query(model.UsageType).order_by(
+            model.UsageType.id).all(),
+        'categories': db.query(model.Category).order_by(
+            model.Category.id).all(),
+        'subcategories': db.query(model.SubCategory).order_by(
+            model.SubCategory.id).all(),
+        'article_types': db.query(model.ArticleType).order_by(
+            model.ArticleType.id).all()
+    }
+
 def get_images(db: Session, skip: int = 0, limit: int = 100):
     """
     Retrieves a list of images from the database with pagination.
@@ -281,19 +307,24 @@ def get_images(db: Session, skip: int = 0, limit: int = 100):
     return db.query(model.ImageProduct).offset(skip).limit(limit).all()
 
 
-def get_images_and_categories(db: Session, skip: int = 0, limit: int = 100):
+def get_images_and_categories(db: Session, skip: int = 0, limit: int = 100,
+                              after_id: int | None = None):
     """
-    Retrieves images along with their associated categories from the database.
+    Retrieves images along with their associated categories from the database,
+    ordered by ID.
 
     Args:
         db (Session): The SQLAlchemy database session.
         skip (int): The number of records to skip (for pagination).
         limit (int): The maximum number of records to return.
+        after_id (int | None): Keyset pagination, only the images with a
+            greater ID are returned. Unlike skip, the cost of a page doesn't
+            grow with its position.
 
     Returns:
         list[tuple]: A list of tuples containing image and category information.
     """
-    return db.query(
+    query = db.query(
                 model.ImageProduct.id,
                 model.ImageProduct.path,
                 model.Gender.gender,
@@ -317,23 +348,29 @@ def get_images_and_categories(db: Session, skip: int = 0, limit: int = 100):
                 ).join(model.Category, 
                         model.Category.id == model.SubCategory.id_category
                 ).join(model.UsageType, 
-                        model.UsageType.id == model.ImageProduct.id_usagetype
-                ).offset(skip).limit(limit).all()
+                        model.UsageType.id == model.ImageProduct.id_usagetype)
+
+    return paginate(query, skip, limit, after_id).all()
 
 def get_images_from_user(db: Session, client_id: int, 
-                         skip: int = 0, limit: int = 100):
+                         skip: int = 0, limit: int = 100,
+                         after_id: int | None = None):
     """
-    Retrieves images along with their associated categories from the database.
+    Retrieves the images of a client along with their associated categories
+    from the database, ordered by ID.
 
     Args:
         db (Session): The SQLAlchemy database session.
+        client_id (int): The client ID.
         skip (int): The number of records to skip (for pagination).
         limit (int): The maximum number of records to return.
+        after_id (int | None): Keyset pagination, only the images with a
+            greater ID are returned.
 
     Returns:
-        list[tuple]: A list of tuples containing image and category information.
+        Query: The query of the image and category information.
     """
-    return db.query(
+    query = db.query(
                 model.ImageProduct.id,
                 model.ImageProduct.path,
                 model.Gender.gender,
@@ -358,10 +395,31 @@ def get_images_from_user(db: Session, client_id: int,
                         model.Category.id == model.SubCategory.id_category
                 ).join(model.UsageType, 
                         model.UsageType.id == model.ImageProduct.id_usagetype
-                ).join(model.Client,
-                       model.Client.id == model.ImageProduct.id_client
-                ).filter(model.ImageProduct.id_client==client_id
-                         ).offset(skip).limit(limit)
+                ).filter(model.ImageProduct.id_client==client_id)
+
+    return paginate(query, skip, limit, after_id)
+
+def paginate(query, skip: int, limit: int, after_id: int | None):
+    """
+    Pages a query of images in a stable order (by ID), by keyset when 
+    after_id is given, by offset otherwise.
+
+    Args:
+        query: The query or select statement of images.
+        skip (int): The number of records to skip.
+        limit (int): The maximum number of records to return.
+        after_id (int | None): The ID of the last image of the previous page.
+
+    Returns:
+        The paged query or statement.
+    """
+    query = query.order_by(model.ImageProduct.id)
+    if after_id is not None:
+        query = query.filter(model.ImageProduct.id > after_id)
+    if skip:
+        query = query.offset(skip)
+
+    return query.limit(limit)
 
 def create_color(db: Session, color: schema.Color):
     """
@@ -400,7 +458,8 @@ def create_image_product(db: Session,
         id_season=image.id_season,
         id_color=image.id_color,
         id_articletype=image.id_articletype,
-        id_client=image.id_client)
+        id_client=image.id_client,
+        phash=image.phash)
 
     db.add(db_image)
     db.commit()
@@ -408,6 +467,55 @@ def create_image_product(db: Session,
     return db_image
 
 
+def create_image_products(db: Session,
+                          images: list[schema.ImageProduct]) -> list[int]:
+    """
+    Creates several image product entries in a single INSERT statement and
+    transaction.
+
+    Args:
+        db (Session): The SQLAlchemy database session.
+        images (list[schema.ImageProduct]): The ImageProduct schema objects
+            containing the images details.
+
+    Returns:
+        list[int]: The IDs of the created ImageProducts, in the same order
+            as the images.
+    """
+    if not images:
+        return []
+
+    statement = insert(model.ImageProduct).values([
+        image.model_dump(exclude={'id'}) for image in images
+    ]).returning(model.ImageProduct.id)
+
+    ids = db.execute(statement).scalars().all()
+    db.commit()
+    return ids
+
+
+def get_image_hashes(db: Session, id_client: int) -> list[tuple[int, int, int]]:
+    """
+    Retrieves the perceptual hashes of the image products of a client, 
+    along with their article type and color.
+
+    Args:
+        db (Session): The SQLAlchemy database session.
+        id_client (int): The client ID.
+
+    Returns:
+        list[tuple[int, int, int]]: The phash, id_articletype and id_color
+        of each client image.
+    """
+    rows = db.query(model.ImageProduct.phash,
+                    model.ImageProduct.id_articletype,
+                    model.ImageProduct.id_color).filter(
+        model.ImageProduct.id_client == id_client,
+        model.ImageProduct.phash.isnot(None)).all()
+
+    return [tuple(row) for row in rows]
+
+
 def get_email(db: Session, email: str):
     return db.query(model.Client).filter(model.Client.email == email).first()
 
@@ -433,13 +541,15 @@ def client_authentication(db: Session, email: str, password: str):
     return False
 
 
-def update_faceid(db: Session, id_client: int, faceid: str):
+def update_faceid(db: Session, id_client: int, faceid: str, 
+                  face_encoding: bytes | None = None):
     db_client = db.query(model.Client).filter(
         model.Client.id == id_client).first()
     if not db_client:
         return False
 
     db_client.face_id = faceid
+    db_client.face_encoding = face_encoding
     db.commit()
     db.refresh(db_client)
 
@@ -454,6 +564,27 @@ def get_faceid(db: Session, id_client: int):
 
     return db_client[0]
 
+def get_face_encoding(db: Session, id_client: int):
+    """
+    Retrieves the face encoding of a client FaceID, without loading the
+    FaceID image itself.
+
+    Args:
+        db (Session): The SQLAlchemy database session.
+        id_client (int): The client ID.
+
+    Returns:
+        bytes | None: The face encoding, None if it has not been computed
+            yet, or False if the client has no FaceID.
+    """
+    db_client = db.query(model.Client.face_id.isnot(None),
+                         model.Client.face_encoding).filter(
+        model.Client.id == id_client).first()
+    if not db_client or not db_client[0]:
+        return False
+
+    return db_client[1]
+
 def insert_log(db: Session, log: schema.Logger):
     """
     Insert a log entry into the database.
@@ -474,6 +605,27 @@ def insert_log(db: Session, log: schema.Logger):
 
     return True
 
+def insert_logs(db: Session, logs: list[schema.Logger]):
+    """
+    Insert several log entries with a single INSERT statement.
+
+    Args:
+        db (Session): Database session.
+        logs (list[schema.Logger]): Log entries to be inserted.
+
+    Returns:
+        bool: True if inserted successfully.
+    """
+    if not logs:
+        return True
+
+    db.execute(insert(model.LogEntry).values([
+        log.model_dump() for log in logs
+    ]))
+    db.commit()
+
+    return True
+
 def insert_metrics(db: Session, metrics: schema.Metrics):
     db_metrics = model.MetricEntry(
         name=metrics.name,
@@ -0,0 +1,2 @@
+-- 128-d float64 encoding of the client FaceID, computed at upload time
+ALTER TABLE tb_client ADD COLUMN IF NOT EXISTS face_encoding BYTEA;
@@ -0,0 +1,4 @@
+-- 64 bits perceptual hash (dHash) of the garment images, to skip the
+-- near-duplicates of the client wardrobe
+ALTER TABLE tb_imageproduct ADD COLUMN IF NOT EXISTS phash BIGINT;
+CREATE INDEX IF NOT EXISTS ix_imageproduct_client ON tb_imageproduct (id_client);
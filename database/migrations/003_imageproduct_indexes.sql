@@ -0,0 +1,21 @@
+-- Indexes of the image listing queries, see model.ImageProduct.
+-- CONCURRENTLY doesn't lock the table against writes while building, but
+-- can't run inside a transaction: run this file with psql in autocommit.
+
+-- Keyset pagination of the images of a client, replaces the id_client
+-- index of 002
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_imageproduct_client_id
+    ON tb_imageproduct (id_client, id) INCLUDE (phash);
+DROP INDEX CONCURRENTLY IF EXISTS ix_imageproduct_client;
+
+-- Foreign keys
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tb_imageproduct_id_usagetype
+    ON tb_imageproduct (id_usagetype);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tb_imageproduct_id_gender
+    ON tb_imageproduct (id_gender);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tb_imageproduct_id_season
+    ON tb_imageproduct (id_season);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tb_imageproduct_id_color
+    ON tb_imageproduct (id_color);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tb_imageproduct_id_articletype
+    ON tb_imageproduct (id_articletype);
@@ -0,0 +1,6 @@
+-- The garments are only deduplicated against the ones of the same article
+-- type and color, which are read along with the hashes from the index, see
+-- crud.get_image_hashes. Run this file with psql in autocommit, see 003.
+DROP INDEX CONCURRENTLY IF EXISTS ix_imageproduct_client_id;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_imageproduct_client_id
+    ON tb_imageproduct (id_client, id) INCLUDE (phash, id_articletype, id_color);
@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, String, Column, ForeignKey, DateTime
+from sqlalchemy import Integer, BigInteger, String, Column, ForeignKey, DateTime, LargeBinary, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -112,6 +112,8 @@ class Client(Base):
     email = Column(String(255))
     password = Column(String(255))
     face_id = Column(String(1000))
+    # 128-d float64 encoding of the face in face_id
+    face_encoding = Column(LargeBinary)
 
 class ImageProduct(Base):
     """
@@ -130,30 +132,43 @@ class ImageProduct(Base):
         color (Color): Relationship to the Color model.
         id_articletype (int): Foreign key linking to ArticleType.
         article_type (ArticleType): Relationship to the ArticleType model.
+        phash (int): Perceptual hash of the image.
     """
     __tablename__ = 'tb_imageproduct'
+    __table_args__ = (
+        # Keyset pagination of the images of a client (id_client = ? AND
+        # id > ? ORDER BY id), the hashes (with the article type and color
+        # they are compared by) are read from the index only
+        Index("ix_imageproduct_client_id", "id_client", "id",
+              postgresql_include=["phash", "id_articletype", "id_color"]),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     path = Column(String(255))
 
-    id_usagetype = Column(Integer, ForeignKey("tb_usagetype.id"))
+    # The foreign keys are indexed, so updating or deleting a category
+    # doesn't scan every image
+    id_usagetype = Column(Integer, ForeignKey("tb_usagetype.id"), index=True)
     usage_type = relationship("UsageType")
 
-    id_gender = Column(Integer, ForeignKey("tb_gender.id"))
+    id_gender = Column(Integer, ForeignKey("tb_gender.id"), index=True)
     gender = relationship("Gender")
 
-    id_season = Column(Integer, ForeignKey("tb_seasons.id"))
+    id_season = Column(Integer, ForeignKey("tb_seasons.id"), index=True)
     season = relationship("Season")
 
-    id_color = Column(Integer, ForeignKey("tb_colors.id"))
+    id_color = Column(Integer, ForeignKey("tb_colors.id"), index=True)
     color = relationship("Color")
 
-    id_articletype= Column(Integer, ForeignKey("tb_articletype.id"))
+    id_articletype= Column(Integer, ForeignKey("tb_articletype.id"), index=True)
     article_type = relationship("ArticleType")
 
     id_client= Column(Integer, ForeignKey("tb_client.id"))
     client = relationship("Client")
 
+    # Perceptual hash (dHash) of the image, to detect near-duplicates
+    phash = Column(BigInteger)
+
 class LogEntry(Base):
     __tablename__ = "logs"
     id = Column(Integer, primary_key=True, autoincrement=True)
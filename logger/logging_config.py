@@ -1,35 +1,202 @@
 import logging
 from logging.config import dictConfig
 from logging import Handler
-from database.crud import insert_log
-from database.connection import SessionLocal, engine
+from datetime import datetime
+from prometheus_client import Counter
+from database.crud import insert_logs
+from database.connection import session_scope
 from schemas import schema
+import threading
+import queue
+import json
+import time
+import sys
+import os
+
+# Where the records go: "db" (logs table), "json" (one JSON object per line
+# on stdout, or in LOG_JSON_FILE when set), or both, e.g. "db,json"
+LOG_SINKS = [sink.strip() for sink in os.getenv("LOG_SINKS", "db").split(",")
+             if sink.strip()]
+LOG_JSON_FILE = os.getenv("LOG_JSON_FILE")
+
+# The records are written by a background thread, LOG_BATCH_SIZE rows at
+# most per INSERT, at least every LOG_FLUSH_INTERVAL_MS milliseconds
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 100))
+LOG_FLUSH_INTERVAL_MS = int(os.getenv("LOG_FLUSH_INTERVAL_MS", 500))
+# Records waiting to be written, the new ones are dropped when it is full,
+# and the ones below WARNING once it is LOG_QUEUE_HIGH_WATERMARK full
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_QUEUE_HIGH_WATERMARK = float(os.getenv("LOG_QUEUE_HIGH_WATERMARK", 0.8))
+
+DROPPED_RECORDS = Counter(
+    "log_records_dropped_total", "Log records dropped, the log queue being full",
+    ["level"]
+)
 
 class DBLogHandler(Handler):
-    def __init__(self):
+    """
+    Writes the log records in the logs table without blocking the thread
+    logging them: the records are queued and a background thread inserts
+    them by batches.
+    """
+
+    def __init__(self,
+                 batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval_ms: int = LOG_FLUSH_INTERVAL_MS,
+                 queue_size: int = LOG_QUEUE_SIZE):
         super().__init__()
         self.formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        self.session = SessionLocal()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.queue_size = queue_size
+        self.writer_pid = None
+        self.writer_lock = threading.Lock()
+
+    def start_writer(self):
+        """
+        Starts the writer thread of the process. A forked process (e.g. a
+        Celery worker) doesn't inherit the thread of its parent, so it
+        starts its own on its first record.
+        """
+        with self.writer_lock:
+            if self.writer_pid == os.getpid():
+                return
+
+            self.records = queue.Queue(maxsize=self.queue_size)
+            self.writer = threading.Thread(target=self.write_batches,
+                                           args=(self.records,),
+                                           name="db-log-writer",
+                                           daemon=True)
+            self.writer.start()
+            self.writer_pid = os.getpid()
 
     def emit(self, record):
-        formatted_message = self.formatter.format(record)
-
-        log_message = schema.Logger(
-                level=record.levelname,
-                message=formatted_message,
-        )
-        log_entry = insert_log(
-            self.session,
-            log_message
-        )
-    def __del__(self):
-        self.session.close()
+        if self.writer_pid != os.getpid():
+            self.start_writer()
+
+        # Under overload, keep the room left for the warnings and errors
+        if (record.levelno < logging.WARNING and 
+                self.records.qsize() >= self.queue_size * LOG_QUEUE_HIGH_WATERMARK):
+            DROPPED_RECORDS.labels(level=record.levelname).inc()
+            return
+
+        try:
+            log_message = schema.Logger(
+                    level=record.levelname,
+                    message=self.format(record),
+                    created_at=datetime.fromtimestamp(record.created)
+            )
+            self.records.put_nowait(log_message)
+        except queue.Full:
+            DROPPED_RECORDS.labels(level=record.levelname).inc()
+        except Exception:
+            self.handleError(record)
+
+    def write_batches(self, records: queue.Queue):
+        """
+        Writer thread loop: waits for a first record, then collects the
+        following ones until the batch is full or the flush interval has
+        elapsed, and inserts them at once. A None record stops the loop.
+        """
+        stopping = False
+        while not stopping:
+            batch = [records.get()]
+            if batch[0] is None:
+                return
+
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    log_message = records.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if log_message is None:
+                    stopping = True
+                    break
+                batch.append(log_message)
+
+            self.write(batch)
+
+    def write(self, batch: list[schema.Logger]):
+        try:
+            with session_scope() as db:
+                insert_logs(db, batch)
+        except Exception as e:
+            # Logging the failure would queue a new record for the DB
+            sys.stderr.write(f"Failed to write {len(batch)} log records: {e}\n")
+
+    def close(self):
+        """
+        Writes the queued records before closing the handler, called by
+        logging.shutdown at exit.
+        """
+        if self.writer_pid == os.getpid():
+            try:
+                self.records.put(None, timeout=1)
+            except queue.Full:
+                pass
+            self.writer.join(timeout=5)
+            self.writer_pid = None
+
+        super().close()
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single line JSON object.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+# Handlers shared by every logger of the process, see get_log_handlers
+log_handlers = []
+log_handlers_lock = threading.Lock()
+
+def get_log_handlers() -> list[Handler]:
+    """
+    Returns the handlers of the LOG_SINKS, created once per process.
+    """
+    with log_handlers_lock:
+        if not log_handlers:
+            if "db" in LOG_SINKS:
+                log_handlers.append(DBLogHandler())
+            if "json" in LOG_SINKS:
+                json_handler = (logging.FileHandler(LOG_JSON_FILE) if LOG_JSON_FILE
+                                else logging.StreamHandler(sys.stdout))
+                json_handler.setFormatter(JsonFormatter())
+                log_handlers.append(json_handler)
+
+        return log_handlers
 
 def setup_logging(logger_name=__name__, log_level=logging.WARNING):
-    db_handler = DBLogHandler()
-    
+    """
+    Attaches the shared log handlers to a logger. Setting up the same logger
+    again doesn't add them twice.
+
+    Args:
+        logger_name (str): The name of the logger.
+        log_level (int): The level of the logger.
+
+    Returns:
+        logging.Logger: The logger.
+    """
     logger = logging.getLogger(logger_name)
     logger.setLevel(log_level)
-    logger.addHandler(db_handler)
+
+    for handler in get_log_handlers():
+        if handler not in logger.handlers:
+            logger.addHandler(handler)
 
     return logger
@@ -0,0 +1,149 @@
+"""
+Compares the latency and the peak memory of the segmentation and object
+detection models, run as before (as returned by from_pretrained, already in
+eval mode, autograd enabled) and through the shared inference wrapper (eval
+mode, torch.inference_mode). The difference measured is the one of
+torch.inference_mode alone.
+
+Each configuration runs in its own process so the peak memory of one run
+doesn't hide the other.
+
+Usage:
+    PYTHONPATH=. python -m models.benchmarking.inference_mode.benchmark_inference_mode \
+        --image path/to/fullbody.jpg --runs 10
+"""
+from transformers import (
+    AutoModelForSemanticSegmentation,
+    DetrForObjectDetection,
+    DetrImageProcessor,
+    SegformerImageProcessor
+)
+from models import inference
+from PIL import Image
+import multiprocessing
+import threading
+import argparse
+import psutil
+import time
+import torch
+import os
+
+MODELS = {
+    "segmentation": (SegformerImageProcessor,
+                     AutoModelForSemanticSegmentation,
+                     os.getenv("SEGMENTATION_MODEL_NAME", "sayeed99/segformer_b3_clothes")),
+    "object_detection": (DetrImageProcessor,
+                         DetrForObjectDetection,
+                         os.getenv("OBJ_DETECTION_MODEL_NAME", "facebook/detr-resnet-50")),
+}
+
+class PeakMemory:
+    """
+    Samples the resident memory of the process in a background thread and
+    keeps its peak (or the peak CUDA allocation when running on GPU).
+    """
+
+    def __init__(self, device: torch.device, interval: float = 0.005):
+        self.device = device
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self.running = False
+
+    def sample(self):
+        while self.running:
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        if self.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(self.device)
+            self.baseline = torch.cuda.memory_allocated(self.device)
+        else:
+            self.baseline = self.process.memory_info().rss
+            self.running = True
+            self.thread = threading.Thread(target=self.sample, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.device.type == "cuda":
+            self.peak = torch.cuda.max_memory_allocated(self.device)
+        else:
+            self.running = False
+            self.thread.join()
+
+    @property
+    def peak_mb(self) -> float:
+        return (self.peak - self.baseline) / 2**20
+
+def run(model_key: str, optimized: bool, image_path: str, runs: int, results):
+    inference.configure_torch()
+
+    processor_class, model_class, model_name = MODELS[model_key]
+    processor = processor_class.from_pretrained(model_name)
+    model = model_class.from_pretrained(model_name)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    if optimized:
+        inference.prepare_model(model, device)
+    else:
+        # Behaviour of the wrappers before the shared inference helpers:
+        # from_pretrained already returns the model in eval mode
+        model.to(device)
+
+    def forward(inputs):
+        return model(**inputs)
+
+    if optimized:
+        forward = inference.inference_mode(forward)
+
+    image = Image.open(image_path).convert("RGB")
+    inputs = {k: v.to(device) for k, v in
+              processor(images=image, return_tensors="pt").items()}
+
+    # Warm up
+    forward(inputs)
+
+    latencies = []
+    with PeakMemory(device) as memory:
+        for _ in range(runs):
+            started_at = time.perf_counter()
+            outputs = forward(inputs)
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            latencies.append(time.perf_counter() - started_at)
+            del outputs
+
+    latencies.sort()
+    results.put((model_key,
+                 "inference_mode" if optimized else "autograd",
+                 latencies[len(latencies) // 2] * 1000,
+                 memory.peak_mb))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image", required=True)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--models", nargs="+", default=list(MODELS))
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+
+    print(f"{'model':<18}{'mode':<16}{'p50 latency (ms)':>18}{'peak memory (MB)':>18}")
+    for model_key in args.models:
+        for optimized in (False, True):
+            process = context.Process(target=run, args=(model_key,
+                                                        optimized,
+                                                        args.image,
+                                                        args.runs,
+                                                        results))
+            process.start()
+            process.join()
+
+            model_key, mode, latency, peak = results.get()
+            print(f"{model_key:<18}{mode:<16}{latency:>18.1f}{peak:>18.1f}")
+
+if __name__ == "__main__":
+    main()
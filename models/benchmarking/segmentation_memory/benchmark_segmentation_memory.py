@@ -0,0 +1,76 @@
+"""
+Measures the peak memory and the latency of the segmentation post-processing
+(segmentation map and 70% certainty mask) for a photo of the given size:
+the former full resolution path (upsampled logits of every class, argmax,
+softmax and max) against the tiled labels_and_confidence.
+
+Random Segformer-shaped logits are used, so the model is not needed. Each
+path runs in its own process so the peak memory of one run doesn't hide
+the other.
+
+Usage:
+    PYTHONPATH=. python -m models.benchmarking.segmentation_memory.benchmark_segmentation_memory \
+        --size 4000 3000
+"""
+from models.benchmarking.inference_mode.benchmark_inference_mode import PeakMemory
+from models.segmentation.segmentation_model import labels_and_confidence
+import multiprocessing
+import argparse
+import torch.nn as nn
+import time
+import torch
+
+def full_resolution(logits: torch.Tensor, size: tuple[int, int]):
+    # Post-processing of crop_clothes_from_image before the tiled path
+    upsampled_logits = nn.functional.interpolate(
+        logits, size=size, mode="bilinear", align_corners=False)
+    pred_seg = upsampled_logits.argmax(dim=1)[0].cpu().numpy()
+    probabilities = nn.functional.softmax(upsampled_logits, dim=1)
+    certainty_mask = (probabilities.max(dim=1).values > 0.7)
+    return pred_seg, certainty_mask.squeeze().cpu().numpy()
+
+def tiled(logits: torch.Tensor, size: tuple[int, int]):
+    pred_seg, confidence = labels_and_confidence(logits, size)
+    return pred_seg, confidence > 0.7
+
+def run(path: str, size: tuple[int, int], runs: int, results):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    postprocess = {"full_resolution": full_resolution, "tiled": tiled}[path]
+
+    # Segformer logits: 18 classes at a quarter of the 512x512 input
+    logits = torch.randn(1, 18, 128, 128, device=device)
+
+    latencies = []
+    with torch.inference_mode(), PeakMemory(device) as memory:
+        for _ in range(runs):
+            started_at = time.perf_counter()
+            postprocess(logits, size)
+            latencies.append(time.perf_counter() - started_at)
+
+    latencies.sort()
+    results.put((path, latencies[len(latencies) // 2] * 1000, memory.peak_mb))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, nargs=2, default=[4000, 3000],
+                        metavar=("HEIGHT", "WIDTH"))
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+
+    print(f"{'path':<18}{'p50 latency (ms)':>18}{'peak memory (MB)':>18}")
+    for path in ("full_resolution", "tiled"):
+        process = context.Process(target=run, args=(path,
+                                                    tuple(args.size),
+                                                    args.runs,
+                                                    results))
+        process.start()
+        process.join()
+
+        path, latency, peak = results.get()
+        print(f"{path:<18}{latency:>18.1f}{peak:>18.1f}")
+
+if __name__ == "__main__":
+    main()
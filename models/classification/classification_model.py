@@ -1,11 +1,22 @@
 from PIL import Image
 from utils import utils_image
+from utils.utils_cache import LRUCache
+from models import inference
 import open_clip
 import torch
+import os
+
+# Prompts whose text features are kept, the categories being sent by the
+# clients, the least recently used ones are evicted
+TEXT_FEATURES_CACHE_SIZE = int(os.getenv("TEXT_FEATURES_CACHE_SIZE", 4096))
 
 class ClassificationModel():
 
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str,
+                 text_features_cache_size: int = TEXT_FEATURES_CACHE_SIZE):
+        self.model_name = model_name
+        # Normalized text features, by (model name, prompt)
+        self.text_features = LRUCache(max_size=text_features_cache_size)
         (self.model, 
          self.preprocess_train, 
          self.preprocess_val, 
@@ -22,7 +33,7 @@ class ClassificationModel():
 
         # Set the device (GPU if available, otherwise CPU)
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        model.to(device) # Move the model to the selected device
+        inference.prepare_model(model, device)
 
         return model, preprocess_train, preprocess_val, tokenizer, device
 
@@ -40,38 +51,142 @@ class ClassificationModel():
         Returns:
             dict: Dict of subcategories that has the highest similarity score to the image.
         """
-        model = self.model
-        preprocess_val = self.preprocess_val
-        tokenizer = self.tokenizer
-        device = self.device
+        image_bytes = utils_image.convert_base64_to_bytesIO(image_to_classify)
+        return self.classify_image(dict_of_categories, 
+                                   utils_image.open_rgb_image(image_bytes))
 
-        result_dict = {}
-        for key, list_of_cat in dict_of_categories.items():
-            # Preprocess the text descriptions for each subcategory using the tokenizer
-            text_inputs = tokenizer([f"a photo of {c}" for c in 
-                                    list_of_cat]).to(device)
+    def classify_image(self, dict_of_categories: dict, image: Image.Image):
+        """
+        Evaluates the similarity between an image and a dict of 
+        subcategory descriptions using CLIP.
+
+        Args:
+            dict_of_categories (dict): The list of subcategories to match, 
+            for each category.
+            image (Image): The RGB image to classify.
+
+        Returns:
+            dict: Dict of subcategories that has the highest similarity score to the image.
+        """
+        image_features = self.encode_images([image])
+        return self.classify_features(dict_of_categories, image_features)[0]
+
+    def classify_images(self, dict_of_categories: dict, 
+                        images: list[Image.Image],
+                        batch_size: int = 32) -> list[dict]:
+        """
+        Evaluates the similarity between a list of images and a dict of 
+        subcategory descriptions using CLIP, encoding the images by batches.
+
+        Args:
+            dict_of_categories (dict): The list of subcategories to match, 
+            for each category.
+            images (list[Image]): The RGB images to classify.
+            batch_size (int): The maximum number of images encoded at once.
+
+        Returns:
+            list[dict]: For each image, the dict of subcategories that has 
+            the highest similarity score to the image.
+        """
+        results = []
+        for start in range(0, len(images), batch_size):
+            image_features = self.encode_images(images[start:start + batch_size])
+            results.extend(self.classify_features(dict_of_categories, 
+                                                  image_features))
+
+        return results
+
+    @inference.inference_mode
+    def encode_images(self, images: list[Image.Image]) -> torch.Tensor:
+        """
+        Encodes a batch of images with CLIP.
+
+        Args:
+            images (list[Image]): The RGB images to encode.
+
+        Returns:
+            torch.Tensor: The normalized image features, one row per image.
+        """
+        image_input = torch.stack(
+            [self.preprocess_val(image) for image in images]).to(self.device)
 
-            image_bytes = utils_image.convert_base64_to_bytesIO(image_to_classify)
+        image_features = self.model.encode_image(image_input)
 
-            image = Image.open(image_bytes)
-            if image.mode != "RGB":
-                image = image.convert("RBG")
-            image_input = preprocess_val(image).unsqueeze(0).to(device)
+        image_features /= image_features.norm(dim=-1, keepdim=True)
+        return image_features
 
-            # Calculate image and text features
-            with torch.no_grad():
-                image_features = model.encode_image(image_input)
-                text_features = model.encode_text(text_inputs)
+    @inference.inference_mode
+    def get_text_features(self, list_of_cat: list[str]) -> torch.Tensor:
+        """
+        Returns the normalized CLIP features of the "a photo of ..." prompt
+        of each subcategory.
+
+        The features are cached by (model name, prompt) in an LRU cache, 
+        only the prompts missing from the cache are tokenized and encoded.
+
+        Args:
+            list_of_cat (list[str]): The subcategories.
+
+        Returns:
+            torch.Tensor: The normalized text features, one row per subcategory.
+        """
+        prompts = [f"a photo of {c}" for c in list_of_cat]
+
+        # Kept for this call, a cached prompt can be evicted meanwhile
+        features_by_prompt = {prompt: self.text_features.get((self.model_name, prompt))
+                              for prompt in dict.fromkeys(prompts)}
+        missing_prompts = [prompt for prompt, features in features_by_prompt.items()
+                           if features is None]
+
+        if missing_prompts:
+            # Preprocess the text descriptions using the tokenizer
+            text_inputs = self.tokenizer(missing_prompts).to(self.device)
 
-            # Normalize the features
-            image_features /= image_features.norm(dim=-1, keepdim=True)
+            text_features = self.model.encode_text(text_inputs)
             text_features /= text_features.norm(dim=-1, keepdim=True)
 
+            for prompt, features in zip(missing_prompts, text_features):
+                features_by_prompt[prompt] = features
+                self.text_features.set((self.model_name, prompt), features)
+
+        return torch.stack([features_by_prompt[prompt] for prompt in prompts])
+
+    def load_text_features(self, dict_of_categories: dict):
+        """
+        Encodes the prompts of every subcategory ahead of the first request.
+
+        Args:
+            dict_of_categories (dict): The list of subcategories, for each 
+            category.
+        """
+        for list_of_cat in dict_of_categories.values():
+            self.get_text_features(list_of_cat)
+
+    @inference.inference_mode
+    def classify_features(self, dict_of_categories: dict, 
+                          image_features: torch.Tensor) -> list[dict]:
+        """
+        Finds the subcategories that best match already encoded images.
+
+        Args:
+            dict_of_categories (dict): The list of subcategories to match, 
+            for each category.
+            image_features (torch.Tensor): The normalized image features 
+            returned by encode_images.
+
+        Returns:
+            list[dict]: For each image, the dict of subcategories that has 
+            the highest similarity score to the image.
+        """
+        results = [{} for _ in range(len(image_features))]
+        for key, list_of_cat in dict_of_categories.items():
+            text_features = self.get_text_features(list_of_cat)
+
             # Calculate similarity between image and text features
             similarity = (100.0 * image_features @ text_features.T).softmax(dim=-1)
-            values, indices = similarity[0].topk(1) # Get the top 1 matching subcategory
+            indices = similarity.argmax(dim=-1) # Get the top 1 matching subcategory
 
-            result_dict[key] = dict_of_categories[key][indices[0].item()]
+            for result_dict, index in zip(results, indices.tolist()):
+                result_dict[key] = list_of_cat[index]
                 
-        return result_dict # Return the best matching subcategory
-    
\ No newline at end of file
+        return results # Return the best matching subcategories
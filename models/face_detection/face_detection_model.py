@@ -1,34 +1,174 @@
 from PIL import Image
 from utils import utils_image
 import face_recognition
+import numpy as np
+
+# Maximum distance between two encodings of the same face, the default of
+# face_recognition.compare_faces
+FACE_MATCH_TOLERANCE = 0.6
 
 class FaceDetectionModel():
 
     def __init__(self, 
-                 temp_dir: str):
+                 temp_dir: str,
+                 max_side: int = utils_image.MAX_WORKING_SIDE):
         
         self.set_image_temporary_directory(temp_dir)
+        self.set_max_side(max_side)
     
     def set_image_temporary_directory(self, temp_dir):
         self.__temp_dir = temp_dir
 
+    def set_max_side(self, max_side: int):
+        # Longest side of the working copy the faces are searched in
+        self.max_side = max_side
+
     def face_recognition(self, face_id_base64, image_base64):
         face_id = utils_image.convert_base64_to_bytesIO(face_id_base64)
         unknown = utils_image.convert_base64_to_bytesIO(image_base64)
 
-        picture_of_me = face_recognition.load_image_file(face_id)
-        my_face_encoding = face_recognition.face_encodings(picture_of_me)[0]
         response = {"images":''}
+        if self.is_same_person(face_id, unknown):
+            # Return the image as received, without re-encoding it
+            response = {"images": image_base64}
+            
+        return response
+
+    def is_same_person(self, face_id, unknown) -> bool:
+        """
+        Checks whether the first face found in an unknown picture matches the
+        face of the client FaceID.
+
+        Args:
+            face_id (file-like object): The encoded FaceID picture.
+            unknown (file-like object): The encoded picture to search in.
+
+        Returns:
+            bool: True if both faces belong to the same person.
+        """
+        return self.match_face_image(self.encode_face_id(face_id), unknown)
+
+    def encode_face_id(self, face_id):
+        """
+        Computes the encoding of the face of a client FaceID.
+
+        Args:
+            face_id (file-like object): The encoded FaceID picture.
+
+        Returns:
+            numpy.ndarray: The face encoding.
+
+        Raises:
+            IndexError: If no face is found in the picture.
+        """
+        # The picture is only searched, it can be decoded reduced
+        return self.get_face_encoding(
+            utils_image.open_rgb_image(face_id, self.max_side))
+
+    def match_face_image(self, face_encoding, unknown) -> bool:
+        """
+        Checks whether the first face found in an encoded picture matches a
+        known face encoding.
+
+        Args:
+            face_encoding (numpy.ndarray): The known face encoding.
+            unknown (file-like object): The encoded picture to search in.
+
+        Returns:
+            bool: True if both faces belong to the same person.
+        """
+        return self.match_face(face_encoding, 
+                               utils_image.open_rgb_image(unknown, self.max_side))
+
+    def get_face_encoding(self, image: Image.Image):
+        """
+        Computes the 128-d encoding of the first face found in an image,
+        searched in a working copy reduced to max_side.
+
+        Args:
+            image (Image): The RGB image to search the face in.
+
+        Returns:
+            numpy.ndarray: The face encoding.
+
+        Raises:
+            IndexError: If no face is found in the image.
+        """
+        image, _ = utils_image.downscale_image(image, self.max_side)
+        return face_recognition.face_encodings(np.array(image))[0]
+
+    def match_face(self, face_encoding, image: Image.Image) -> bool:
+        """
+        Checks whether the first face found in an image matches a known 
+        face encoding.
+
+        Args:
+            face_encoding (numpy.ndarray): The known face encoding.
+            image (Image): The RGB image to search the face in.
+
+        Returns:
+            bool: True if both faces belong to the same person.
+        """
         try:
-            unknown_picture = face_recognition.load_image_file(unknown)
-            unknown_face_encoding = face_recognition.face_encodings(unknown_picture)[0]
-
-            # Now we can see the two face encodings are of the same person with `compare_faces`!
-            results = face_recognition.compare_faces(
-                unknown_face_encoding, [my_face_encoding])
-            if results[0] == True:
-                response = {"images": utils_image.convert_pil_to_base64(Image.open(unknown))}
+            unknown_face_encoding = self.get_face_encoding(image)
         except IndexError:
             print("I wasn't able to locate any faces in at least one of the images.")
-            
-        return response
\ No newline at end of file
+            return False
+
+        # Now we can see the two face encodings are of the same person with `compare_faces`!
+        results = face_recognition.compare_faces(
+            [face_encoding], unknown_face_encoding)
+
+        return bool(results[0])
+
+    def match_faces(self, face_encoding, images: list[Image.Image]) -> list[bool]:
+        """
+        Checks, for each image of a batch, whether the first face found in
+        it matches a known face encoding. The distances of every face found
+        are computed at once.
+
+        Args:
+            face_encoding (numpy.ndarray): The known face encoding.
+            images (list[Image]): The RGB images to search the face in.
+
+        Returns:
+            list[bool]: For each image, True if its face belongs to the same
+                person, False if it doesn't or no face is found.
+        """
+        candidate_encodings = []
+        candidate_indexes = []
+        for index, image in enumerate(images):
+            try:
+                candidate_encodings.append(self.get_face_encoding(image))
+                candidate_indexes.append(index)
+            except IndexError:
+                continue
+
+        matches = [False] * len(images)
+        if not candidate_encodings:
+            return matches
+
+        distances = face_recognition.face_distance(np.array(candidate_encodings),
+                                                   face_encoding)
+        for index, distance in zip(candidate_indexes, distances):
+            matches[index] = bool(distance <= FACE_MATCH_TOLERANCE)
+
+        return matches
+
+    def match_face_images(self, face_encoding, unknowns) -> list[bool]:
+        """
+        Same as match_faces, for encoded pictures.
+
+        Args:
+            face_encoding (numpy.ndarray): The known face encoding.
+            unknowns (list[file-like object]): The encoded pictures to 
+                search in.
+
+        Returns:
+            list[bool]: For each picture, True if its face belongs to the 
+                same person.
+        """
+        return self.match_faces(
+            face_encoding,
+            [utils_image.open_rgb_image(unknown, self.max_side) 
+             for unknown in unknowns])
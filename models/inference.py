@@ -0,0 +1,58 @@
+from functools import wraps
+import logging
+import torch
+import os
+
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", 0))
+TORCH_NUM_INTEROP_THREADS = int(os.getenv("TORCH_NUM_INTEROP_THREADS", 0))
+
+logger = logging.getLogger(__name__)
+
+def configure_torch():
+    """
+    Applies the PyTorch thread settings of the env config. 0 (the default)
+    keeps the PyTorch defaults.
+
+    Must be called once, before the first model is loaded: the number of
+    inter-op threads can't be changed after the first parallel work.
+    """
+    if TORCH_NUM_THREADS > 0:
+        torch.set_num_threads(TORCH_NUM_THREADS)
+
+    if TORCH_NUM_INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(TORCH_NUM_INTEROP_THREADS)
+        except RuntimeError as e:
+            logger.warning(f"Could not set the inter-op threads: {e}")
+
+    logger.info(f"PyTorch threads: {torch.get_num_threads()} intra-op, "
+                f"{torch.get_num_interop_threads()} inter-op")
+
+def prepare_model(model: torch.nn.Module, device: torch.device) -> torch.nn.Module:
+    """
+    Moves a model to the given device and switches it to evaluation mode,
+    disabling the dropout and the batch norm statistics updates.
+
+    Args:
+        model (torch.nn.Module): The loaded model.
+        device (torch.device): The device to run the inference on.
+
+    Returns:
+        torch.nn.Module: The model, ready for inference.
+    """
+    model.to(device)
+    model.eval()
+    return model
+
+def inference_mode(method):
+    """
+    Decorator running a model method under torch.inference_mode, so no
+    autograd graph is recorded and the activations are freed as soon as
+    they are used.
+    """
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        with torch.inference_mode():
+            return method(*args, **kwargs)
+
+    return wrapper
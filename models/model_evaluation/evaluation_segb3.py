@@ -1,5 +1,5 @@
 from schemas import schema
-from database.connection import SessionLocal, engine
+from database.connection import session_scope
 from database.crud import insert_metrics
 from transformers import SegformerImageProcessor, AutoModelForSemanticSegmentation
 from datasets import load_dataset
@@ -81,10 +81,11 @@ if __name__ == "__main__":
     metrics = evaluate_model()
 
     # Update Prometheus metrics
-    for metric_name, value in metrics.items():
-        schema_metrics = schema.Metrics(
-            name=metric_name,
-            value=str(value)
-        )
+    with session_scope() as db:
+        for metric_name, value in metrics.items():
+            schema_metrics = schema.Metrics(
+                name=metric_name,
+                value=str(value)
+            )
 
-        db_return = insert_metrics(db=SessionLocal(), metrics=schema_metrics)
\ No newline at end of file
+            db_return = insert_metrics(db=db, metrics=schema_metrics)
\ No newline at end of file
@@ -2,16 +2,21 @@ from transformers import DetrImageProcessor, DetrForObjectDetection
 from PIL import Image
 import torch
 from utils import utils_image
+from models import inference
 
 class ObjectDetection:
 
-    def __init__(self, model_name: str, temp_dir: str):
+    def __init__(self, 
+                 model_name: str, 
+                 temp_dir: str,
+                 max_side: int = utils_image.MAX_WORKING_SIDE):
         (
             self.processor,
             self.model,
             self.device
         ) = self.load_model(model_name)
         self.set_image_temporary_directory(temp_dir)
+        self.set_max_side(max_side)
 
     def load_model(self, model_name: str):
         processor = DetrImageProcessor.from_pretrained(model_name, revision="no_timm")
@@ -19,13 +24,17 @@ class ObjectDetection:
 
         # Set the device to GPU if available, otherwise use CPU
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        model.to(device)  # Move the model to the selected device
+        inference.prepare_model(model, device)
 
         return processor, model, device
     
     def set_image_temporary_directory(self, temp_dir):
         self.__temp_dir = temp_dir
 
+    def set_max_side(self, max_side: int):
+        # Longest side of the working copy the detection runs on
+        self.max_side = max_side
+
     def detection(self, image_base64: str, category_to_detect: str):
         """
         Perform object detection on an image.
@@ -41,35 +50,59 @@ class ObjectDetection:
         -------
         A dictionary with a single key "images", which contains a list of base64 encoded images, each containing the detected object.
         """
+        image_buffer = utils_image.convert_base64_to_bytesIO(image_base64)
+        cropped_images = self.detect_objects(
+            utils_image.open_rgb_image(image_buffer), 
+            category_to_detect)
+
+        return_images = [utils_image.convert_pil_to_base64(cropped_image)
+                         for cropped_image in cropped_images]
+
+        response = {"images": return_images}
+        return response
+
+    @inference.inference_mode
+    def detect_objects(self, image: Image.Image, category_to_detect: str):
+        """
+        Perform object detection on an image and crop each detected object.
+
+        The detection runs on a working copy reduced to max_side, the boxes
+        are mapped back to crop the original image.
+
+        Parameters
+        ----------
+        image : Image
+            The RGB image to perform object detection on.
+        category_to_detect : str
+            The category to detect in the image.
+
+        Returns
+        -------
+        A list of PIL images, each containing the detected object.
+        """
         processor = self.processor
         model = self.model
         device = self.device
 
         return_images = []
 
-        image_buffer = utils_image.convert_base64_to_bytesIO(image_base64)
-        image = Image.open(image_buffer)
-
-        if image.mode != "RGB":
-            image = image.convert("RGB")
+        working_image, scale = utils_image.downscale_image(image, self.max_side)
 
-        inputs = processor(images=image, return_tensors="pt")
+        inputs = processor(images=working_image, return_tensors="pt")
         inputs = {k: v.to(device) for k, v in inputs.items()}
         outputs = model(**inputs)
 
         # convert outputs (bounding boxes and class logits) to COCO API
         # let's only keep detections with score > 0.9
-        target_sizes = torch.tensor([image.size[::-1]])
+        target_sizes = torch.tensor([working_image.size[::-1]])
         results = processor.post_process_object_detection(
             outputs, target_sizes=target_sizes, threshold=0.9)[0]
 
         for label, box in zip(results["labels"], results["boxes"]):
             if model.config.id2label[label.item()] != category_to_detect:
                 continue
-            box = [round(i, 2) for i in box.tolist()]
+            box = [round(i, 2) for i in utils_image.scale_box(box.tolist(), scale)]
 
-            cropped_image = image.crop(box)
-            return_images.append(utils_image.convert_pil_to_base64(cropped_image))
+            return_images.append(image.crop(box))
 
-        response = {"images": return_images}
-        return response
\ No newline at end of file
+        return return_images
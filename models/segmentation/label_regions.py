@@ -0,0 +1,56 @@
+import numpy as np
+
+def label_regions(label_map: np.ndarray) -> dict:
+    """
+    Computes the bounding box, the pixel count and the centroid of every
+    label of a segmentation map in a single pass.
+
+    The per-row and per-column histograms of the labels are built with one
+    bincount each, every statistic is then a reduction of those histograms,
+    so the cost no longer depends on the number of labels present.
+
+    Args:
+        label_map (np.ndarray): The (height, width) segmentation map of
+            non-negative integer labels.
+
+    Returns:
+        dict: For each label present in the map, a dictionary with its
+            "bbox" (min_x, min_y, max_x, max_y, bounds included), its pixel
+            "count" and its "centroid" (x, y).
+    """
+    height, width = label_map.shape
+    n_labels = int(label_map.max()) + 1 if label_map.size else 0
+    label_map = label_map.astype(np.int32, copy=False)
+
+    # Histogram of the labels of each row, and of each column
+    row_histogram = np.bincount(
+        (label_map + n_labels * np.arange(height, dtype=np.int32)[:, None]).ravel(),
+        minlength=height * n_labels).reshape(height, n_labels)
+    column_histogram = np.bincount(
+        (label_map + n_labels * np.arange(width, dtype=np.int32)[None, :]).ravel(),
+        minlength=width * n_labels).reshape(width, n_labels)
+
+    counts = row_histogram.sum(axis=0)
+    labels = np.flatnonzero(counts)
+
+    # First and last row (column) where each label appears
+    rows_with_label = row_histogram > 0
+    columns_with_label = column_histogram > 0
+    min_y = rows_with_label.argmax(axis=0)
+    max_y = height - 1 - rows_with_label[::-1].argmax(axis=0)
+    min_x = columns_with_label.argmax(axis=0)
+    max_x = width - 1 - columns_with_label[::-1].argmax(axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroid_y = np.arange(height) @ row_histogram / counts
+        centroid_x = np.arange(width) @ column_histogram / counts
+
+    return {
+        int(label): {
+            "bbox": (int(min_x[label]), int(min_y[label]),
+                     int(max_x[label]), int(max_y[label])),
+            "count": int(counts[label]),
+            "centroid": (float(centroid_x[label]), float(centroid_y[label]))
+        }
+        for label in labels
+    }
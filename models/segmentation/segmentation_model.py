@@ -1,21 +1,95 @@
 from transformers import SegformerImageProcessor, AutoModelForSemanticSegmentation
 from PIL import Image
 from utils import utils_image
+from models import inference
+from models.segmentation.label_regions import label_regions
 import rembg
 import torch.nn as nn
 import torch
 import numpy as np
+import os
+
+# Number of full resolution rows post-processed at once
+SEGMENTATION_TILE_ROWS = int(os.getenv("SEGMENTATION_TILE_ROWS", 256))
+
+# Background removal of the garment crops: "rembg" (U2-Net), "mask" (the
+# Segformer mask of the garment) or "none"
+BACKGROUND_REMOVAL = os.getenv("BACKGROUND_REMOVAL", "rembg")
+REMBG_MODEL_NAME = os.getenv("REMBG_MODEL_NAME", "u2net")
+
+def labels_and_confidence(logits: torch.Tensor, 
+                          size: tuple[int, int],
+                          tile_rows: int = SEGMENTATION_TILE_ROWS):
+    """
+    Computes the segmentation map and the confidence (highest softmax 
+    probability) of each pixel at the given size, without building the
+    upsampled logits and probabilities of every class at full resolution.
+
+    The logits are first upsampled along the width only, at logit height,
+    then the bilinear upsampling along the height is applied by tiles of 
+    rows, each tile being reduced to its labels and confidences right away.
+    The result is the same as an argmax and a softmax on the fully 
+    upsampled logits, but the peak memory is bounded by the tile size.
+
+    Args:
+        logits (torch.Tensor): The (1, classes, height, width) logits.
+        size (tuple[int, int]): The (height, width) to upsample to.
+        tile_rows (int): The number of rows processed at once.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The (height, width) uint8 label map
+            and the float32 confidence map.
+    """
+    height, width = size
+    logits_height = logits.shape[2]
+
+    # Upsample the width only, the height is left untouched
+    logits = nn.functional.interpolate(
+        logits,
+        size=(logits_height, width),
+        mode="bilinear",
+        align_corners=False,
+    )[0]
+
+    # Source rows and weights of the bilinear interpolation along the height,
+    # as computed by interpolate with align_corners=False
+    rows = torch.arange(height, device=logits.device, dtype=torch.float32)
+    source = ((rows + 0.5) * (logits_height / height) - 0.5).clamp(min=0)
+    top = source.floor().long().clamp(max=logits_height - 1)
+    bottom = (top + 1).clamp(max=logits_height - 1)
+    weight = (source - top).view(1, -1, 1)
+
+    label_map = np.empty(size, dtype=np.uint8)
+    confidence = np.empty(size, dtype=np.float32)
+    for start in range(0, height, tile_rows):
+        end = min(start + tile_rows, height)
+        tile_weight = weight[:, start:end]
+        tile = (logits[:, top[start:end]] * (1 - tile_weight) 
+                + logits[:, bottom[start:end]] * tile_weight)
+
+        # max softmax = 1 / sum(exp(logits - max logit))
+        max_logits, labels = tile.max(dim=0)
+        tile_confidence = 1 / (tile - max_logits).exp_().sum(dim=0)
+
+        label_map[start:end] = labels.cpu().numpy()
+        confidence[start:end] = tile_confidence.cpu().numpy()
+
+    return label_map, confidence
 
 class SegmentationModel():
 
     def __init__(self, 
                  model_name: str, 
                  temp_dir: str,
-                 valid_labels: list[int] = [4, 5, 6, 7]):
+                 valid_labels: list[int] = [4, 5, 6, 7],
+                 background_removal: str = BACKGROUND_REMOVAL,
+                 max_side: int = utils_image.MAX_WORKING_SIDE):
         
         self.processor, self.model, self.device = self.load_model(model_name)
         self.set_valid_label(valid_labels)
         self.set_image_temporary_directory(temp_dir)
+        self.set_background_removal(background_removal)
+        self.set_max_side(max_side)
 
     def load_model(self, model_name: str):
         """
@@ -33,7 +107,7 @@ class SegmentationModel():
 
         # Set the device to GPU if available, otherwise use CPU
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        model.to(device)  # Move the model to the selected device
+        inference.prepare_model(model, device)
 
         return processor, model, device
     
@@ -63,50 +137,81 @@ class SegmentationModel():
     def set_image_temporary_directory(self, temp_dir):
         self.__temp_dir = temp_dir
 
-    def clothes_segmentation(self, image_path):
+    def set_max_side(self, max_side: int):
+        # Longest side of the working copy the segmentation runs on
+        self.max_side = max_side
+
+    def set_background_removal(self, background_removal: str):
         """
-        Segments clothing from a given image using a pre-trained semantic segmentation model.
+        Sets how the background of the garment crops is removed, loading the
+        rembg session once if needed.
 
         Args:
-            image_path (str): The file path to the image that will be segmented.
+            background_removal (str): "rembg" to remove it with U2-Net, 
+                "mask" to keep only the pixels of the Segformer mask, "none"
+                to keep the crops untouched.
+        """
+        if background_removal not in ("rembg", "mask", "none"):
+            raise ValueError(f"Unknown background removal: {background_removal}")
+
+        self.background_removal = background_removal
+        self.rembg_session = None
+        if background_removal == "rembg":
+            self.rembg_session = rembg.new_session(REMBG_MODEL_NAME)
+
+    @inference.inference_mode
+    def segment(self, image: Image.Image):
+        """
+        Segments a given image, computing the segmentation map and the 
+        confidence of each pixel by tiles (see labels_and_confidence).
+
+        The segmentation runs on a working copy of the image reduced to
+        max_side, the maps are computed at the working copy size.
+
+        Args:
+            image (Image): The RGB image that will be segmented.
 
         Returns:
-            Tuple[torch.Tensor, AutoModelForSemanticSegmentation]: 
-                - upsampled_logits (torch.Tensor): 
-                The logits after upsampling to the original image size.
+            tuple[np.ndarray, np.ndarray, float]: The label map, the 
+                confidence map and the scale from the maps to the original
+                image coordinates.
         """
-        
-        # Load the image processor and the pre-trained model for semantic segmentation
-        processor = self.processor
-        model = self.model
-        device = self.device
+        working_image, scale = utils_image.downscale_image(image, self.max_side)
 
-        # Open and preprocess the image for the model
-        image = Image.open(image_path)
-        if image.mode != "RGB":
-            image = image.convert("RGB")
+        inputs = self.processor(images=working_image, return_tensors="pt")
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
 
-        inputs = processor(images=image, return_tensors="pt")
+        logits = self.model(**inputs).logits
+        pred_seg, confidence = labels_and_confidence(logits, 
+                                                     working_image.size[::-1])
+        return pred_seg, confidence, scale
 
-        # Move inputs to the same device as the model
-        inputs = {k: v.to(device) for k, v in inputs.items()}
+    def region_mask(self, 
+                    pred_seg: np.ndarray, 
+                    label: int, 
+                    bbox: tuple, 
+                    size: tuple[int, int]) -> Image.Image:
+        """
+        Builds the mask of a label restricted to its bounding box, resized
+        to the size of the matching crop of the original image.
 
-        # Perform inference to obtain logits from the model
-        outputs = model(**inputs)
-        logits = outputs.logits
+        Args:
+            pred_seg (np.ndarray): The segmentation map.
+            label (int): The label of the region.
+            bbox (tuple): The bounding box of the region in the map.
+            size (tuple[int, int]): The size of the crop.
 
-        # Upsample the logits to match the original image size
-        upsampled_logits = nn.functional.interpolate(
-            logits,
-            size=image.size[::-1],  # Reverse the size to (height, width)
-            mode="bilinear",
-            align_corners=False,
-        )
+        Returns:
+            Image: The "L" mode mask, 255 on the pixels of the label.
+        """
+        min_x, min_y, max_x, max_y = bbox
+        binary_mask = (pred_seg[min_y:max_y, min_x:max_x] == label).astype(np.uint8)
 
-        # Close the opened image file to free resources
-        image.close()
+        mask = Image.fromarray(binary_mask * 255)
+        if mask.size != size:
+            mask = mask.resize(size, Image.Resampling.NEAREST)
 
-        return upsampled_logits
+        return mask
 
     def crop_clothes_from_fullbody(self, image_to_segment):
         """
@@ -114,61 +219,70 @@ class SegmentationModel():
         detected clothing items.
 
         Args:
-            image_to_segment (str): The file path to the full-body 
+            image_to_segment (str): The base64 encoded full-body 
             image that will be segmented.
 
         Returns:
-            List[str]: Return a list of paths to the temporary images.
+            dict: A dictionary with a single key "images", which contains a
+            list of base64 encoded images, one for each clothing item.
         """
-        
-        # Set the device to GPU if available, otherwise use CPU
-        device = self.device
-        
-        # Perform segmentation on the input image, returning logits 
         image_to_segment = utils_image.convert_base64_to_bytesIO(image_to_segment)
-        upsampled_logits = self.clothes_segmentation(image_to_segment)
-        upsampled_logits = upsampled_logits.to(device)
+        cropped_images = self.crop_clothes_from_image(
+            utils_image.open_rgb_image(image_to_segment))
 
-        # Obtain the segmentation map by applying argmax to the logits
-        pred_seg = upsampled_logits.argmax(dim=1)[0].cpu().numpy()
+        return_images = [utils_image.convert_pil_to_base64(cropped_image)
+                         for cropped_image in cropped_images]
 
-        # Apply Softmax to normalize probabilities for each class
-        probabilities = nn.functional.softmax(upsampled_logits, dim=1)  
+        response = {"images": return_images}
+        return response 
 
-        # Create a certainty mask for probabilities exceeding 70%
-        certainty_mask = (probabilities.max(dim=1).values > 0.7).to(device)  
-        certainty_mask_np = certainty_mask.squeeze().cpu().numpy()
+    @inference.inference_mode
+    def crop_clothes_from_image(self, image_to_segment):
+        """
+        Segments clothing from a full-body image and crops out the 
+        detected clothing items.
+
+        Args:
+            image_to_segment (Image): The RGB full-body image that will 
+            be segmented.
+
+        Returns:
+            List[Image]: Return a list of PIL images, one for each clothing item.
+        """
+        
+        # Segmentation map and confidence (highest class probability)
+        pred_seg, confidence, scale = self.segment(image_to_segment)
 
         # Filter unique labels in the segmentation map, only where certainty is > 70%
-        unique_labels = np.unique(pred_seg[certainty_mask_np]) 
+        unique_labels = np.unique(pred_seg[confidence > 0.7]) 
 
-        # Open the original image
         return_images = []
-        image = self.remove_background(Image.open(image_to_segment))    
+
+        # Bounding boxes of every label in a single pass
+        regions = label_regions(pred_seg)
 
         for label in unique_labels:
             # Skip labels that are not in the valid_labels list
             if label not in self.__valid_labels:
                 continue
-            
-            # Convert the segmentation map to a binary mask for the target class
-            target_class = label  # Define the class to be extracted
-            binary_mask = (pred_seg == target_class).astype(np.uint8)
 
-            # Find the bounding box of the target segment using non-zero indices of the binary mask
-            non_zero_indices = np.nonzero(binary_mask)
-            
-            # Calculate the bounding box limits (min and max coordinates)
-            min_y, max_y = np.min(non_zero_indices[0]), np.max(non_zero_indices[0])
-            min_x, max_x = np.min(non_zero_indices[1]), np.max(non_zero_indices[1])
+            # Crop the original image using the bounding box limits, 
+            # mapped back to the original coordinates
+            bbox = regions[label]["bbox"]
+            cropped_image = image_to_segment.crop(
+                utils_image.scale_box(bbox, scale))
 
-            # Crop the original image using the calculated bounding box limits
-            cropped_image = image.crop((min_x, min_y, max_x, max_y))
+            # Remove the background of the crop only
+            if self.background_removal == "rembg":
+                cropped_image = self.remove_background(cropped_image)
+            elif self.background_removal == "mask":
+                cropped_image = self.apply_mask(
+                    cropped_image, 
+                    self.region_mask(pred_seg, label, bbox, cropped_image.size))
 
-            return_images.append(utils_image.convert_pil_to_base64(cropped_image))
+            return_images.append(cropped_image)
 
-        response = {"images": return_images}
-        return response 
+        return return_images
 
     def remove_background(self, image: Image):
         """
@@ -181,59 +295,82 @@ class SegmentationModel():
             Image: The image with the background removed.
         """
         input_array = np.array(image)
-        output_array = rembg.remove(input_array, bgcolor=(255, 255, 255, 255))
+        output_array = rembg.remove(input_array, 
+                                    session=self.rembg_session,
+                                    bgcolor=(255, 255, 255, 255))
         return Image.fromarray(output_array)
 
+    def apply_mask(self, image: Image.Image, mask: Image.Image):
+        """
+        Replaces the pixels outside of a mask by a white background, as
+        remove_background does.
+
+        Args:
+            image (Image): The input image.
+            mask (Image): The "L" mode mask of the pixels to keep, of the 
+                image size.
+
+        Returns:
+            Image: The RGBA image with the background removed.
+        """
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        return Image.composite(image.convert("RGBA"), background, mask)
+
     def crop_clothes(self, image_to_segment: str):
         """
         Segments clothing from a single clothe image and crops out the 
         detected clothing.
 
         Args:
-            image_to_segment (str): The file path to the full-body 
+            image_to_segment (str): The base64 encoded single clothe 
             image that will be segmented.
 
         Returns:
-            List[str]: Return a list of paths to the temporary images.
+            dict: A dictionary with a single key "images", which contains a
+            list with the base64 encoded clothing image.
         """
-
         image_to_segment = utils_image.convert_base64_to_bytesIO(image_to_segment)
-        upsampled_logits = self.clothes_segmentation(image_to_segment)
+        cropped_image = self.crop_clothe_from_image(
+            utils_image.open_rgb_image(image_to_segment))
 
-        # Get the segmentation map
-        pred_seg = upsampled_logits.argmax(dim=1)[0].cpu().numpy()
+        response = {"images": [utils_image.convert_pil_to_base64(cropped_image)]}
+        return response
 
-        # Get unique class labels present in the predicted segmentation map
-        unique_labels, counts = np.unique(pred_seg, return_counts=True)
+    @inference.inference_mode
+    def crop_clothe_from_image(self, image_to_segment):
+        """
+        Segments clothing from a single clothe image and crops out the 
+        detected clothing.
 
-        # Create a dictionary to store label counts excluding label 0 (Background)
-        label_counts = {label: count for label, count in 
-                        zip(unique_labels, counts) if label != 0}
+        Args:
+            image_to_segment (Image): The RGB single clothe image that 
+            will be segmented.
 
-        # Get the label with the most values
-        max_label = max(label_counts, key=label_counts.get)
+        Returns:
+            Image: The PIL image of the clothing item.
+        """
+        # Get the segmentation map
+        pred_seg, _, scale = self.segment(image_to_segment)
 
-        # Convert the segmentation map to a binary mask 
-        target_class = max_label
-        binary_mask = (pred_seg == target_class).astype(np.uint8)
+        # Bounding box and pixel count of every label, in a single pass
+        regions = label_regions(pred_seg)
 
-        return_images = []
+        # Get the label with the most values, excluding label 0 (Background)
+        label_counts = {label: region["count"] for label, region 
+                        in regions.items() if label != 0}
+        max_label = max(label_counts, key=label_counts.get)
+        bbox = regions[max_label]["bbox"]
 
-        image = Image.open(image_to_segment)
+        # Crop the original image, the bounding box being mapped back to the 
+        # original coordinates
+        image = image_to_segment.crop(utils_image.scale_box(bbox, scale))
         cropped_image = Image.new("RGBA", image.size)
 
-        # Apply the mask to the original image
-        cropped_image = Image.composite(image.convert("RGBA"), 
-                                        cropped_image, 
-                                        Image.fromarray(binary_mask * 255))
+        # Apply the mask of the label to the crop
+        cropped_image = Image.composite(
+            image.convert("RGBA"), 
+            cropped_image, 
+            self.region_mask(pred_seg, max_label, bbox, image.size))
 
-        # Crop the image to remove excess transparent borders
-        non_zero_indices = np.nonzero(binary_mask)
-        min_y, max_y = np.min(non_zero_indices[0]), np.max(non_zero_indices[0])
-        min_x, max_x = np.min(non_zero_indices[1]), np.max(non_zero_indices[1])
-        cropped_image = cropped_image.crop((min_x, min_y, max_x, max_y))
-
-        return_images.append(utils_image.convert_pil_to_base64(cropped_image))
-
-        response = {"images": return_images}
-        return response 
\ No newline at end of file
+        return cropped_image
+ 
\ No newline at end of file
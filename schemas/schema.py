@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field, model_validator, root_validator
 from typing import List
+from datetime import datetime
 
 class Color(BaseModel):
     """
@@ -99,6 +100,27 @@ class Category(BaseModel):
     name: str
     sub_categories: list[SubCategory] = []
 
+class Taxonomy(BaseModel):
+    """
+    Schema for representing every reference table used to classify the images.
+    
+    Attributes:
+        genders (list[Gender]): All the genders.
+        seasons (list[Season]): All the seasons.
+        colors (list[Color]): All the colors.
+        usage_types (list[UsageType]): All the usage types.
+        categories (list[Category]): All the categories.
+        subcategories (list[SubCategory]): All the subcategories.
+        article_types (list[ArticleType]): All the article types.
+    """
+    genders: list[Gender]
+    seasons: list[Season]
+    colors: list[Color]
+    usage_types: list[UsageType]
+    categories: list[Category]
+    subcategories: list[SubCategory]
+    article_types: list[ArticleType]
+
 class ImageProduct(BaseModel):
     """
     Schema for representing image product information.
@@ -111,6 +133,7 @@ class ImageProduct(BaseModel):
         id_season (int): The unique identifier for the season associated with the image.
         id_color (int): The unique identifier for the color associated with the image.
         id_articletype (int): The unique identifier for the article type of the image.
+        phash (int | None): The perceptual hash of the image. Optional.
     
     Config:
         orm_mode (bool): Enables compatibility with ORM models.
@@ -123,6 +146,7 @@ class ImageProduct(BaseModel):
     id_color: int
     id_articletype: int
     id_client: int
+    phash: int|None = None
 
     class Config:
         orm_mode = True
@@ -192,6 +216,14 @@ class CeleryImageClassification(BaseModel):
     id: int
     images: List[str]
     
+class CeleryTaskResp(BaseModel):
+    task_id: str
+
+class CeleryTaskStatus(BaseModel):
+    task_id: str
+    status: str
+    result: None | bool | int | str = Field(default=None)
+    
 class CelerySuggestion(BaseModel):
     client_id: int
     date: None | str = Field(default=None)
@@ -211,6 +243,7 @@ class CelerySuggestionResp(BaseModel):
 class Logger(BaseModel):
     level: str
     message: str
+    created_at: datetime = Field(default_factory=datetime.now)
 
 class Metrics(BaseModel):
     name: str
@@ -0,0 +1,121 @@
+from unittest import mock
+from PIL import Image, ImageDraw
+from broker import tasks
+from utils import utils_image
+
+SHIRT = 5
+RED = 3
+BLUE = 4
+
+def shirt_image(color):
+    """A shirt of the same shape, whatever its color."""
+    image = Image.new("RGB", (64, 64), "white")
+    ImageDraw.Draw(image).polygon([(8, 8), (56, 8), (48, 56), (16, 56)],
+                                  fill=color)
+    return utils_image.convert_pil_to_bytes(image)
+
+def test_garments_of_different_colors_are_kept():
+    red_shirt = shirt_image((200, 0, 0))
+    blue_shirt = shirt_image((0, 0, 200))
+
+    with mock.patch.object(tasks, "session_scope"), \
+         mock.patch.object(tasks.crud, "get_image_hashes", return_value=[]):
+        new_images = tasks.new_clothes(1, [red_shirt, blue_shirt],
+                                       [(SHIRT, RED), (SHIRT, BLUE)])
+
+    assert [index for index, _ in new_images] == [0, 1]
+    # The hash ignores the colors
+    assert new_images[0][1] == new_images[1][1]
+
+    stored_hashes = [(new_images[0][1], SHIRT, RED)]
+    with mock.patch.object(tasks, "session_scope"), \
+         mock.patch.object(tasks.crud, "get_image_hashes", 
+                           return_value=stored_hashes):
+        new_images = tasks.new_clothes(1, [red_shirt, blue_shirt],
+                                       [(SHIRT, RED), (SHIRT, BLUE)])
+
+    assert [index for index, _ in new_images] == [1]
+
+class Response:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+def test_identify_person_retries_when_unavailable(tmp_path):
+    person_path = tmp_path / "person.jpeg"
+    person_path.write_bytes(shirt_image((200, 0, 0)))
+    crop_exists = []
+
+    def image_segmentation(person_bytes):
+        crop_exists.append(person_path.exists())
+        if len(crop_exists) == 1:
+            return Response(503, headers={"Retry-After": "1"})
+        return Response(400)
+
+    with mock.patch.object(tasks, "image_segmentation", 
+                           side_effect=image_segmentation):
+        result = tasks.identify_person.apply(
+            args=(str(person_path), 1, {}), throw=False).get()
+
+    assert result == 0
+    # The crop is kept for the retry, then removed on the definitive answer
+    assert crop_exists == [True, True]
+    assert not person_path.exists()
+
+def test_identify_person_gives_up_after_max_retries(tmp_path):
+    person_path = tmp_path / "person.jpeg"
+    person_path.write_bytes(shirt_image((200, 0, 0)))
+
+    with mock.patch.object(tasks, "TASK_MAX_RETRIES", 1), \
+         mock.patch.object(tasks, "image_segmentation", 
+                           return_value=Response(503)) as image_segmentation:
+        result = tasks.identify_person.apply(
+            args=(str(person_path), 1, {}), throw=False).get()
+
+    assert result == 0
+    assert image_segmentation.call_count == 2
+    assert not person_path.exists()
+
+def test_identify_clothes_removes_uploads_on_failure(tmp_path):
+    image_path = tmp_path / "upload.jpeg"
+    image_path.write_bytes(shirt_image((200, 0, 0)))
+
+    with mock.patch.object(tasks, "load_categories", return_value={}), \
+         mock.patch.object(tasks, "get_face_encoding", 
+                           return_value=Response(404)):
+        result = tasks.identify_clothes.apply(
+            args=(1, [str(image_path)]), throw=False)
+
+    assert result.failed()
+    assert not image_path.exists()
+
+def test_identify_clothes_chord_cleans_up_on_failure(tmp_path):
+    image_path = tmp_path / "upload.jpeg"
+    image_path.write_bytes(shirt_image((200, 0, 0)))
+
+    with mock.patch.object(tasks, "load_categories", return_value={}), \
+         mock.patch.object(tasks, "get_face_encoding", 
+                           return_value=Response(200)), \
+         mock.patch.object(tasks, "replace_task") as replace_task:
+        tasks.identify_clothes.apply(args=(1, [str(image_path)]))
+
+    workflow = replace_task.call_args.args[1]
+    errbacks = workflow.body.options["link_error"]
+    assert [errback["task"] for errback in errbacks] == \
+        [tasks.cleanup_identification.name]
+    # Replaced by the chord, the uploads are kept for its tasks
+    assert image_path.exists()
+
+def test_extract_garments_retries_when_unavailable(tmp_path):
+    image_path = tmp_path / "upload.jpeg"
+    image_path.write_bytes(shirt_image((200, 0, 0)))
+
+    with mock.patch.object(tasks.requests, "post",
+                           side_effect=[Response(503, headers={"Retry-After": "1"}),
+                                        Response(204)]) as post:
+        result = tasks.extract_garments.apply(
+            args=(str(image_path), 1, {}), throw=False).get()
+
+    assert result == 0
+    assert post.call_count == 2
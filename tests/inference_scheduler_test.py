@@ -0,0 +1,45 @@
+import asyncio
+import threading
+import pytest
+from api.inference_scheduler import InferenceScheduler
+
+def test_cancelled_request_does_not_stop_the_worker():
+    release = threading.Event()
+    batches = []
+
+    def batch_function(batch):
+        batches.append(batch)
+        release.wait(5)
+        return [args[0] for args in batch]
+
+    scheduler = InferenceScheduler("test_cancel", batch_function)
+    first = scheduler.submit(1)
+
+    async def cancelled_request():
+        # Queued behind the first request, cancelled by the timeout
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(scheduler.run(2), 0.05)
+    asyncio.run(cancelled_request())
+
+    release.set()
+    assert first.result(5) == 1
+
+    async def next_request():
+        return await asyncio.wait_for(scheduler.run(3), 5)
+    assert asyncio.run(next_request()) == 3
+
+    # The cancelled request never reached the model
+    assert batches == [[(1,)], [(3,)]]
+    assert all(worker.is_alive() for worker in scheduler.workers)
+
+def test_interrupted_batch_does_not_stop_the_worker():
+    def batch_function(batch):
+        if batch[0][0] == "interrupt":
+            raise KeyboardInterrupt
+        return [args[0] for args in batch]
+
+    scheduler = InferenceScheduler("test_interrupt", batch_function)
+
+    with pytest.raises(RuntimeError):
+        scheduler.submit("interrupt").result(5)
+    assert scheduler.submit("next").result(5) == "next"
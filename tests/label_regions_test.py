@@ -0,0 +1,26 @@
+import numpy as np
+from models.segmentation.label_regions import label_regions
+
+def test_label_regions():
+    label_map = np.zeros((6, 8), dtype=np.uint8)
+    label_map[1:3, 2:5] = 4
+    label_map[5, 7] = 6
+
+    regions = label_regions(label_map)
+
+    assert set(regions) == {0, 4, 6}
+    assert regions[4] == {"bbox": (2, 1, 4, 2), "count": 6, "centroid": (3.0, 1.5)}
+    assert regions[6] == {"bbox": (7, 5, 7, 5), "count": 1, "centroid": (7.0, 5.0)}
+    assert regions[0]["count"] == 6 * 8 - 7
+
+def test_label_regions_matches_nonzero():
+    label_map = np.random.default_rng(0).integers(0, 18, (40, 30)).astype(np.uint8)
+
+    regions = label_regions(label_map)
+
+    for label, region in regions.items():
+        rows, columns = np.nonzero(label_map == label)
+        assert region["bbox"] == (columns.min(), rows.min(),
+                                  columns.max(), rows.max())
+        assert region["count"] == len(rows)
+        assert np.allclose(region["centroid"], (columns.mean(), rows.mean()))
@@ -0,0 +1,64 @@
+import json
+from unittest import mock
+import logging
+from logger import logging_config
+
+def test_db_log_handler_batches():
+    handler = logging_config.DBLogHandler(batch_size=10, flush_interval_ms=50)
+    logger = logging.getLogger("logging_config_test")
+    logger.addHandler(handler)
+
+    with mock.patch.object(logging_config, "session_scope"), \
+         mock.patch.object(logging_config, "insert_logs") as insert_logs:
+        for i in range(25):
+            logger.warning("record %d", i)
+        handler.close()
+    logger.removeHandler(handler)
+
+    batches = [call.args[1] for call in insert_logs.call_args_list]
+    assert all(len(batch) <= 10 for batch in batches)
+    assert [log.message.split(" - ")[-1] for batch in batches for log in batch] == \
+        [f"record {i}" for i in range(25)]
+
+def test_db_log_handler_drops_when_full():
+    handler = logging_config.DBLogHandler(queue_size=2)
+    logger = logging.getLogger("logging_config_test_full")
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    with mock.patch.object(logging_config, "session_scope"), \
+         mock.patch.object(logging_config, "insert_logs") as insert_logs, \
+         mock.patch.object(handler, "write_batches"):
+        for i in range(5):
+            logger.error("record %d", i)
+        logger.info("low priority")
+
+        assert handler.records.qsize() == 2
+        handler.records.queue.clear()
+        handler.close()
+    logger.removeHandler(handler)
+
+def test_setup_logging_shares_handlers():
+    with mock.patch.object(logging_config, "log_handlers", []), \
+         mock.patch.object(logging_config, "LOG_SINKS", ["db", "json"]):
+        logger = logging_config.setup_logging("logging_config_test_setup")
+        logging_config.setup_logging("logging_config_test_setup")
+        other_logger = logging_config.setup_logging("logging_config_test_other")
+
+        assert len(logger.handlers) == 2
+        assert other_logger.handlers == logger.handlers
+
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        other_logger.removeHandler(handler)
+        handler.close()
+
+def test_json_formatter():
+    record = logging.LogRecord("name", logging.ERROR, __file__, 1,
+                               "failed %s", ("task",), None)
+
+    entry = json.loads(logging_config.JsonFormatter().format(record))
+
+    assert entry["level"] == "ERROR"
+    assert entry["logger"] == "name"
+    assert entry["message"] == "failed task"
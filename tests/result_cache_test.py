@@ -0,0 +1,73 @@
+import os
+import pickle
+from api.result_cache import ResultCache
+
+def test_result_cache_disk_tier(tmp_path):
+    cache = ResultCache("test_model", "v1", max_size=1, directory=str(tmp_path))
+    key, value = cache.lookup(b"image", "person")
+    assert value is None
+
+    cache.set(key, [b"crop"])
+    # Evict the entry from the memory tier
+    cache.set(cache.key(b"other"), [])
+
+    assert cache.lookup(b"image", "person") == (key, [b"crop"])
+
+def test_result_cache_versioned_keys():
+    assert (ResultCache("test_model", "v1").key(b"image") 
+            != ResultCache("test_model", "v2").key(b"image"))
+
+def test_result_cache_disabled():
+    cache = ResultCache("test_model", "v1", max_size=0, directory=None)
+
+    assert cache.lookup(b"image") == (None, None)
+    cache.set(None, [b"crop"])
+
+def test_result_cache_corrupt_entry(tmp_path):
+    cache = ResultCache("test_model", "v1", max_size=0, directory=str(tmp_path))
+    key = cache.key(b"image")
+    cache.set(key, [b"crop"])
+
+    # Truncated entry, e.g. written by a process killed before the rename
+    with open(cache.path(key), 'r+b') as cache_file:
+        cache_file.truncate(3)
+
+    assert cache.get(key) is None
+    assert not os.path.exists(cache.path(key))
+
+def test_result_cache_unwritable_directory(tmp_path):
+    directory = tmp_path / "cache"
+    directory.write_bytes(b"")
+    cache = ResultCache("test_model", "v1", max_size=1, directory=str(directory))
+    key = cache.key(b"image")
+
+    cache.set(key, [b"crop"])
+
+    # Still cached in memory
+    assert cache.get(key) == [b"crop"]
+
+def test_result_cache_disk_eviction(tmp_path):
+    entry_size = len(pickle.dumps(b"x" * 100))
+    cache = ResultCache("test_model", "v1", max_size=0, directory=str(tmp_path),
+                        directory_max_bytes=3 * entry_size)
+    keys = [cache.key(str(i)) for i in range(4)]
+    for i, key in enumerate(keys[:3]):
+        cache.set(key, b"x" * 100)
+        os.utime(cache.path(key), (i, i))
+    # The first entry is used again
+    assert cache.get(keys[0]) == b"x" * 100
+
+    # Evicts the least recently used entries, down to 90% of the limit
+    cache.set(keys[3], b"x" * 100)
+
+    assert [cache.get(key) is not None for key in keys] == [True, False, False, True]
+
+def test_result_cache_memory_bytes():
+    entry_size = len(pickle.dumps(b"x" * 100))
+    cache = ResultCache("test_model", "v1", max_size=10, directory=None,
+                        max_bytes=2 * entry_size)
+    keys = [cache.key(str(i)) for i in range(3)]
+    for key in keys:
+        cache.set(key, b"x" * 100)
+
+    assert [cache.get(key) is not None for key in keys] == [False, True, True]
@@ -0,0 +1,33 @@
+import time
+from utils.utils_cache import LRUCache
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    cache.get(1)
+    cache.set(3, "c")
+
+    assert cache.get(1) == "a"
+    assert cache.get(2) is None
+    assert cache.get(3) == "c"
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(ttl=0.01)
+    cache.set(1, "a")
+    time.sleep(0.02)
+
+    assert cache.get(1) is None
+    assert len(cache) == 0
+
+def test_lru_cache_bounded_in_bytes():
+    cache = LRUCache(max_bytes=10)
+    cache.set(1, "a", 4)
+    cache.set(2, "b", 4)
+    cache.set(3, "c", 4)
+    cache.set(4, "d", 11)
+
+    assert cache.get(1) is None
+    assert cache.get(2) == "b"
+    assert cache.get(4) is None
+    assert cache.bytes == 8
@@ -0,0 +1,79 @@
+import json
+import io
+from PIL import Image
+import pytest
+from utils import utils_image
+
+def test_pack_unpack_images():
+    image = utils_image.convert_pil_to_bytes(Image.new("RGB", (8, 8)))
+    images = [image, b"", image[:10]]
+
+    payload = utils_image.pack_images(images)
+
+    assert utils_image.unpack_images(payload) == images
+
+def test_unpack_truncated_images():
+    payload = utils_image.pack_images([b"fake image content"])
+
+    with pytest.raises(ValueError):
+        utils_image.unpack_images(payload[:-1])
+
+def test_images_response_stream():
+    images = [Image.new("RGB", (8, 8)), Image.new("RGBA", (4, 4))]
+
+    response = utils_image.images_response(
+        images, utils_image.IMAGE_STREAM_MEDIA_TYPE)
+
+    assert response.media_type == utils_image.IMAGE_STREAM_MEDIA_TYPE
+    assert len(utils_image.unpack_images(response.body)) == 2
+
+def test_images_response_base64():
+    response = utils_image.images_response([Image.new("RGB", (8, 8))], None)
+
+    assert len(response["images"]) == 1
+
+def test_downscale_image():
+    image = Image.new("RGB", (4000, 3000))
+
+    working_image, scale = utils_image.downscale_image(image, 1000)
+
+    assert working_image.size == (1000, 750)
+    assert utils_image.scale_box((10, 20, 30, 40), scale) == (40, 80, 120, 160)
+    assert utils_image.downscale_image(working_image, 1000) == (working_image, 1.0)
+
+def test_open_rgb_image_reduced():
+    image_bytes = utils_image.convert_pil_to_bytes(Image.new("RGB", (4000, 3000)))
+
+    image = utils_image.open_rgb_image(io.BytesIO(image_bytes), 1000)
+
+    assert image.mode == "RGB"
+    assert image.size == (1000, 750)
+
+def test_perceptual_hash_near_duplicates():
+    image = Image.linear_gradient("L").rotate(30).convert("RGB")
+    copy = utils_image.convert_pil_to_bytes(image.resize((128, 128)), quality=60)
+    other = utils_image.convert_pil_to_bytes(image.transpose(Image.Transpose.FLIP_LEFT_RIGHT))
+
+    image_hash = utils_image.perceptual_hash(io.BytesIO(
+        utils_image.convert_pil_to_bytes(image)))
+
+    assert -2**63 <= image_hash < 2**63
+    assert utils_image.hash_distance(image_hash, 
+        utils_image.perceptual_hash(io.BytesIO(copy))) <= 6
+    assert not utils_image.is_near_duplicate(
+        utils_image.perceptual_hash(io.BytesIO(other)), [image_hash], 6)
+
+def test_classified_images_response_stream():
+    categories = [{"id_color": "Red"}, {"id_color": "Blue"}]
+
+    response = utils_image.classified_images_response(
+        [b"red", b"blue"], categories, utils_image.IMAGE_STREAM_MEDIA_TYPE)
+
+    assert utils_image.unpack_images(response.body) == [b"red", b"blue"]
+    assert json.loads(response.headers[utils_image.IMAGE_CATEGORIES_HEADER]) == categories
+
+def test_classified_images_response_base64():
+    response = utils_image.classified_images_response(
+        [b"red"], [{"id_color": "Red"}], None)
+
+    assert response == {"images": ["cmVk"], "categories": [{"id_color": "Red"}]}
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+import threading
+import time
+
+class LRUCache:
+    """
+    Thread-safe in-process cache keeping the max_size most recently used
+    entries, each entry expiring ttl seconds after it was set. The cache can
+    also be bounded by the total size of its entries, given when they are
+    set.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 0, max_bytes: int = 0):
+        """
+        Args:
+            max_size (int): The maximum number of entries.
+            ttl (float): The lifetime of an entry in seconds, 0 for no
+                expiration.
+            max_bytes (int): The maximum total size of the entries, 0 for
+                no limit.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the value cached for a key, or default if it is missing
+        or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+
+            value, expires_at, size = entry
+            if expires_at and expires_at < time.monotonic():
+                del self.entries[key]
+                self.bytes -= size
+                return default
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, size: int = 0):
+        """
+        Caches a value of a given size (in bytes), evicting the least 
+        recently used entries when the cache is full. A value larger than
+        max_bytes is not cached.
+        """
+        if self.max_bytes and size > self.max_bytes:
+            self.invalidate(key)
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+
+            self.entries[key] = (value, expires_at, size)
+            self.bytes += size
+            while (len(self.entries) > self.max_size or 
+                   (self.max_bytes and self.bytes > self.max_bytes)):
+                _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def invalidate(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[2]
+
+    def __len__(self):
+        return len(self.entries)
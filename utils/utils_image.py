@@ -5,14 +5,29 @@ from fastapi import (
 from PIL import Image
 
 import time
+import struct
 import io
 import zipfile
+import json
 import os
 import base64
 import random
 import string
 import mimetypes
 
+# Binary alternative to the {"images": [base64, ...]} JSON responses
+IMAGE_STREAM_MEDIA_TYPE = "application/x-image-stream"
+# JPEG quality of the images of a stream, which are decoded and cropped 
+# again by the next model before being stored
+IMAGE_STREAM_QUALITY = int(os.getenv("IMAGE_STREAM_QUALITY", 95))
+# Header of a binary stream holding the JSON list of the categories of its
+# images, see classified_images_response
+IMAGE_CATEGORIES_HEADER = "X-Image-Categories"
+
+# Longest side of the images the models run on, 0 to keep the uploads
+# at their original resolution
+MAX_WORKING_SIDE = int(os.getenv("MAX_WORKING_SIDE", 1333))
+
 def zipfiles(filenames):
     timestamp = int(time.time())
     zip_filename = f"identified_objects_{timestamp}.zip"
@@ -78,6 +93,200 @@ def convert_pil_to_base64(image: Image.Image, format: str = 'JPEG') -> str:
     
     return image_base64
 
+def convert_pil_to_bytes(image: Image.Image, format: str = 'JPEG', 
+                         **save_options) -> bytes:
+    if image.mode == 'RGBA':
+        image = image.convert('RGB')
+
+    with io.BytesIO() as buffer:
+        image.save(buffer, format=format, **save_options)
+        image_bytes = buffer.getvalue()
+
+    return image_bytes
+
+def pack_images(images: list[bytes]) -> bytes:
+    """
+    Packs a list of encoded images (JPEG, PNG...) into a single binary
+    payload, each image being prefixed by its length as a 4 bytes big-endian
+    unsigned integer. This is the body of an IMAGE_STREAM_MEDIA_TYPE response.
+
+    Args:
+        images (list[bytes]): The encoded images.
+
+    Returns:
+        bytes: The length-prefixed stream of images.
+    """
+    return b''.join(struct.pack('>I', len(image)) + image for image in images)
+
+def unpack_images(payload: bytes) -> list[bytes]:
+    """
+    Unpacks a binary payload created by pack_images.
+
+    Args:
+        payload (bytes): The length-prefixed stream of images.
+
+    Returns:
+        list[bytes]: The encoded images.
+
+    Raises:
+        ValueError: If the payload is truncated.
+    """
+    images = []
+    offset = 0
+    while offset < len(payload):
+        if offset + 4 > len(payload):
+            raise ValueError("Truncated image stream")
+
+        (length,) = struct.unpack_from('>I', payload, offset)
+        offset += 4
+        if offset + length > len(payload):
+            raise ValueError("Truncated image stream")
+
+        images.append(payload[offset:offset + length])
+        offset += length
+
+    return images
+
+def accepts_image_stream(accept: str | None) -> bool:
+    """
+    Checks whether the Accept header of a request asks for a binary
+    IMAGE_STREAM_MEDIA_TYPE response instead of base64 encoded JSON.
+    """
+    return accept is not None and IMAGE_STREAM_MEDIA_TYPE in accept
+
+def image_stream_response(images: list[bytes]) -> Response:
+    return Response(pack_images(images), media_type=IMAGE_STREAM_MEDIA_TYPE)
+
+def images_response(images: list[Image.Image], accept: str | None):
+    """
+    Builds the response of an endpoint returning a list of images, either as
+    a binary IMAGE_STREAM_MEDIA_TYPE stream or as {"images": [base64, ...]}
+    depending on the Accept header of the request.
+    """
+    if accepts_image_stream(accept):
+        return image_stream_response(
+            [convert_pil_to_bytes(image, quality=IMAGE_STREAM_QUALITY) 
+             for image in images])
+
+    return {"images": [convert_pil_to_base64(image) for image in images]}
+
+def encoded_images_response(images: list[bytes], accept: str | None):
+    """
+    Same as images_response, for already encoded images.
+    """
+    if accepts_image_stream(accept):
+        return image_stream_response(images)
+
+    return {"images": [base64.b64encode(image).decode('utf-8') 
+                       for image in images]}
+
+def classified_images_response(images: list[bytes], categories: list[dict],
+                               accept: str | None):
+    """
+    Same as encoded_images_response, along with the categories of each 
+    image: as the JSON IMAGE_CATEGORIES_HEADER header of a binary stream,
+    or as the "categories" list of the JSON body.
+    """
+    if accepts_image_stream(accept):
+        response = image_stream_response(images)
+        response.headers[IMAGE_CATEGORIES_HEADER] = json.dumps(categories)
+        return response
+
+    return {**encoded_images_response(images, accept), "categories": categories}
+
+def open_rgb_image(image_buffer, max_side: int = 0) -> Image.Image:
+    """
+    Decodes an encoded image (file path or file-like object) as an RGB
+    PIL image, the format expected by every model.
+
+    When max_side is given, the image is reduced to fit in a max_side
+    square, JPEG images being directly decoded at a reduced scale (PIL 
+    draft mode). Only for the images that are not cropped afterwards.
+    """
+    image = Image.open(image_buffer)
+    if max_side:
+        image.draft("RGB", (max_side, max_side))
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    if max_side:
+        image.thumbnail((max_side, max_side))
+
+    return image
+
+def downscale_image(image: Image.Image, 
+                    max_side: int = MAX_WORKING_SIDE) -> tuple[Image.Image, float]:
+    """
+    Reduces an image so that its longest side is at most max_side, to run 
+    the models on a working copy instead of the original upload.
+
+    Args:
+        image (Image): The original image.
+        max_side (int): The longest side of the working copy, 0 to keep the
+            original image.
+
+    Returns:
+        tuple[Image, float]: The working copy (the image itself if it is 
+            small enough) and the scale from the working copy to the 
+            original coordinates.
+    """
+    if not max_side or max(image.size) <= max_side:
+        return image, 1.0
+
+    scale = max(image.size) / max_side
+    size = (max(1, round(image.width / scale)), max(1, round(image.height / scale)))
+    return image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0), scale
+
+def scale_box(box, scale: float) -> tuple:
+    """
+    Maps a (left, top, right, bottom) box of a working copy back to the
+    coordinates of the original image.
+    """
+    return tuple(coordinate * scale for coordinate in box)
+
+def perceptual_hash(image_buffer) -> int:
+    """
+    Computes the 64 bits difference hash (dHash) of an image: the image is
+    reduced to 9x8 gray pixels and each bit tells whether a pixel is 
+    brighter than its left neighbour. Near-duplicate images (burst shots,
+    recompressed or resized copies) get hashes at a small Hamming distance.
+
+    Args:
+        image_buffer: The encoded image (file path or file-like object).
+
+    Returns:
+        int: The hash, as a signed 64 bits integer (PostgreSQL BIGINT).
+    """
+    image = Image.open(image_buffer)
+    # JPEG images are decoded directly at a reduced scale
+    image.draft("L", (64, 64))
+    image = image.convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+
+    pixels = list(image.getdata())
+    image_hash = 0
+    for row in range(8):
+        for column in range(8):
+            left = pixels[row * 9 + column]
+            right = pixels[row * 9 + column + 1]
+            image_hash = (image_hash << 1) | (right > left)
+
+    return int.from_bytes(image_hash.to_bytes(8, 'big'), 'big', signed=True)
+
+def hash_distance(hash_a: int, hash_b: int) -> int:
+    """
+    Returns the Hamming distance between two perceptual hashes.
+    """
+    return bin((hash_a ^ hash_b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+def is_near_duplicate(image_hash: int, hashes, max_distance: int) -> bool:
+    """
+    Checks whether a perceptual hash is at most max_distance bits away from
+    any of the given hashes.
+    """
+    return any(hash_distance(image_hash, other_hash) <= max_distance 
+               for other_hash in hashes)
+
 def image_base64_to_buffer(image_base64):
     image_buffer = convert_base64_to_bytesIO(image_base64)
     image = Image.open(image_buffer)